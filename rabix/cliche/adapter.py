@@ -3,21 +3,27 @@ import json
 import copy
 import operator
 import glob
+import threading
 import six
-import execjs
 
 from six.moves import reduce
-from jsonschema import Draft4Validator
 
 from rabix.cliche.ref_resolver import from_url
-from rabix.cliche.expressions.evaluator import Evaluator
 
 
-ev = Evaluator()
+_evaluator = None
+_evaluator_lock = threading.Lock()
 
 
 def evaluate(lang, expression, job, context, *args, **kwargs):
-    return ev.evaluate(lang, expression, job, context, *args, **kwargs)
+    # the evaluator loads its plugins (and execjs) on first use only
+    global _evaluator
+    with _evaluator_lock:
+        if _evaluator is None:
+            from rabix.cliche.expressions.evaluator import Evaluator
+            _evaluator = Evaluator()
+    return _evaluator.evaluate(lang, expression, job, context, *args,
+                               **kwargs)
 
 
 def intersect_dicts(d1, d2):
@@ -124,6 +130,7 @@ class Argument(object):
 
     @staticmethod
     def _schema_from_opts(options, value):
+        from jsonschema import Draft4Validator
         for opt in options:
             validator = Draft4Validator(opt)
             try:
@@ -162,6 +169,9 @@ class Adapter(object):
                              None)
         return resolved
 
+    def allocated_resources(self, job):
+        return self._resolve_job_resources(job).get('allocatedResources', {})
+
     def cmd_line(self, job):
         job = self._resolve_job_resources(job)
         arg_list, stdin = self._arg_list_and_stdin(job)
@@ -188,7 +198,7 @@ class Adapter(object):
 
     @staticmethod
     def _make_meta(file, adapter, job):
-        meta, result = adapter.get('meta', {}), {}
+        meta, result = dict(adapter.get('meta', {})), {}
         inherit = meta.pop('__inherit__', None)
         if inherit:
             src = job['inputs'].get(inherit)
@@ -4,12 +4,15 @@ import yaml
 import copy
 import hashlib
 import logging
-import collections
-import requests
 import six
 
 from six.moves.urllib import parse as urlparse
 
+try:
+    from collections.abc import Sequence
+except ImportError:
+    from collections import Sequence
+
 log = logging.getLogger(__name__)
 
 
@@ -81,7 +84,8 @@ class Loader(object):
         split = urlparse.urlsplit(url)
         scheme, path = split.scheme, split.path
 
-        if scheme in ['http', 'https'] and requests:
+        if scheme in ['http', 'https']:
+            import requests
             resp = requests.get(url)
             try:
                 resp.raise_for_status()
@@ -91,7 +95,7 @@ class Loader(object):
         elif scheme == 'file':
             try:
                 with open(path) as fp:
-                    result = yaml.load(fp)
+                    result = yaml.safe_load(fp)
             except (OSError, IOError) as e:
                 raise RuntimeError('Failed for %s: %s' % (url, e))
         else:
@@ -122,7 +126,7 @@ def resolve_pointer(document, pointer, default=POINTER_DEFAULT):
     parts = urlparse.unquote(pointer.lstrip('/#')).split('/') \
         if pointer else []
     for part in parts:
-        if isinstance(document, collections.Sequence):
+        if isinstance(document, Sequence):
             try:
                 part = int(part)
             except ValueError:
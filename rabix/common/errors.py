@@ -21,3 +21,9 @@ class ResourceUnavailable(RabixError):
         super(ResourceUnavailable, self).__init__(msg)
         self.__cause__ = cause
         self.uri = uri
+
+
+class JobCancelled(RabixError):
+    def __init__(self, job_id):
+        super(JobCancelled, self).__init__('Job %s was cancelled.' % job_id)
+        self.job_id = job_id
@@ -1,11 +1,21 @@
+import os
 import copy
+import errno
 import signal
 import random
 import itertools
-import collections
 import logging
+import threading
 import six
 
+from multiprocessing.pool import ThreadPool
+from rabix.common.errors import RabixError
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
 log = logging.getLogger(__name__)
 
 
@@ -42,17 +52,17 @@ def update_dict(cfg, new_cfg):
         if '.' in key:
             for k in key.split('.'):
                 if k == key.split('.')[-1]:
-                    if isinstance(val, collections.Mapping):
+                    if isinstance(val, Mapping):
                         t = t.setdefault(k, {})
                         update_dict(t, new_cfg[key])
                     else:
                         t[k] = val
                 else:
-                    if not isinstance(t.get(k), collections.Mapping):
+                    if not isinstance(t.get(k), Mapping):
                         t[k] = {}
                     t = t.setdefault(k, {})
         else:
-            if isinstance(val, collections.Mapping):
+            if isinstance(val, Mapping):
                 t = t.setdefault(key, {})
                 update_dict(t, new_cfg[key])
             else:
@@ -134,3 +144,46 @@ def set_log_level(v_count):
     else:
         level = logging.DEBUG
     logging.root.setLevel(level)
+
+
+def makedirs(path):
+    """
+    Creates path and missing parents, if it does not exist yet.
+    """
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+def run_all(tasks, workers, action='run', cancelled=None, failed=None):
+    """
+    Runs (name, fn) tasks on a pool of up to `workers` threads. After the
+    first failure, or once the `cancelled` event is set, no new task is
+    started. The first failure sets the `failed` event, if given, so
+    running tasks can stop too. Returns (name, error) of the failed tasks.
+    """
+    errors = []
+    if not tasks:
+        return errors
+    failed = failed or threading.Event()
+
+    def run(task):
+        name, fn = task
+        if failed.is_set() or cancelled is not None and cancelled.is_set():
+            return
+        try:
+            fn()
+        except (Exception, RabixError) as e:
+            log.error('Failed to %s %s: %s', action, name, e)
+            errors.append((name, e))
+            failed.set()
+
+    pool = ThreadPool(max(1, min(workers, len(tasks))))
+    try:
+        pool.map(run, tasks, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+    return errors
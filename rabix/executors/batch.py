@@ -0,0 +1,213 @@
+import os
+import sys
+import copy
+import json
+import time
+import uuid
+import logging
+import threading
+import six
+
+from rabix.common.errors import JobCancelled, RabixError, ValidationError
+from rabix.executors.scheduler import scheduler_for
+
+log = logging.getLogger(__name__)
+
+TYPES = {
+    'string': six.string_types,
+    'integer': six.integer_types,
+    'number': six.integer_types + (float,),
+    'boolean': (bool,),
+    'object': (dict,),
+    'array': (list,),
+    'file': (dict,),
+    'directory': (dict,),
+}
+
+
+def read_jobs(fp, base=None):
+    """
+    Jobs of a JSON-lines jobs file as (line number, name, job) triples. A
+    line is either a job, with its inputs under 'inputs' and optionally
+    a name under 'id', or just the inputs of one. Either is laid over a
+    copy of base. A line that is not a JSON object comes with a
+    ValidationError in place of the job. Blank lines are skipped.
+
+    >>> import io
+    >>> [(n, name, job['inputs']) for n, name, job in read_jobs(io.StringIO(
+    ...     u'{"a": 1}\\n\\n{"id": "x", "inputs": {"a": 2}}\\n'))]
+    [(1, '1', {'a': 1}), (3, 'x', {'a': 2})]
+    """
+    for num, line in enumerate(fp, 1):
+        if not line.strip():
+            continue
+        try:
+            doc = json.loads(line)
+            if not isinstance(doc, dict):
+                raise ValueError('Not a JSON object.')
+        except ValueError as e:
+            yield num, str(num), ValidationError('Line %s: %s' % (num, e))
+            continue
+        job = copy.deepcopy(base or {})
+        if 'inputs' in doc:
+            name = six.text_type(doc.pop('id', num))
+            inputs = doc.pop('inputs')
+            job.update(doc)
+        else:
+            name, inputs = str(num), doc
+        job.setdefault('inputs', {}).update(inputs)
+        yield num, name, job
+
+
+def validate_job(tool, job):
+    """
+    Checks the inputs of job against the input schema of tool: required
+    inputs are given, there are no unknown ones and values are of the
+    declared type, files and directories with a path.
+    """
+    schema = tool.get('inputs', {})
+    props = schema.get('properties', {})
+    inputs = job.get('inputs', {})
+    unknown = sorted(set(inputs) - set(props))
+    if unknown:
+        raise ValidationError('Unknown inputs: %s' % ', '.join(unknown))
+    required = set(schema.get('required', [])) | set(
+        k for k, v in six.iteritems(props) if v.get('required'))
+    missing = sorted(k for k in required if inputs.get(k) in (None, []))
+    if missing:
+        raise ValidationError('Missing inputs: %s' % ', '.join(missing))
+    for k, v in six.iteritems(inputs):
+        _validate_value(k, props[k], v)
+
+
+def _validate_value(name, schema, value):
+    if value is None:
+        return
+    kind = schema.get('type')
+    types = TYPES.get(kind)
+    if types and (not isinstance(value, types) or
+                  kind in ('integer', 'number') and
+                  isinstance(value, bool)):
+        raise ValidationError('Input %s is not of type %s.' % (name, kind))
+    if kind in ('file', 'directory') and \
+            not isinstance(value.get('path'), six.string_types):
+        raise ValidationError('Input %s has no path.' % name)
+    if kind == 'array':
+        for item in value:
+            _validate_value(name, schema.get('items', {}), item)
+
+
+class BatchRunner(object):
+    """
+    Runs many jobs of one tool on a single runner, so the tool is resolved
+    and its image checked once. Jobs are validated up front; invalid ones
+    are reported and not run. Valid jobs go to the scheduler, at most
+    `parallel` at a time, each in a job dir named after it under the run
+    dir. A JSON line with the status ('finished', 'failed', 'cancelled'
+    or 'invalid') of each job is written to `results` as it ends.
+    """
+
+    def __init__(self, tool, runner, parallel=None, scheduler=None,
+                 results=None):
+        self.tool = tool
+        self.runner = runner
+        self.parallel = parallel
+        self.scheduler = scheduler
+        self.results = results or sys.stdout
+        self._lock = threading.Lock()
+
+    def install(self):
+        self.runner.install()
+
+    def run_job(self, jobs, job_id=None):
+        """
+        Runs jobs, (line number, name, job) triples as from read_jobs(),
+        and returns the number of jobs per status.
+        """
+        run_dir = os.path.abspath(job_id or str(uuid.uuid4()))
+        if not os.path.isdir(run_dir):
+            os.mkdir(run_dir)
+        scheduler = self.scheduler or scheduler_for(
+            self.runner, self.parallel, run_dir)
+        counts = {}
+        pending, names = [], set()
+        for num, name, job in jobs:
+            error = job if isinstance(job, RabixError) else None
+            if not error and name in names:
+                error = ValidationError('Duplicate job id: %s' % name)
+            if not error and (os.path.basename(name) != name or
+                              name in ('', '.', '..')):
+                error = ValidationError('Bad job id: %s' % name)
+            try:
+                if not error:
+                    validate_job(self.tool, job)
+            except ValidationError as e:
+                error = e
+            names.add(name)
+            if error:
+                self._report(counts, num, name, None, 'invalid', error=error)
+            else:
+                pending.append((num, name, job))
+        parallel = self.parallel or len(pending)
+        running = set()
+        cond = threading.Condition()
+
+        def submit():
+            while pending and len(running) < parallel:
+                num, name, job = pending.pop(0)
+                job_dir = os.path.join(run_dir, name)
+                try:
+                    task = scheduler.submit(
+                        self.runner, job, job_id=job_dir,
+                        callback=lambda task, num=num, name=name:
+                        finished(num, name, task))
+                except (Exception, RabixError) as e:
+                    self._report(counts, num, name, job_dir, 'failed',
+                                 error=e)
+                    continue
+                running.add(task)
+
+        def finished(num, name, task):
+            if task.error is None:
+                status = 'finished'
+            elif isinstance(task.error, JobCancelled):
+                status = 'cancelled'
+            else:
+                status = 'failed'
+            self._report(counts, num, name, task.job_id, status,
+                         outputs=task.result, error=task.error,
+                         runtime=task.started and
+                         task.finished - task.started)
+            with cond:
+                running.discard(task)
+                submit()
+                cond.notify_all()
+
+        try:
+            with cond:
+                submit()
+                while running:
+                    cond.wait()
+        finally:
+            if not self.scheduler:
+                scheduler.shutdown(wait=False)
+        return counts
+
+    def _report(self, counts, num, name, job_dir, status, outputs=None,
+                error=None, runtime=None):
+        if error is not None:
+            log.warning('Job %s (line %s) %s: %s', name, num, status, error)
+        record = {'line': num, 'id': name, 'job_dir': job_dir,
+                  'status': status}
+        if outputs is not None:
+            record['outputs'] = outputs
+        if error is not None:
+            record['error'] = six.text_type(error)
+            record['exit_code'] = getattr(error, 'exit_code', None)
+        if runtime is not None:
+            record['runtime'] = round(runtime, 3)
+        record['time'] = time.time()
+        with self._lock:
+            counts[status] = counts.get(status, 0) + 1
+            self.results.write(json.dumps(record, sort_keys=True) + '\n')
+            self.results.flush()
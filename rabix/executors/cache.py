@@ -0,0 +1,211 @@
+import os
+import json
+import fcntl
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+import subprocess
+import requests
+
+from contextlib import contextmanager
+from rabix.common.util import makedirs
+
+log = logging.getLogger(__name__)
+
+
+def file_digest(path, method='sha1', chunk_size=4 * 1024 * 1024):
+    digest = hashlib.new(method)
+    with open(path, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def place(src, dest):
+    """
+    Makes src available at dest as a hard link, a reflink (copy-on-write
+    clone) or, failing both, a copy.
+    """
+    try:
+        os.link(src, dest)
+        return
+    except OSError:
+        pass
+    clone(src, dest)
+
+
+def clone(src, dest):
+    """
+    Copies src to dest as a reflink (copy-on-write clone) or, failing
+    that, byte for byte. Unlike a hard link, dest is a file of its own.
+    """
+    with open(os.devnull, 'w') as devnull:
+        if subprocess.call(['cp', '--reflink=always', src, dest],
+                           stderr=devnull) == 0:
+            return
+    shutil.copyfile(src, dest)
+
+
+class InputCache(object):
+    """
+    Host-wide cache of remote inputs, shared by all jobs and processes.
+
+    Content is stored once per sha1 under <root>/blobs. Each URL has an
+    entry under <root>/urls recording its blob, ETag and size, which are
+    checked against a HEAD request before the blob is reused. Downloads
+    of one URL are serialized with a file lock, so concurrent jobs wait for
+    the first one instead of downloading again. Blobs are placed into task
+    dirs by hard link or reflink. When max_size (MB) is set, the least
+    recently used blobs are evicted.
+    """
+
+    def __init__(self, root=None, max_size=None, session=None):
+        if not root:
+            from xdg.BaseDirectory import save_cache_path
+            root = save_cache_path('rabix', 'inputs')
+        self.root = os.path.abspath(root)
+        self.max_size = max_size
+        self.session = session or requests.Session()
+        for d in ('blobs', 'urls', 'locks', 'tmp'):
+            makedirs(os.path.join(self.root, d))
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0,
+                       'bytes_downloaded': 0, 'bytes_served': 0}
+
+    def fetch(self, url, dest, download):
+        """
+        Places the content of url at dest. On a miss download(url, path) is
+        called to write it to path first.
+        """
+        with self._locked(url):
+            entry = self._entry(url)
+            if entry and self._valid(url, entry):
+                self._count('hits')
+                log.info('Cache hit for %s', url)
+            else:
+                self._count('misses')
+                entry = self._store(url, download)
+            try:
+                os.utime(self._blob(entry['sha1']), None)
+            except OSError:
+                log.debug('%s evicted meanwhile, downloading again', url)
+                entry = self._store(url, download)
+            place(self._blob(entry['sha1']), dest)
+        self._count('bytes_served', entry['size'])
+        self.evict()
+        return entry
+
+    def stats(self):
+        blobs = self._blobs()
+        with self._lock:
+            stats = dict(self._stats)
+        stats['entries'] = len(blobs)
+        stats['size'] = sum(size for _, size, _ in blobs)
+        return stats
+
+    def evict(self):
+        if not self.max_size:
+            return
+        limit = self.max_size * 1024 * 1024
+        blobs = sorted(self._blobs(), key=lambda b: b[2])
+        total = sum(size for _, size, _ in blobs)
+        for path, size, _ in blobs:
+            if total <= limit:
+                break
+            log.debug('Evicting %s from input cache', path)
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            self._count('evictions')
+
+    def _store(self, url, download):
+        fd, tmp = tempfile.mkstemp(dir=os.path.join(self.root, 'tmp'))
+        os.close(fd)
+        try:
+            headers = self._head(url)
+            download(url, tmp)
+            sha1 = file_digest(tmp)
+            size = os.path.getsize(tmp)
+            blob = self._blob(sha1)
+            if os.path.exists(blob):
+                os.remove(tmp)
+            else:
+                os.chmod(tmp, 0o444)
+                os.rename(tmp, blob)
+        except:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        self._count('bytes_downloaded', size)
+        entry = {'url': url, 'sha1': sha1, 'size': size,
+                 'etag': headers.get('ETag')}
+        path = self._entry_path(url)
+        with open(path + '.tmp', 'w') as fp:
+            json.dump(entry, fp)
+        os.rename(path + '.tmp', path)
+        return entry
+
+    def _valid(self, url, entry):
+        if not os.path.exists(self._blob(entry['sha1'])):
+            return False
+        try:
+            headers = self._head(url)
+        except requests.RequestException as e:
+            log.warning('Unable to validate cached %s: %s', url, e)
+            return True
+        etag, size = headers.get('ETag'), headers.get('Content-Length')
+        if etag and entry.get('etag') and etag != entry['etag']:
+            return False
+        if size is not None and int(size) != entry['size']:
+            return False
+        return True
+
+    def _head(self, url):
+        r = self.session.head(url, allow_redirects=True)
+        if not r.ok:
+            return {}
+        return r.headers
+
+    def _entry(self, url):
+        try:
+            with open(self._entry_path(url)) as fp:
+                return json.load(fp)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def _entry_path(self, url):
+        key = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.root, 'urls', key + '.json')
+
+    def _blob(self, sha1):
+        return os.path.join(self.root, 'blobs', sha1)
+
+    def _blobs(self):
+        blob_dir = os.path.join(self.root, 'blobs')
+        result = []
+        for name in os.listdir(blob_dir):
+            try:
+                st = os.stat(os.path.join(blob_dir, name))
+            except OSError:
+                continue
+            result.append((os.path.join(blob_dir, name), st.st_size,
+                           st.st_mtime))
+        return result
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self._stats[key] += n
+
+    @contextmanager
+    def _locked(self, url):
+        key = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        with open(os.path.join(self.root, 'locks', key), 'w') as fp:
+            fcntl.flock(fp, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fp, fcntl.LOCK_UN)
@@ -0,0 +1,181 @@
+import os
+import json
+import uuid
+import logging
+import six
+
+from rabix.cliche.ref_resolver import loader
+from rabix.common.util import makedirs
+from rabix.executors.cache import clone, file_digest, place
+from rabix.executors.io import MetaCache, is_pipe, is_remote, output_files, \
+    secondary_file
+
+log = logging.getLogger(__name__)
+
+file_hashes = MetaCache()
+
+
+def content_hash(path):
+    """
+    sha1 of a file, or of the names and hashes of the files under a
+    directory, computed once per size and mtime.
+    """
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    if is_pipe(path):
+        raise IOError('%s is a named pipe' % path)
+    if os.path.isdir(path):
+        return loader.checksum(dict(
+            (name, content_hash(os.path.join(path, name)))
+            for name in sorted(os.listdir(path))))
+    return file_hashes.get((path, st.st_size, st.st_mtime),
+                           lambda: (file_digest(path), True))
+
+
+class CallCache(object):
+    """
+    Outputs of finished jobs, keyed by the checksum of the tool, its
+    container image id and the inputs: the content hash of input files
+    and their secondary files, their metadata and all other parameters.
+    Remote inputs are keyed by URL and the 'checksum' given in the job
+    or, without one, the ETag or Last-Modified date the server reports;
+    a job with a remote input the server reports neither for is not
+    cached. Output files are copied by content to read-only blobs under
+    <root>/blobs and linked into the job dir on a hit. A blob that no
+    longer matches its sha1 is a miss.
+    """
+
+    def __init__(self, root=None):
+        if not root:
+            from xdg.BaseDirectory import save_cache_path
+            root = save_cache_path('rabix', 'calls')
+        self.root = os.path.abspath(root)
+        for d in ('blobs', 'calls'):
+            makedirs(os.path.join(self.root, d))
+
+    def key(self, tool, job):
+        schema = tool.get('inputs', {}).get('properties', {})
+        inputs = dict((k, self._input_key(v, schema.get(k) or {}))
+                      for k, v in six.iteritems(job.get('inputs', {})))
+        image = tool.get('requirements', {}).get('environment', {}).get(
+            'container', {}).get('imageId')
+        return loader.checksum({'tool': loader.checksum(tool),
+                                'image': image, 'inputs': inputs})
+
+    def get(self, key, job_dir):
+        """
+        Places the cached outputs for key in job_dir and returns them, or
+        None on a miss.
+        """
+        try:
+            with open(self._call_path(key)) as fp:
+                entry = json.load(fp)
+        except (IOError, OSError, ValueError):
+            return None
+        outputs = entry['outputs']
+        files = list(output_files(outputs))
+        if not all(os.path.exists(self._blob(f['sha1'])) for f in files):
+            log.warning('Cached outputs of call %s are gone.', key)
+            return None
+        try:
+            for f in files:
+                blob = self._blob(f['sha1'])
+                if content_hash(blob) != f['sha1']:
+                    log.warning('Cached output %s of call %s was changed, '
+                                'dropping it.', blob, key)
+                    os.remove(blob)
+                    return None
+            for f in files:
+                dest = os.path.join(job_dir, f.pop('path'))
+                makedirs(os.path.dirname(dest))
+                place(self._blob(f.pop('sha1')), dest)
+                f['path'] = dest
+        except (IOError, OSError) as e:
+            log.warning('Not using cached outputs of call %s: %s', key, e)
+            return None
+        return outputs
+
+    def put(self, key, outputs, job_dir):
+        """
+        Stores outputs (with their metadata) of the call with key. Calls
+        with outputs piped to another job are not stored. A call that
+        cannot be stored, e.g. for lack of space, is only logged.
+        """
+        try:
+            self._put(key, outputs, job_dir)
+        except (IOError, OSError) as e:
+            log.warning('Could not store call %s: %s', key, e)
+
+    def _put(self, key, outputs, job_dir):
+        entry = json.loads(json.dumps(outputs))
+        if any(is_pipe(f['path']) for f in output_files(entry)):
+            return
+        for f in output_files(entry):
+            sha1 = content_hash(f['path'])
+            if not os.path.exists(self._blob(sha1)):
+                self._store(f['path'], sha1)
+            f['path'] = os.path.relpath(f['path'], job_dir)
+            f['sha1'] = sha1
+        path = self._call_path(key)
+        with open(path + '.tmp', 'w') as fp:
+            json.dump({'outputs': entry}, fp)
+        os.rename(path + '.tmp', path)
+
+    def _store(self, path, sha1):
+        # never a hard link: the job's output stays a file of its own
+        tmp = '%s.%s.tmp' % (self._blob(sha1), uuid.uuid4().hex)
+        try:
+            clone(path, tmp)
+            os.chmod(tmp, 0o444)
+            os.rename(tmp, self._blob(sha1))
+        except:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def _input_key(self, value, schema):
+        if isinstance(value, list):
+            return [self._input_key(v, schema.get('items') or {})
+                    for v in value]
+        if not (isinstance(value, dict) and 'path' in value):
+            return value
+        path = value['path']
+        key = {'meta': value.get('meta', {})}
+        if is_remote(path):
+            key.update(url=path, checksum=value.get('checksum') or
+                       self._version(path))
+        else:
+            if path.startswith('file://'):
+                path = path[len('file://'):]
+            key['sha1'] = content_hash(path)
+        secondary = (schema.get('adapter') or {}).get('secondaryFiles') or []
+        key['secondaryFiles'] = [
+            self._version(sf) for sf in (secondary_file(path, ext)
+                                         for ext in secondary)]
+        return key
+
+    @staticmethod
+    def _version(path):
+        """
+        Content hash of a local file, or the validators the server reports
+        for a URL; None if there is no such file. Raises IOError if the
+        version of a URL cannot be told.
+        """
+        if not is_remote(path):
+            return content_hash(path) if os.path.exists(path) else None
+        import requests
+        r = requests.head(path, allow_redirects=True)
+        if r.status_code == 404:
+            return None
+        r.raise_for_status()
+        version = dict((h, r.headers[h]) for h in ('ETag', 'Last-Modified')
+                       if r.headers.get(h))
+        if not version:
+            raise IOError('%s has no ETag or Last-Modified date.' % path)
+        return version
+
+    def _blob(self, sha1):
+        return os.path.join(self.root, 'blobs', sha1)
+
+    def _call_path(self, key):
+        return os.path.join(self.root, 'calls', key + '.json')
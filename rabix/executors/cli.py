@@ -1,12 +1,26 @@
 import docopt
+import os
 import sys
+import signal
 import logging
+import threading
 import six
-import collections
+import functools
 from rabix import __version__ as version
-from rabix.executors.runner import DockerRunner, NativeRunner
+from rabix.executors.pipeline import Pipeline, PipelineRunner, is_pipeline
+from rabix.executors.scatter import ScatterRunner, scattered_inputs
+from rabix.executors.batch import BatchRunner, read_jobs
 from rabix.cliche.adapter import Adapter, from_url
-from rabix.common.util import set_log_level
+from rabix.executors.scheduler import cancel_all
+from rabix.common.errors import RabixError
+from rabix.common.util import SignalContextProcessor, set_log_level
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+log = logging.getLogger(__name__)
 
 
 TEMPLATE_JOB = {
@@ -24,7 +38,14 @@ TEMPLATE_JOB = {
 
 USAGE = '''
 Usage:
-    rabix <tool> [-v...] [-hcI] [-d <dir>] [-i <inp>] [-- {inputs}...]
+    rabix <tool> [-v...] [-hcI] [--native] [-d <dir>] [-i <inp>]
+          [--scratch <scratch>] [--cache <cache>] [--cache-size <mb>]
+          [--export <url>] [--meta-sidecars] [--queue <queue>]
+          [--scatter <names> [--cross] [--straggler <x> [--speculate]]]
+          [--jobs <file> [--results <file>]] [--parallel <n>]
+          [--call-cache <dir>] [--resume <run>] [--registry <db>]
+          [-- {inputs}...]
+    rabix jobs [<args>...]
     rabix --version
 
     Options:
@@ -37,9 +58,58 @@ Usage:
   -i --inp-file=<inp>  Inputs
   -c --print-cli       Only print calculated command line. Do not run anything.
   -v --verbose         Verbosity. More Vs more output.
+     --native          Run the tool directly on this host, without a
+                       container. The tool must be installed locally.
+     --scratch=<scratch>
+                       Run the job in a directory under <scratch> (local SSD
+                       or tmpfs) and move outputs to the job dir on success.
+                       Defaults to $RABIX_SCRATCH.
+     --cache=<cache>   Share downloaded inputs with other jobs through a
+                       cache in this directory.
+     --cache-size=<mb> Evict least recently used cached inputs above this
+                       size (in MB).
+     --export=<url>    Copy outputs and their metadata to this file:// or
+                       http(s):// URL when the job succeeds, under the name
+                       of the run dir.
+     --meta-sidecars   Besides the job manifest, write metadata of each
+                       output to a '.meta' file next to it.
+     --queue=<queue>   Run on rabix-worker processes pulling jobs from this
+                       queue, a redis:// URL or a shared directory. Job
+                       dirs must be shared with the workers. Scratch,
+                       cache, call cache and registry options do not
+                       apply; give rabix-worker its scratch and cache.
+     --scatter=<names> Run one job per element of these comma separated
+                       array inputs and gather outputs into arrays.
+     --cross           Scatter over every combination of elements rather
+                       than over elements at the same position.
+     --parallel=<n>    Run at most <n> scattered jobs, or jobs of --jobs, at
+                       a time.
+     --straggler=<x>   Warn about scattered jobs running over <x> times the
+                       median runtime of finished ones.
+     --speculate       Start a copy of such jobs and keep the one that
+                       finishes first.
+     --jobs=<file>     Run one job per line of this JSON-lines file, a job
+                       or just its inputs, over the inputs given with -i.
+                       Job dirs are named after the 'id' of the job or its
+                       line, under the --dir directory.
+     --results=<file>  Append a JSON line with the status and outputs of
+                       each job of --jobs to this file as it ends, rather
+                       than printing it.
+     --call-cache=<dir>
+                       Reuse outputs of earlier jobs with the same tool and
+                       inputs, kept in this directory.
+     --resume=<run>    Resume the pipeline run in this directory with the job
+                       it was started with, running only steps that did not
+                       finish.
+     --registry=<db>   Record jobs in this SQLite database rather than in
+                       jobs.db in the XDG data dir. See 'rabix jobs -h'.
      --version         Print version and exit.
 '''
 
+# options for the host running a job, which a --queue coordinator is not
+QUEUE_LOCAL_OPTIONS = ('--scratch', '--cache', '--cache-size',
+                       '--call-cache', '--registry')
+
 TOOL_TEMPLATE = '''
 Usage:
   tool {inputs}
@@ -52,17 +122,17 @@ def update_dict(dct, new_dct):
         if '.' in key:
             for k in key.split('.'):
                 if k == key.split('.')[-1]:
-                    if isinstance(val, collections.Mapping):
+                    if isinstance(val, Mapping):
                         t = t.setdefault(k, {})
                         update_dict(t, new_dct[key])
                     else:
                         t[k] = val
                 else:
-                    if not isinstance(t.get(k), collections.Mapping):
+                    if not isinstance(t.get(k), Mapping):
                         t[k] = {}
                     t = t.setdefault(k, {})
         else:
-            if isinstance(val, collections.Mapping):
+            if isinstance(val, Mapping):
                 t = t.setdefault(key, {})
                 update_dict(t, new_dct[key])
             else:
@@ -154,12 +224,113 @@ def dry_run_parse(args=None):
         return
 
 
+def make_runner(tool, args):
+    """
+    Builds the runner for the options in args. Executors and their
+    dependencies (docker, requests, the job registry) are imported here so
+    that printing help or the command line does not pay for them.
+    """
+    from rabix.executors.runner import DockerRunner, NativeRunner
+    from rabix.executors.cache import InputCache
+    from rabix.executors.callcache import CallCache
+    from rabix.executors.export import Exporter
+    from rabix.executors.history import RuntimeHistory
+    from rabix.executors.registry import open_registry
+    from rabix.executors.distributed import DistributedRunner, \
+        queue_from_url
+
+    cache = None
+    if args['--cache']:
+        cache = InputCache(args['--cache'],
+                           max_size=int(args['--cache-size'] or 0))
+    export = None
+    if args['--export']:
+        run_dir = args['--dir'] or args['--resume']
+        export = Exporter(args['--export'], root=run_dir and os.path.dirname(
+            os.path.abspath(run_dir)))
+    if args['--queue']:
+        runner_cls = DistributedRunner
+        runner_kwargs = dict(queue=queue_from_url(args['--queue']),
+                             native=args['--native'], export=export,
+                             sidecars=args['--meta-sidecars'])
+    else:
+        runner_cls = NativeRunner if args['--native'] else DockerRunner
+        runner_kwargs = dict(scratch=args['--scratch'], cache=cache,
+                             export=export, sidecars=args['--meta-sidecars'],
+                             registry=open_registry(args['--registry']))
+        if args['--call-cache']:
+            runner_kwargs['call_cache'] = CallCache(args['--call-cache'])
+    if is_pipeline(tool):
+        runner_cls = functools.partial(PipelineRunner, runner=runner_cls,
+                                       history=RuntimeHistory(),
+                                       **runner_kwargs)
+        runner_kwargs = {}
+    if args['--scatter']:
+        return ScatterRunner(
+            tool, runner_cls, args['--scatter'].split(','),
+            method='cross' if args['--cross'] else 'dot',
+            parallel=int(args['--parallel'] or 0) or None,
+            straggler=float(args['--straggler'] or 0) or None,
+            speculate=args['--speculate'], **runner_kwargs)
+    return runner_cls(tool, **runner_kwargs)
+
+
+def run_job(runner, job, **kwargs):
+    """
+    Runs the job, cancelling it on SIGINT or SIGTERM: containers and
+    processes started are stopped, downloads aborted and queued jobs
+    dropped.
+    """
+    cancelled = threading.Event()
+
+    def handler(signum, frame):
+        log.warning('Got signal %s, cancelling jobs.', signum)
+        cancelled.set()
+        threading.Thread(target=cancel_all).start()
+
+    with SignalContextProcessor(handler, signal.SIGINT, signal.SIGTERM):
+        try:
+            return runner.run_job(job, **kwargs)
+        except (Exception, RabixError):
+            if not cancelled.is_set():
+                raise
+    print('Cancelled.')
+    sys.exit(130)
+
+
+def run_batch(tool, runner, job, args):
+    """
+    Runs the jobs of the --jobs file on runner and exits with 1 if any of
+    them failed or was invalid, 130 if cancelled.
+    """
+    with open(args['--jobs']) as fp:
+        jobs = list(read_jobs(fp, base=job))
+    results = open(args['--results'], 'a') if args['--results'] else None
+    try:
+        batch = BatchRunner(tool, runner, results=results,
+                            parallel=int(args['--parallel'] or 0) or None)
+        counts = run_job(batch, jobs, job_id=args['--dir'])
+    finally:
+        if results:
+            results.close()
+    log.info('Jobs: %s', ', '.join('%s %s' % (n, status) for status, n
+                                   in sorted(counts.items())))
+    if counts.get('cancelled'):
+        sys.exit(130)
+    if set(counts) - set(['finished']):
+        sys.exit(1)
+
+
 def main():
     logging.basicConfig(level=logging.WARN)
     if len(sys.argv) == 1:
         print(USAGE)
         return
 
+    if sys.argv[1] == 'jobs':
+        from rabix.executors.registry import jobs_main
+        return jobs_main(sys.argv[1:])
+
     usage = USAGE.format(inputs='<inputs>')
     tool_usage = usage
 
@@ -183,22 +354,47 @@ def main():
         print("Couldn't find tool.")
         return
 
-    runner = DockerRunner(tool)
+    local = [o for o in QUEUE_LOCAL_OPTIONS if dry_run_args[o]]
+    if dry_run_args['--queue'] and local:
+        print('%s cannot be used with --queue: jobs run on the workers, '
+              'see rabix-worker -h.' % ', '.join(local))
+        return
+
+    pipeline = is_pipeline(tool)
+    runner = functools.partial(make_runner, tool, dry_run_args)
+    if pipeline:
+        tool = dict(tool, inputs=Pipeline(tool).inputs)
+    if dry_run_args['--scatter']:
+        tool = dict(tool, inputs=scattered_inputs(
+            tool.get('inputs', {}), dry_run_args['--scatter'].split(',')))
 
     if dry_run_args['--install']:
-        runner.install()
+        runner().install()
         print("Install successful.")
         return
 
     try:
-        args = docopt.docopt(usage, version=version, help=False)
+        # same parse as the dry run, without its placeholder input
+        args = dict(dry_run_args,
+                    **{'<inputs>': dry_run_args['<inputs>'][:-1]})
         job = TEMPLATE_JOB
         set_log_level(dry_run_args['--verbose'])
 
+        if dry_run_args['--resume']:
+            if not pipeline or dry_run_args['--scatter']:
+                print('Only pipeline runs can be resumed.')
+                return
+            print(run_job(runner(), None, job_id=dry_run_args['--resume'],
+                          resume=True))
+            return
+
         if args['--inp-file']:
             input_file = from_url(args.get('--inp-file'))
             update_dict(job['inputs'], get_inputs(tool, input_file)['inputs'])
 
+        if args['--jobs']:
+            return run_batch(tool, runner(), job, args)
+
         tool_inputs_usage = make_tool_usage_string(
             tool, template=TOOL_TEMPLATE, inp=job['inputs'])
         tool_usage = make_tool_usage_string(tool, USAGE, job['inputs'])
@@ -213,11 +409,15 @@ def main():
         job = update_paths(job, inp)
 
         if args['--print-cli']:
+            if pipeline:
+                print('Command lines of pipeline steps depend on the '
+                      'outputs of earlier steps.')
+                return
             adapter = Adapter(tool)
             print(adapter.cmd_line(job))
             return
 
-        runner.run_job(job, job_id=args.get('--dir'))
+        print(run_job(runner(), job, job_id=args.get('--dir')))
 
     except docopt.DocoptExit:
         print(tool_usage)
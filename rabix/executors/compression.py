@@ -0,0 +1,230 @@
+import os
+import bz2
+import zlib
+import gzip
+import errno
+import shutil
+import logging
+import subprocess
+import multiprocessing
+
+log = logging.getLogger(__name__)
+
+CHUNK_SIZE = 4 * 1024 * 1024
+
+EXTENSIONS = {'gzip': '.gz', 'bzip2': '.bz2'}
+FORMATS = {'.gz': 'gzip', '.bgz': 'gzip', '.bz2': 'bzip2'}
+
+# Multi-threaded tools, in order of preference. None of them is required,
+# without one the Python modules are used.
+DECOMPRESSORS = {
+    'gzip': [['bgzip', '-d', '-c', '-@', '{threads}'],
+             ['pigz', '-d', '-c', '-p', '{threads}']],
+    'bzip2': [['pbzip2', '-d', '-c', '-p{threads}'],
+              ['lbzip2', '-d', '-c', '-n', '{threads}']],
+}
+COMPRESSORS = {
+    'gzip': [['bgzip', '-c', '-@', '{threads}'],
+             ['pigz', '-c', '-p', '{threads}']],
+    'bzip2': [['pbzip2', '-c', '-p{threads}'],
+              ['lbzip2', '-c', '-n', '{threads}']],
+}
+
+
+def which(name):
+    for path in os.getenv('PATH', '').split(os.pathsep):
+        exe = os.path.join(path, name)
+        if os.path.isfile(exe) and os.access(exe, os.X_OK):
+            return exe
+
+
+def command(commands, fmt, threads=None):
+    threads = str(threads or multiprocessing.cpu_count())
+    for cmd in commands.get(fmt, []):
+        if which(cmd[0]):
+            return [arg.format(threads=threads) for arg in cmd]
+
+
+def detect(path):
+    return FORMATS.get(os.path.splitext(path)[1].lower())
+
+
+def strip_extension(path):
+    base, ext = os.path.splitext(path)
+    return base if ext.lower() in FORMATS else path
+
+
+def format_for(option, path):
+    """
+    Format to decompress path with, given the 'decompress' adapter option:
+    a format name, or Yes/'auto' to go by the file extension.
+
+    >>> format_for('auto', 'a.fq.gz'), format_for(True, 'a.fq')
+    ('gzip', None)
+    >>> format_for('bzip2', 'a.fq'), format_for('No', 'a.fq.gz')
+    ('bzip2', None)
+    """
+    if option in EXTENSIONS:
+        return option
+    if option is True or str(option).lower() in ('yes', 'true', 'auto'):
+        return detect(path)
+
+
+class PyDecompressor(object):
+    """Incremental decompressor handling multi-member files (bgzip)."""
+
+    def __init__(self, fmt):
+        self.fmt = fmt
+        self._new()
+
+    def _new(self):
+        self.eof = False
+        if self.fmt == 'gzip':
+            self.obj = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        else:
+            self.obj = bz2.BZ2Decompressor()
+
+    def decompress(self, data):
+        out = []
+        while data:
+            if self.eof:
+                self._new()
+            try:
+                out.append(self.obj.decompress(data))
+            except EOFError:
+                # Python 2 bz2: the member ended with the previous chunk
+                self.eof = True
+                continue
+            data = b''
+            if self._at_eof():
+                self.eof = True
+                data = self.obj.unused_data
+        return b''.join(out)
+
+    def _at_eof(self):
+        return getattr(self.obj, 'eof', False) or self.obj.unused_data != b''
+
+    def _ended(self):
+        if hasattr(self.obj, 'eof'):
+            return self.obj.eof
+        # Python 2 objects have no eof: past the end of a member a byte is
+        # left unused by zlib and refused by bz2
+        if self.fmt == 'gzip':
+            probe = self.obj.copy()
+            try:
+                probe.decompress(b'\0')
+            except zlib.error:
+                return False
+            return probe.unused_data != b''
+        try:
+            self.obj.decompress(b'\0')
+        except EOFError:
+            return True
+        except (IOError, ValueError):
+            pass
+        return False
+
+    @property
+    def truncated(self):
+        return not (self.eof or self._ended())
+
+
+class DecompressingWriter(object):
+    """
+    File-like sink that writes the decompressed form of what it is given
+    to fp, through a multi-threaded tool when one is installed. tell()
+    counts the compressed bytes, so an interrupted download can resume
+    with a Range request.
+    """
+
+    def __init__(self, fp, fmt, threads=None):
+        self.fp = fp
+        self.consumed = 0
+        cmd = command(DECOMPRESSORS, fmt, threads)
+        self.proc = None
+        if cmd and hasattr(fp, 'fileno'):
+            fp.flush()
+            log.debug('Decompressing with %s', ' '.join(cmd))
+            self.proc = subprocess.Popen(cmd, stdin=subprocess.PIPE,
+                                         stdout=fp.fileno())
+        else:
+            self.decompressor = PyDecompressor(fmt)
+
+    def write(self, data):
+        if getattr(self.fp, 'closed', False):
+            raise IOError(errno.EPIPE, 'Output closed')
+        self.consumed += len(data)
+        if self.proc:
+            self.proc.stdin.write(data)
+        else:
+            self.fp.write(self.decompressor.decompress(data))
+
+    def flush(self):
+        if self.proc:
+            self.proc.stdin.flush()
+        else:
+            self.fp.flush()
+
+    def tell(self):
+        return self.consumed
+
+    def abort(self):
+        """Stops the decompressing tool, if any, after a failed transfer."""
+        if not self.proc:
+            return
+        if self.proc.poll() is None:
+            self.proc.kill()
+        try:
+            self.proc.stdin.close()
+        except (IOError, OSError):
+            pass
+        self.proc.wait()
+
+    def close(self):
+        if self.proc:
+            self.proc.stdin.close()
+            if self.proc.wait() != 0:
+                raise IOError('Decompression failed with exit code %s' %
+                              self.proc.returncode)
+        else:
+            self.fp.flush()
+            if self.decompressor.truncated:
+                raise IOError('Compressed data is truncated')
+
+
+def decompress_to(src, fp, fmt, threads=None):
+    writer = DecompressingWriter(fp, fmt, threads)
+    try:
+        with open(src, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                writer.write(chunk)
+    except:
+        writer.abort()
+        raise
+    writer.close()
+
+
+def compress_file(path, fmt='gzip', threads=None):
+    """
+    Replaces path with its compressed form and returns the new path.
+    """
+    dest = path + EXTENSIONS[fmt]
+    cmd = command(COMPRESSORS, fmt, threads)
+    try:
+        if cmd:
+            with open(path, 'rb') as src, open(dest, 'wb') as dst:
+                subprocess.check_call(cmd, stdin=src, stdout=dst)
+        else:
+            opener = gzip.open if fmt == 'gzip' else bz2.BZ2File
+            with open(path, 'rb') as src:
+                dst = opener(dest, 'wb')
+                try:
+                    shutil.copyfileobj(src, dst, CHUNK_SIZE)
+                finally:
+                    dst.close()
+    except:
+        if os.path.exists(dest):
+            os.remove(dest)
+        raise
+    os.remove(path)
+    return dest
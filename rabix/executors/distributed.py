@@ -0,0 +1,443 @@
+import os
+import sys
+import json
+import time
+import uuid
+import socket
+import shutil
+import hashlib
+import logging
+import threading
+import docopt
+
+from rabix import __version__ as version
+from rabix.common.errors import JobCancelled, RabixError
+from rabix.common.util import makedirs, set_log_level
+from rabix.executors.runner import DockerRunner, NativeRunner, _runners
+from rabix.executors.scheduler import RESOURCES
+
+log = logging.getLogger(__name__)
+
+RUNNERS = {'docker': DockerRunner, 'native': NativeRunner}
+
+
+class DirectoryQueue(object):
+    """
+    Job queue kept in a directory, shared by processes on one host or,
+    on a shared filesystem, on many. A job is claimed by atomically
+    renaming it from pending/ to claimed/<worker>/, workers touch
+    heartbeats/<worker> and results are written to results/.
+    """
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        for d in ('pending', 'claimed', 'heartbeats', 'results', 'tmp'):
+            makedirs(os.path.join(self.root, d))
+
+    def put(self, job_id, payload):
+        payload = dict(payload, job_id=job_id)
+        payload.setdefault('attempts', 0)
+        if os.path.exists(self._result_path(job_id)):
+            os.remove(self._result_path(job_id))
+        name = '%.6f-%s.json' % (time.time(), self._key(job_id))
+        self._write(os.path.join(self.root, 'pending', name), payload)
+
+    def claim(self, worker_id, timeout=1.0):
+        """
+        Returns the oldest pending (job_id, payload), waiting up to timeout
+        seconds for one, or None.
+        """
+        claimed = os.path.join(self.root, 'claimed', worker_id)
+        makedirs(claimed)
+        deadline = time.time() + timeout
+        while True:
+            pending = os.path.join(self.root, 'pending')
+            for name in sorted(os.listdir(pending)):
+                try:
+                    os.rename(os.path.join(pending, name),
+                              os.path.join(claimed, name))
+                except OSError:
+                    continue
+                with open(os.path.join(claimed, name)) as fp:
+                    payload = json.load(fp)
+                return payload['job_id'], payload
+            if time.time() >= deadline:
+                return None
+            time.sleep(min(0.1, timeout))
+
+    def heartbeat(self, worker_id):
+        path = os.path.join(self.root, 'heartbeats', worker_id)
+        with open(path, 'a'):
+            os.utime(path, None)
+
+    def complete(self, job_id, worker_id, result=None, error=None):
+        self._write(self._result_path(job_id),
+                    {'result': result, 'error': error, 'worker': worker_id})
+        claimed = os.path.join(self.root, 'claimed', worker_id)
+        for name in self._listdir(claimed):
+            if name.endswith(self._key(job_id) + '.json'):
+                os.remove(os.path.join(claimed, name))
+
+    def result(self, job_id):
+        try:
+            with open(self._result_path(job_id)) as fp:
+                return json.load(fp)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def requeue_dead(self, timeout, max_attempts=3):
+        """
+        Moves jobs claimed by workers without a heartbeat in the last
+        timeout seconds back to pending. A job which has already been
+        attempted max_attempts times is failed instead.
+        """
+        requeued = []
+        claimed_root = os.path.join(self.root, 'claimed')
+        for worker_id in self._listdir(claimed_root):
+            if self._alive(worker_id, timeout):
+                continue
+            claimed = os.path.join(claimed_root, worker_id)
+            for name in self._listdir(claimed):
+                # taken out of claimed/ first, so only one waiter gets it
+                path = os.path.join(self.root, 'tmp', str(uuid.uuid4()))
+                try:
+                    os.rename(os.path.join(claimed, name), path)
+                except OSError:
+                    continue
+                try:
+                    with open(path) as fp:
+                        payload = json.load(fp)
+                except (IOError, OSError, ValueError):
+                    continue
+                finally:
+                    os.remove(path)
+                job_id = payload['job_id']
+                if self.result(job_id):
+                    continue
+                payload['attempts'] += 1
+                if payload['attempts'] >= max_attempts:
+                    log.error('Job %s lost %s workers, giving up.',
+                              job_id, payload['attempts'])
+                    self._write(self._result_path(job_id), {
+                        'result': None, 'worker': worker_id,
+                        'error': 'Worker %s died. Giving up after %s '
+                                 'attempts.' % (worker_id,
+                                                payload['attempts'])})
+                    continue
+                log.warning('Worker %s died, requeueing job %s',
+                            worker_id, job_id)
+                self._write(os.path.join(self.root, 'pending', name), payload)
+                requeued.append(job_id)
+        return requeued
+
+    def _alive(self, worker_id, timeout):
+        try:
+            beat = os.stat(os.path.join(
+                self.root, 'heartbeats', worker_id)).st_mtime
+        except OSError:
+            return False
+        return time.time() - beat < timeout
+
+    def _result_path(self, job_id):
+        return os.path.join(self.root, 'results', self._key(job_id) + '.json')
+
+    def _write(self, path, obj):
+        tmp = os.path.join(self.root, 'tmp', str(uuid.uuid4()))
+        with open(tmp, 'w') as fp:
+            json.dump(obj, fp)
+        os.rename(tmp, path)
+
+    @staticmethod
+    def _key(job_id):
+        return hashlib.sha1(job_id.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _listdir(path):
+        try:
+            return sorted(os.listdir(path))
+        except OSError:
+            return []
+
+
+class RedisQueue(object):
+    """
+    Job queue in Redis, for workers on many hosts. Jobs are claimed with
+    BRPOPLPUSH from <name>:pending to a per-worker list, so a job is never
+    lost between being taken and completed.
+    """
+
+    def __init__(self, connection, name='rabix'):
+        self.redis = connection
+        self.name = name
+
+    def put(self, job_id, payload):
+        payload = dict(payload, job_id=job_id)
+        self.redis.hset(self._k('payloads'), job_id, json.dumps(payload))
+        self.redis.hdel(self._k('results'), job_id)
+        self.redis.hdel(self._k('attempts'), job_id)
+        self.redis.lpush(self._k('pending'), job_id)
+
+    def claim(self, worker_id, timeout=1.0):
+        self.redis.sadd(self._k('workers'), worker_id)
+        job_id = self.redis.brpoplpush(self._k('pending'),
+                                       self._k('claimed', worker_id),
+                                       max(1, int(timeout)))
+        if job_id is None:
+            return None
+        job_id = self._str(job_id)
+        payload = json.loads(self._str(self.redis.hget(
+            self._k('payloads'), job_id)))
+        payload['attempts'] = int(self.redis.hget(
+            self._k('attempts'), job_id) or 0)
+        return job_id, payload
+
+    def heartbeat(self, worker_id):
+        self.redis.hset(self._k('heartbeats'), worker_id, time.time())
+
+    def complete(self, job_id, worker_id, result=None, error=None):
+        self.redis.hset(self._k('results'), job_id, json.dumps(
+            {'result': result, 'error': error, 'worker': worker_id}))
+        self.redis.lrem(self._k('claimed', worker_id), 0, job_id)
+
+    def result(self, job_id):
+        value = self.redis.hget(self._k('results'), job_id)
+        return json.loads(self._str(value)) if value else None
+
+    def requeue_dead(self, timeout, max_attempts=3):
+        requeued = []
+        for worker_id in self.redis.smembers(self._k('workers')):
+            worker_id = self._str(worker_id)
+            beat = self.redis.hget(self._k('heartbeats'), worker_id)
+            if beat and time.time() - float(beat) < timeout:
+                continue
+            claimed = self._k('claimed', worker_id)
+            while True:
+                job_id = self.redis.rpop(claimed)
+                if job_id is None:
+                    break
+                job_id = self._str(job_id)
+                attempts = self.redis.hincrby(self._k('attempts'), job_id, 1)
+                if attempts >= max_attempts:
+                    self.redis.hset(self._k('results'), job_id, json.dumps({
+                        'result': None, 'worker': worker_id,
+                        'error': 'Worker %s died. Giving up after %s '
+                                 'attempts.' % (worker_id, attempts)}))
+                    continue
+                log.warning('Worker %s died, requeueing job %s',
+                            worker_id, job_id)
+                self.redis.lpush(self._k('pending'), job_id)
+                requeued.append(job_id)
+            self.redis.srem(self._k('workers'), worker_id)
+        return requeued
+
+    def _k(self, *parts):
+        return ':'.join((self.name,) + parts)
+
+    @staticmethod
+    def _str(value):
+        return value.decode('utf-8') if isinstance(value, bytes) else value
+
+
+def queue_from_url(url):
+    """
+    A RedisQueue for redis:// URLs, otherwise a DirectoryQueue.
+    """
+    if url.startswith('redis://'):
+        import redis
+        return RedisQueue(redis.StrictRedis.from_url(url))
+    return DirectoryQueue(url)
+
+
+class DistributedRunner(object):
+    """
+    Runs jobs on workers pulling from a queue, with the same interface as
+    the local runners, so it can be used with LocalScheduler and
+    PipelineRunner. Job dirs must be on a filesystem the workers share.
+    While waiting for a result, jobs of workers whose heartbeat is older
+    than heartbeat_timeout seconds are requeued.
+
+    Jobs are not packed against the capacity of this host, the workers
+    take them as they have room. A scheduler waits for at most `slots` of
+    them at a time. Outputs are exported like the Exporter `export` does
+    and get '.meta' sidecars with `sidecars`, by the worker running the
+    job.
+
+    A cancelled job stops being waited for and raises JobCancelled; the
+    worker which took it still runs it to the end.
+    """
+
+    capacity = dict.fromkeys(RESOURCES, float('inf'))
+    slots = 64
+
+    def __init__(self, tool, queue, native=False, heartbeat_timeout=60,
+                 max_attempts=3, poll=1.0, slots=None, export=None,
+                 sidecars=False):
+        self.tool = tool
+        self.queue = queue
+        self.native = native
+        self.slots = slots or self.slots
+        self.export = export
+        self.sidecars = sidecars
+        self.heartbeat_timeout = heartbeat_timeout
+        self.max_attempts = max_attempts
+        self.poll = poll
+        self._cond = threading.Condition()
+        self._cancelled = set()
+        self._cancel_all = False
+        _runners.add(self)
+
+    def install(self):
+        pass
+
+    def run_job(self, job, job_id=None):
+        job_id = os.path.abspath(job_id or str(uuid.uuid4()))
+        if self._is_cancelled(job_id):
+            raise JobCancelled(job_id)
+        self.submit(job, job_id)
+        return self.wait(job_id)
+
+    def submit(self, job, job_id):
+        self.queue.put(job_id, {'tool': self.tool, 'job': job,
+                                'runner': 'native' if self.native
+                                else 'docker', 'export': self.export and {
+                                    'dest': self.export.dest,
+                                    'root': self.export.root},
+                                'sidecars': self.sidecars})
+        return job_id
+
+    def wait(self, job_id, timeout=None):
+        deadline = timeout and time.time() + timeout
+        while True:
+            if self._is_cancelled(job_id):
+                raise JobCancelled(job_id)
+            result = self.queue.result(job_id)
+            if result:
+                if result.get('error'):
+                    raise RabixError('Job %s failed on %s: %s' % (
+                        job_id, result.get('worker'), result['error']))
+                return result['result']
+            if deadline and time.time() > deadline:
+                raise RabixError('Timed out waiting for job %s' % job_id)
+            self.queue.requeue_dead(self.heartbeat_timeout,
+                                    self.max_attempts)
+            with self._cond:
+                if not self._is_cancelled(job_id):
+                    self._cond.wait(self.poll)
+
+    def cancel(self, job_id):
+        with self._cond:
+            self._cancelled.add(os.path.abspath(job_id))
+            self._cond.notify_all()
+
+    def cancel_all(self):
+        with self._cond:
+            self._cancel_all = True
+            self._cond.notify_all()
+
+    def _is_cancelled(self, job_id):
+        with self._cond:
+            return self._cancel_all or \
+                os.path.abspath(job_id) in self._cancelled
+
+
+class Worker(object):
+    """
+    Pulls jobs from the queue and runs them one at a time with the runner
+    named in the job, reporting the outputs (the content of result.json)
+    or the error back. Sends a heartbeat every `heartbeat` seconds from a
+    background thread, also while a job runs.
+    """
+
+    def __init__(self, queue, worker_id=None, heartbeat=10, **runner_kwargs):
+        self.queue = queue
+        self.worker_id = worker_id or '%s-%s-%s' % (
+            socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+        self.heartbeat = heartbeat
+        self.runner_kwargs = runner_kwargs
+        self._stop = threading.Event()
+
+    def work(self, burst=False, poll=1.0):
+        """
+        Runs jobs until stopped or, with burst, until the queue is empty.
+        """
+        beat = threading.Thread(target=self._beat)
+        beat.daemon = True
+        self.queue.heartbeat(self.worker_id)
+        beat.start()
+        try:
+            while not self._stop.is_set():
+                claimed = self.queue.claim(self.worker_id, poll)
+                if claimed:
+                    self.run(*claimed)
+                elif burst:
+                    break
+        finally:
+            self._stop.set()
+
+    def stop(self):
+        self._stop.set()
+
+    def run(self, job_id, payload):
+        log.info('Worker %s running job %s', self.worker_id, job_id)
+        result, error = None, None
+        try:
+            if payload.get('attempts') and os.path.exists(job_id):
+                shutil.rmtree(job_id)
+            export = None
+            if payload.get('export'):
+                from rabix.executors.export import Exporter
+                export = Exporter(payload['export']['dest'],
+                                  root=payload['export']['root'])
+            runner = RUNNERS[payload.get('runner', 'docker')](
+                payload['tool'], export=export,
+                sidecars=payload.get('sidecars', False),
+                **self.runner_kwargs)
+            result = runner.run_job(payload['job'], job_id=job_id)
+        except (Exception, RabixError) as e:
+            log.error('Job %s failed: %s', job_id, e)
+            error = str(e) or type(e).__name__
+        self.queue.complete(job_id, self.worker_id, result, error)
+
+    def _beat(self):
+        while not self._stop.wait(self.heartbeat):
+            try:
+                self.queue.heartbeat(self.worker_id)
+            except Exception:
+                log.exception('Heartbeat of %s failed', self.worker_id)
+
+
+WORKER_USAGE = '''
+Usage:
+    rabix-worker <queue> [-v...] [--burst] [--scratch <scratch>]
+                 [--cache <cache>] [--heartbeat <sec>]
+    rabix-worker --version
+
+    Options:
+  <queue>              A redis:// URL or a directory shared with the
+                       coordinator.
+  -v --verbose         Verbosity. More Vs more output.
+     --burst           Exit once the queue is empty.
+     --scratch=<scratch>
+                       Run jobs in directories under <scratch>.
+     --cache=<cache>   Share downloaded inputs through a cache in this
+                       directory.
+     --heartbeat=<sec> Seconds between heartbeats [default: 10].
+     --version         Print version and exit.
+'''
+
+
+def worker_main(argv=None):
+    logging.basicConfig(level=logging.WARN)
+    args = docopt.docopt(WORKER_USAGE, argv or sys.argv[1:], version=version)
+    set_log_level(args['--verbose'])
+    cache = None
+    if args['--cache']:
+        from rabix.executors.cache import InputCache
+        cache = InputCache(args['--cache'])
+    Worker(queue_from_url(args['<queue>']),
+           heartbeat=float(args['--heartbeat']),
+           scratch=args['--scratch'], cache=cache).work(burst=args['--burst'])
+
+
+if __name__ == '__main__':
+    worker_main()
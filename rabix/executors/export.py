@@ -0,0 +1,151 @@
+import os
+import copy
+import time
+import shutil
+import logging
+import requests
+import six
+
+from six.moves.urllib import parse as urlparse
+
+from rabix.common.errors import RabixError
+from rabix.common.util import run_all
+from rabix.executors.io import MANIFEST, is_pipe, output_files, to_json
+from rabix.executors.runner import is_subdir
+
+log = logging.getLogger(__name__)
+
+
+class FileSlice(object):
+    """Read-only view of length bytes of a file, starting at offset."""
+
+    def __init__(self, path, offset, length):
+        self.fp = open(path, 'rb')
+        self.fp.seek(offset)
+        self.remaining = self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.fp.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.fp.close()
+
+
+class Exporter(object):
+    """
+    Exports job outputs, the job manifest and any '.meta' sidecars to dest,
+    a file:// or http(s):// URL, keeping their paths relative to root,
+    the directory run dirs are made in (the current one by default). So
+    the jobs of a run, its steps and scatter shards, and different runs
+    do not overwrite each other at dest. Job dirs outside root are
+    exported under their name.
+
+    Files are copied, or uploaded with HTTP PUT, concurrently by `workers`
+    threads. Files larger than part_size are uploaded in parts, each a PUT
+    with a Content-Range header, also concurrently. Each transfer is retried
+    up to `retries` times. A manifest of destination URLs, shaped like the
+    outputs, is written to export.json in the job dir.
+    """
+
+    MANIFEST = 'export.json'
+
+    def __init__(self, dest, workers=4, part_size=64 * 1024 * 1024,
+                 retries=3, backoff=1.0, session=None, root=None):
+        self.dest = dest.rstrip('/')
+        self.root = os.path.abspath(root or os.getcwd())
+        self.workers = workers
+        self.part_size = part_size
+        self.retries = retries
+        self.backoff = backoff
+        self.session = session or requests.Session()
+        scheme = urlparse.urlparse(self.dest).scheme
+        if scheme not in ('file', 'http', 'https'):
+            raise ValueError('Unsupported export destination: %s' % dest)
+
+    def __call__(self, outputs, job_dir):
+        manifest = copy.deepcopy(outputs)
+        tasks = []
+        for out in output_files(manifest):
+            if is_pipe(out['path']):
+                log.debug('Not exporting %s, a named pipe.', out['path'])
+                continue
+            url = self.url_for(out['path'], job_dir)
+            tasks += self._tasks(out['path'], url)
+            if os.path.exists(out['path'] + '.meta'):
+                tasks += self._tasks(out['path'] + '.meta', url + '.meta')
+            out.clear()
+            out['url'] = url
+        manifest_path = os.path.join(job_dir, MANIFEST)
+        if os.path.exists(manifest_path):
+            tasks += self._tasks(manifest_path,
+                                 self.url_for(manifest_path, job_dir))
+        self._run_all(tasks)
+        with open(os.path.join(job_dir, self.MANIFEST), 'w') as fp:
+            to_json(manifest, fp)
+        return manifest
+
+    def url_for(self, path, job_dir):
+        job_dir = os.path.abspath(job_dir)
+        if is_subdir(job_dir, self.root) and job_dir != self.root:
+            rel = os.path.relpath(os.path.abspath(path), self.root)
+        else:
+            rel = os.path.join(os.path.basename(job_dir),
+                               os.path.relpath(path, job_dir))
+        return '/'.join([self.dest,
+                         urlparse.quote(rel.replace(os.sep, '/'))])
+
+    def _tasks(self, path, url):
+        if url.startswith('file://'):
+            return [(url, lambda: self._copy(path, url))]
+        size = os.path.getsize(path)
+        if size <= self.part_size:
+            return [(url, lambda: self._put(path, url, 0, size, size))]
+        return [(url, lambda offset=offset: self._put(
+            path, url, offset, min(self.part_size, size - offset), size))
+            for offset in range(0, size, self.part_size)]
+
+    def _copy(self, path, url):
+        dest = urlparse.unquote(urlparse.urlparse(url).path)
+        if not os.path.isdir(os.path.dirname(dest)):
+            try:
+                os.makedirs(os.path.dirname(dest))
+            except OSError:
+                if not os.path.isdir(os.path.dirname(dest)):
+                    raise
+        shutil.copyfile(path, dest + '.part')
+        os.rename(dest + '.part', dest)
+
+    def _put(self, path, url, offset, length, size):
+        headers = {}
+        if length != size:
+            headers['Content-Range'] = 'bytes %s-%s/%s' % (
+                offset, offset + length - 1, size)
+        for attempt in range(self.retries + 1):
+            data = FileSlice(path, offset, length)
+            try:
+                r = self.session.put(url, data=data, headers=headers)
+                r.raise_for_status()
+                return
+            except requests.RequestException as e:
+                response = getattr(e, 'response', None)
+                if attempt == self.retries or (
+                        response is not None and response.status_code < 500):
+                    raise
+                log.warning('Upload of %s to %s failed, retrying: %s',
+                            path, url, e)
+                time.sleep(self.backoff * 2 ** attempt)
+            finally:
+                data.close()
+
+    def _run_all(self, tasks):
+        errors = run_all(tasks, self.workers, 'export')
+        if errors:
+            raise RabixError('Export failed:\n' + '\n'.join(
+                '%s: %s' % (url, six.text_type(e)) for url, e in errors))
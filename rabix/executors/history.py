@@ -0,0 +1,100 @@
+import os
+import json
+import fcntl
+import threading
+
+from rabix.cliche.ref_resolver import loader
+from rabix.common.util import makedirs
+
+
+class RuntimeHistory(object):
+    """
+    Runtimes of past jobs per tool, kept in a JSON file under the XDG data
+    dir. Runtimes are recorded as cpu-seconds (wall time times allocated
+    cpu) averaged with a moving average, so an estimate scales with the
+    cpu allocated to the job. Tools never seen are estimated at `default`
+    seconds. Records are merged into the file by save().
+    """
+
+    ALPHA = 0.3
+
+    def __init__(self, path=None, default=60.0):
+        if not path:
+            from xdg.BaseDirectory import save_data_path
+            path = os.path.join(save_data_path('rabix'), 'history.json')
+        self.path = path
+        self.default = default
+        self.records = self._load()
+        self._pending = []
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(tool):
+        return loader.checksum(tool)
+
+    def estimate(self, tool, cpu=1):
+        """
+        Expected runtime in seconds of tool given cpu cores.
+        """
+        record = self.records.get(self.key(tool))
+        if not record:
+            return self.default
+        return record['cpu_seconds'] / max(cpu or 1, 1)
+
+    def record(self, tool, seconds, cpu=1):
+        cpu_seconds = seconds * max(cpu or 1, 1)
+        key = self.key(tool)
+        with self._lock:
+            self._update(self.records, key, cpu_seconds)
+            self._pending.append((key, cpu_seconds))
+
+    def save(self):
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if not pending:
+            return
+        makedirs(os.path.dirname(self.path))
+        with open(self.path + '.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            records = self._load()
+            for key, cpu_seconds in pending:
+                self._update(records, key, cpu_seconds)
+            with open(self.path + '.tmp', 'w') as fp:
+                json.dump(records, fp)
+            os.rename(self.path + '.tmp', self.path)
+        self.records = records
+
+    def _update(self, records, key, cpu_seconds):
+        record = records.get(key)
+        if not record:
+            records[key] = {'cpu_seconds': cpu_seconds, 'count': 1}
+            return
+        record['cpu_seconds'] += self.ALPHA * (cpu_seconds -
+                                               record['cpu_seconds'])
+        record['count'] += 1
+
+    def _load(self):
+        try:
+            with open(self.path) as fp:
+                records = json.load(fp)
+            return records if isinstance(records, dict) else {}
+        except (IOError, OSError, ValueError):
+            return {}
+
+
+def critical_paths(graph, weights):
+    """
+    Length of the longest path from each node of a DAG to a sink, nodes
+    weighted by weights.
+
+    >>> import networkx as nx
+    >>> g = nx.DiGraph([('a', 'b'), ('b', 'c'), ('a', 'd')])
+    >>> sorted(critical_paths(g, {'a': 1, 'b': 2, 'c': 3, 'd': 1}).items())
+    [('a', 6), ('b', 5), ('c', 3), ('d', 1)]
+    """
+    import networkx as nx
+    lengths = {}
+    for node in reversed(list(nx.topological_sort(graph))):
+        lengths[node] = weights[node] + max(
+            [lengths[s] for s in graph.successors(node)] or [0])
+    return lengths
@@ -4,11 +4,19 @@ import logging
 import uuid
 import copy
 import json
+import time
+import errno
+import stat
+import hashlib
+import functools
+import collections
+import threading
 import six
-import requests
 
 from six.moves.urllib import parse as urlparse
-from rabix.common.errors import ResourceUnavailable
+from rabix.common.errors import RabixError, ResourceUnavailable
+from rabix.common.util import run_all
+from rabix.executors import compression
 
 log = logging.getLogger(__name__)
 
@@ -20,15 +28,293 @@ def to_json(obj, fp=None):
     return json.dump(obj, fp, **kwargs) if fp else json.dumps(obj, **kwargs)
 
 
+def output_files(outputs):
+    """
+    Yields the file dicts of job outputs, whether single or arrays.
+    """
+    for v in six.itervalues(outputs):
+        for out in (v if isinstance(v, list) else [v] if v else []):
+            yield out
+
+
+def is_pipe(path):
+    try:
+        return stat.S_ISFIFO(os.stat(path).st_mode)
+    except OSError:
+        return False
+
+
+def is_remote(url):
+    return '://' in url and not url.startswith(('file://', 'data:'))
+
+
+def secondary_file(path, ext):
+    """
+    Path of a secondary file of path: ext is appended if it starts with
+    '*', else it replaces the extension of the file name.
+
+    >>> secondary_file('/refs/hg19.fa', '*.fai')
+    '/refs/hg19.fa.fai'
+    >>> secondary_file('/refs.v2/hg19.fa', '.dict')
+    '/refs.v2/hg19.dict'
+    >>> secondary_file('/refs.v2/hg19', '.dict')
+    '/refs.v2/hg19.dict'
+    """
+    if ext.startswith('*'):
+        return path + ext[1:]
+    return os.path.splitext(path)[0] + ext
+
+
+class MetaCache(object):
+    """
+    Metadata lookups cached by key for the life of the process. Concurrent
+    lookups of the same key wait for a single load. load() returns the
+    value and whether it may be cached, so transient failures are retried
+    while missing metadata (None) is remembered. Values are copied unless
+    copy is False, for values that are never modified. With size, only
+    the size most recently used values are kept.
+    """
+    def __init__(self, copy=True, size=None):
+        self.copy = copy
+        self.size = size
+        self._values = collections.OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, load):
+        with self._lock:
+            if key in self._values:
+                self._values[key] = self._values.pop(key)
+                return self._copy(self._values[key])
+            event = self._pending.get(key)
+            owner = event is None
+            if owner:
+                event = self._pending[key] = threading.Event()
+        if not owner:
+            event.wait()
+            with self._lock:
+                if key in self._values:
+                    return self._copy(self._values[key])
+            return self.get(key, load)
+        try:
+            value, cacheable = load()
+            if cacheable:
+                with self._lock:
+                    self._values[key] = self._copy(value)
+                    while self.size and len(self._values) > self.size:
+                        self._values.popitem(last=False)
+        finally:
+            with self._lock:
+                del self._pending[key]
+            event.set()
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def _copy(self, value):
+        return copy.deepcopy(value) if self.copy else value
+
+
+url_metas = MetaCache()
+file_metas = MetaCache()
+manifests = MetaCache(copy=False, size=64)
+
+MANIFEST = 'manifest.jsonl'
+
+
+class ManifestWriter(object):
+    """
+    Writes the job manifest, one JSON line with the path (relative to the
+    job dir) and metadata of each output file, as the files are added.
+    The manifest appears under its final name once closed.
+    """
+    def __init__(self, job_dir):
+        self.job_dir = job_dir
+        self.path = os.path.join(job_dir, MANIFEST)
+        self.fp = open(self.path + '.part', 'w')
+
+    def add(self, path, meta):
+        rel = os.path.relpath(path, self.job_dir)
+        self.fp.write(json.dumps({'path': rel, 'meta': meta},
+                                 sort_keys=True, default=six.text_type))
+        self.fp.write('\n')
+
+    def close(self):
+        self.fp.close()
+        os.rename(self.path + '.part', self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type:
+            self.fp.close()
+            os.remove(self.path + '.part')
+        else:
+            self.close()
+
+
+class Manifest(object):
+    """
+    A job manifest loaded into an index of metadata by absolute path.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        root = os.path.dirname(os.path.abspath(path))
+        with open(path) as fp:
+            for line in fp:
+                if line.strip():
+                    entry = json.loads(line)
+                    self.entries[os.path.normpath(os.path.join(
+                        root, entry['path']))] = entry.get('meta') or {}
+
+    def get(self, path):
+        meta = self.entries.get(os.path.abspath(path))
+        return copy.deepcopy(meta) if meta is not None else None
+
+    @classmethod
+    def find(cls, path):
+        """
+        Returns the manifest of the closest job dir above path, loading
+        each manifest once per process.
+        """
+        parent = os.path.dirname(os.path.abspath(path))
+        while True:
+            candidate = os.path.join(parent, MANIFEST)
+            try:
+                mtime = os.stat(candidate).st_mtime
+            except OSError:
+                if parent == os.path.dirname(parent):
+                    return None
+                parent = os.path.dirname(parent)
+                continue
+            return manifests.get((candidate, mtime),
+                                 lambda: (cls(candidate), True))
+
+
+def is_yes(value):
+    return value is True or six.text_type(value).lower() in ('yes', 'true')
+
+
+class StreamClosed(Exception):
+    pass
+
+
+class Stream(object):
+    """
+    A named pipe at path fed by feed(fp) on a background thread, which
+    blocks until the tool opens the pipe for reading. The reader may stop
+    early. close() stops the feeder and unblocks it if the pipe was never
+    opened.
+    """
+    def __init__(self, path, feed):
+        self.path = path
+        self.error = None
+        self.closed = False
+        self.written = 0
+        self._fp = None
+        os.mkfifo(path)
+        self.thread = threading.Thread(target=self._run, args=(feed,))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self, feed):
+        try:
+            with open(self.path, 'wb') as self._fp:
+                feed(self)
+        except StreamClosed:
+            log.debug('Stream %s closed', self.path)
+        except (IOError, OSError) as e:
+            if e.errno != errno.EPIPE:
+                self.error = e
+            log.debug('Reader of %s went away', self.path)
+        except (Exception, RabixError) as e:
+            log.error('Streaming to %s failed: %s', self.path, e)
+            self.error = e
+
+    def write(self, data):
+        if self.closed:
+            raise StreamClosed()
+        self._fp.write(data)
+        self.written += len(data)
+
+    def flush(self):
+        if self._fp:
+            self._fp.flush()
+
+    def tell(self):
+        return self.written
+
+    def fileno(self):
+        return self._fp.fileno()
+
+    def close(self):
+        self.closed = True
+        if self.thread.is_alive():
+            fd = os.open(self.path, os.O_RDONLY | os.O_NONBLOCK)
+            try:
+                while self.thread.is_alive():
+                    try:
+                        os.read(fd, 65536)
+                    except OSError as e:
+                        if e.errno != errno.EAGAIN:
+                            raise
+                    self.thread.join(0.01)
+            finally:
+                os.close(fd)
+        self.thread.join()
+
+
 class InputRunner(object):
     """
     Will handle local files, 'data:,' URLs (for tests) and delegate other
-    URLs to requests.get()
+    URLs to requests.get(). Inputs, their secondary files and metadata are
+    fetched concurrently by a pool of `workers` threads sharing one HTTP
+    session.
+
+    Downloads are streamed in chunk_size pieces to a '.part' file which is
+    renamed once complete. Dropped connections are resumed with Range
+    requests up to `retries` times. With `verify`, a 'checksum' of the form
+    'sha1$<hexdigest>' in the file's metadata is checked while streaming.
+    Given an InputCache, remote files are taken from or added to it.
+    Metadata of remote files is prefetched concurrently and, like local
+    '.meta' sidecars, cached for the life of the process.
+
+    Remote inputs marked streamable are not downloaded but delivered
+    through a named pipe in the task dir, fed while the tool runs. Call
+    close() once the tool has finished.
+
+    Inputs with a 'decompress' adapter option (a format, or Yes/'auto' to
+    go by extension) are decompressed into the task dir, while they are
+    downloaded or streamed.
+
+    Metadata of local files is taken from the manifest of the job that
+    produced them, or their '.meta' sidecar if they are not in one. With
+    `sidecars`, metadata of remote files is written next to them.
     """
-    def __init__(self, job, inputs, dir=None):
+    def __init__(self, job, inputs, dir=None, workers=8,
+                 chunk_size=4 * 1024 * 1024, retries=5, backoff=1.0,
+                 verify=True, cache=None, sidecars=True):
         self.inputs = inputs
         self.job = job
         self.dir = dir
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.retries = retries
+        self.backoff = backoff
+        self.verify = verify
+        self.cache = cache
+        self.sidecars = sidecars
+        import requests
+        self.session = requests.Session()
+        self.streams = []
+        self.cancelled = threading.Event()
+        self.failed = threading.Event()
+        self._lock = threading.RLock()
+        self._reserved = set()
 
     def __call__(self, *args, **kwargs):
         remaped_job = copy.deepcopy(self.job)
@@ -38,35 +324,99 @@ class InputRunner(object):
             self.inputs[i]['items']['type'] == 'directory',
             self.inputs[i]['items']['type'] == 'file'])
         input_values = self.job.get('inputs')
+        tasks = []
         if self.inputs:
             single = filter(is_single, [i for i in self.inputs])
             lists = filter(is_array, [i for i in self.inputs])
             for inp in single:
-                secondaryFiles = self.inputs[inp].get('adapter', {}).get(
-                    'secondaryFiles')
-                remaped_job['inputs'][inp]['path'] = self._download(
-                    input_values[inp]['path'])
-                remaped_job['inputs'][inp]['meta'] = self._meta(
-                    input_values[inp])
-                self._get_secondary_files(secondaryFiles, input_values[
-                    inp]['path'])
+                adapter = self.inputs[inp].get('adapter', {})
+                tasks += self._tasks(remaped_job['inputs'][inp],
+                                     input_values[inp], adapter)
             for inp in lists:
-                secondaryFiles = self.inputs[inp].get('adapter', {}).get(
-                    'secondaryFiles')
+                adapter = dict(self.inputs[inp].get('adapter', {}),
+                               **self.inputs[inp]['items'].get('adapter', {}))
                 for num, inv in enumerate(input_values[inp]):
-                    remaped_job['inputs'][inp][num]['path'] = self._download(
-                        input_values[inp][num]['path'])
-                    remaped_job['inputs'][inp][num]['meta'] = self._meta(inv)
-                    self._get_secondary_files(secondaryFiles, input_values[
-                        inp][num]['path'])
-            return remaped_job
+                    tasks += self._tasks(remaped_job['inputs'][inp][num],
+                                         inv, adapter)
+        try:
+            self._run_all(tasks)
+        except:
+            self.close(check=False)
+            raise
+        return remaped_job
+
+    def close(self, check=True):
+        """
+        Stops feeding streamed inputs. Raises ResourceUnavailable if any
+        of them failed, as the tool has then read incomplete data.
+        """
+        for stream in self.streams:
+            stream.close()
+        errors = [s for s in self.streams if s.error]
+        if check and errors:
+            raise ResourceUnavailable(
+                ', '.join(s.url for s in errors),
+                '\n'.join('%s: %s' % (s.url, s.error) for s in errors))
+
+    def cancel(self):
+        """
+        Aborts staging: downloads in flight stop at their next chunk, no
+        new ones start and streamed inputs stop being fed.
+        """
+        self.cancelled.set()
+        self.session.close()
+        self.close(check=False)
+
+    def _tasks(self, remaped, input, adapter):
+        """
+        Returns (url, callable) pairs prefetching metadata of remote files,
+        staging the input into remaped and downloading its secondary files.
+        """
+        urls = [input['path']] + [
+            secondary_file(input['path'], sf)
+            for sf in adapter.get('secondaryFiles') or []]
+        tasks = [(url, functools.partial(self._get_meta_for_url, url))
+                 for url in urls if is_remote(url)]
+        tasks.append((input['path'],
+                      lambda: self._stage(remaped, input, adapter)))
+        tasks += [(url, functools.partial(self._download, url))
+                  for url in urls[1:]]
+        return tasks
+
+    def _stage(self, remaped, input, adapter):
+        url = input['path']
+        stream = is_yes(adapter.get('streamable'))
+        fmt = compression.format_for(adapter.get('decompress'), url)
+        if fmt:
+            remaped['path'] = self._decompress(url, fmt, stream)
+        elif stream and is_remote(url):
+            remaped['path'] = self._stream(url)
+        else:
+            remaped['path'] = self._download(url)
+        remaped['meta'] = self._meta(input)
+
+    def _run_all(self, tasks):
+        """
+        Runs the staging tasks on the thread pool. After the first failure
+        no new task is started, downloads in flight stop at their next
+        chunk and all errors are raised together.
+        """
+        errors = run_all(tasks, self.workers, 'stage', self.cancelled,
+                         self.failed)
+        if self.cancelled.is_set():
+            raise RabixError('Staging of inputs cancelled.')
+        if errors:
+            raise ResourceUnavailable(
+                ', '.join(url for url, _ in errors),
+                '\n'.join('%s: %s' % (url, e) for url, e in errors))
 
     @property
     def task_dir(self):
-        if not self.dir:
-            self.dir = str(uuid.uuid4())
-        if not os.path.exists(self.dir):
-            os.mkdir(self.dir)
+        with self._lock:
+            if not self.dir:
+                self.dir = str(uuid.uuid4())
+            if not os.path.exists(self.dir):
+                os.mkdir(self.dir)
         return self.dir
 
     def _download(self, url):
@@ -77,39 +427,168 @@ class InputRunner(object):
         if url.startswith('file://'):
             return self._local(url)
 
-        log.debug('Downloading %s', url)
-        r = requests.get(url)
-        try:
-            r.raise_for_status()
-        except Exception as e:
-            raise ResourceUnavailable(str(e))
-        dest = self._get_dest_for_url(url)
-        with open(dest, 'wb') as fp:
-            for chunk in r.iter_content(chunk_size=1024):
-                fp.write(chunk)
         meta = self._get_meta_for_url(url)
-        if meta:
+        dest = self._get_dest_for_url(url)
+        checksum = meta.get('checksum') if meta and self.verify else None
+        if self.cache:
+            self.cache.fetch(url, dest, lambda url, path: self._fetch(
+                url, path, checksum))
+        else:
+            self._fetch(url, dest, checksum)
+        if meta and self.sidecars:
             with open(dest + '.meta', 'w') as fp:
                 to_json(meta, fp)
         return os.path.abspath(dest)
 
+    def _stream(self, url, dest=None, feed=None):
+        meta = self._get_meta_for_url(url) if is_remote(url) else None
+        dest = dest or self._get_dest_for_url(url)
+        checksum = meta.get('checksum') if meta and self.verify else None
+        log.debug('Streaming %s through %s', url, dest)
+        stream = Stream(dest, feed or (
+            lambda fp: self._copy_url(url, fp, checksum)))
+        stream.url = url
+        with self._lock:
+            self.streams.append(stream)
+        if meta and self.sidecars:
+            with open(dest + '.meta', 'w') as fp:
+                to_json(meta, fp)
+        return os.path.abspath(dest)
+
+    def _decompress(self, url, fmt, stream=False):
+        name = compression.strip_extension(
+            urlparse.urlparse(url).path.split('/')[-1])
+        dest = self._get_dest_for_url(url, name)
+        if is_remote(url) and not self.cache:
+            meta = self._get_meta_for_url(url)
+            checksum = meta.get('checksum') if meta and self.verify else None
+
+            def feed(fp):
+                writer = compression.DecompressingWriter(fp, fmt)
+                try:
+                    self._copy_url(url, writer, checksum)
+                except:
+                    writer.abort()
+                    raise
+                writer.close()
+        else:
+            src = self._download(url)
+
+            def feed(fp):
+                compression.decompress_to(src, fp, fmt)
+        log.debug('Decompressing %s (%s) to %s', url, fmt, dest)
+        if stream:
+            return self._stream(url, dest, feed)
+        self._write_atomic(dest, feed)
+        meta = self._get_meta_for_url(url) if is_remote(url) else None
+        if meta and self.sidecars:
+            with open(dest + '.meta', 'w') as fp:
+                to_json(meta, fp)
+        return os.path.abspath(dest)
+
+    def _fetch(self, url, dest, checksum=None):
+        self._write_atomic(dest, lambda fp: self._copy_url(url, fp, checksum))
+
+    @staticmethod
+    def _write_atomic(dest, feed):
+        part = dest + '.part'
+        try:
+            with open(part, 'wb') as fp:
+                feed(fp)
+        except:
+            os.remove(part)
+            raise
+        os.rename(part, dest)
+
+    def _copy_url(self, url, fp, checksum=None):
+        import requests
+        log.debug('Downloading %s', url)
+        method, hexdigest = checksum.split('$') if checksum else ('sha1', '')
+        digest = hashlib.new(method)
+        attempt = 0
+        while True:
+            try:
+                self._fetch_range(url, fp, digest)
+                break
+            except requests.RequestException as e:
+                self._check_stopped(url)
+                response = getattr(e, 'response', None)
+                if response is not None and response.status_code < 500:
+                    raise ResourceUnavailable(url, cause=e)
+                attempt += 1
+                if attempt > self.retries:
+                    raise ResourceUnavailable(url, 'Giving up after %s '
+                                              'retries.' % self.retries,
+                                              cause=e)
+                log.warning('Download of %s interrupted at %s bytes, '
+                            'retrying: %s', url, fp.tell(), e)
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+        if hexdigest and digest.hexdigest() != hexdigest:
+            raise ResourceUnavailable(url, 'Checksum does not match: %s' %
+                                      checksum)
+
+    def _fetch_range(self, url, fp, digest):
+        """
+        Appends the content of url past the current end of fp to it,
+        updating digest. If the server ignores the Range header the bytes
+        already written are skipped. Raises a RequestException if the
+        transfer ends early.
+        """
+        import requests
+        offset = fp.tell()
+        headers = {'Range': 'bytes=%s-' % offset} if offset else {}
+        r = self.session.get(url, stream=True, headers=headers)
+        r.raise_for_status()
+        skip = offset if r.status_code != 206 else 0
+        expected = r.headers.get('Content-Length')
+        if expected is not None:
+            expected = int(expected) + offset - skip
+        try:
+            for chunk in r.iter_content(chunk_size=self.chunk_size):
+                self._check_stopped(url)
+                if skip:
+                    chunk, skip = chunk[skip:], max(0, skip - len(chunk))
+                fp.write(chunk)
+                digest.update(chunk)
+        finally:
+            fp.flush()
+            r.close()
+        if expected is not None and fp.tell() < expected:
+            raise requests.ConnectionError('Got %s of %s bytes' %
+                                           (fp.tell(), expected))
+
+    def _check_stopped(self, url):
+        if self.cancelled.is_set():
+            raise RabixError('Download of %s cancelled.' % url)
+        if self.failed.is_set():
+            raise RabixError('Download of %s stopped, another input '
+                             'failed.' % url)
+
     def _get_meta_for_url(self, url):
+        return url_metas.get(url, lambda: self._load_meta_for_url(url))
+
+    def _load_meta_for_url(self, url):
+        import requests
         log.debug('Fetching metadata for %s', url)
         chunks = list(urlparse.urlparse(url))
         chunks[2] += '.meta'
         meta_url = urlparse.urlunparse(chunks)
-        r = requests.get(meta_url)
+        try:
+            r = self.session.get(meta_url)
+        except requests.RequestException as e:
+            log.warning('Failed to get metadata for URL %s: %s', url, e)
+            return None, False
         if not r.ok:
             log.warning('Failed to get metadata for URL %s', url)
-            return
+            return None, r.status_code in (403, 404, 410)
         try:
             meta = r.json()
             assert isinstance(meta, dict)
             log.info('Fetched metadata from %s', meta_url)
         except:
             log.warning('Metadata not valid JSON object: %s', meta_url)
-            return
-        return meta
+            return None, True
+        return meta, True
 
     def _data_url(self, url):
         data = url[len('data:,'):]
@@ -118,37 +597,42 @@ class InputRunner(object):
             fp.write(data)
         return os.path.abspath(dest)
 
-    def _get_dest_for_url(self, url):
+    def _get_dest_for_url(self, url, name=None):
         path = urlparse.urlparse(url).path
-        name = path.split('/')[-1]
+        name = name or path.split('/')[-1]
         tgt = os.path.join(self.task_dir, name)
-        if os.path.exists(tgt) or not name:
-            return tempfile.mktemp(dir=self.task_dir)
+        with self._lock:
+            if os.path.exists(tgt) or tgt in self._reserved or not name:
+                return tempfile.mktemp(dir=self.task_dir)
+            self._reserved.add(tgt)
         return tgt
 
     def _local(self, url):
         path = url[len('file://'):]
-        if not os.path.isfile(path):
+        if not (os.path.isfile(path) or is_pipe(path)):
             raise ResourceUnavailable('Not a file: %s' % path)
         return os.path.abspath(path)
 
     def _meta(self, input):
-        file_meta = {}
-        if os.path.exists(input['path'] + '.meta'):
-            with open(input['path'] + '.meta') as m:
-                file_meta = json.load(m)
+        if is_remote(input['path']):
+            file_meta = self._get_meta_for_url(input['path']) or {}
+        else:
+            manifest = Manifest.find(input['path'])
+            file_meta = manifest and manifest.get(input['path'])
+            if file_meta is None:
+                file_meta = self._read_meta(input['path'] + '.meta')
         job_meta = input.get('meta', {})
         file_meta.update(job_meta)
         return file_meta
 
-    def _get_secondary_files(self, secondaryFiles, input):
-        if secondaryFiles:
-            for sf in secondaryFiles:
-                log.info('Downloading: %s', self._secondary_file(input, sf))
-                self._download(self._secondary_file(input, sf))
+    @staticmethod
+    def _read_meta(path):
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            return {}
 
-    def _secondary_file(self, path, ext):
-        if ext.startswith('*'):
-            return ''.join([path, ext[1:]])
-        else:
-            return ''.join(['.'.join(path.split('.')[:-1]), ext])
+        def load():
+            with open(path) as m:
+                return json.load(m), True
+        return file_metas.get((os.path.abspath(path), mtime), load)
@@ -0,0 +1,70 @@
+import os
+import json
+import logging
+import threading
+import six
+
+from rabix.executors.io import output_files
+
+log = logging.getLogger(__name__)
+
+JOURNAL = 'journal.jsonl'
+
+
+class Journal(object):
+    """
+    Append-only log of a pipeline run in <run_dir>/journal.jsonl: the job
+    first, then one record per change of step status ('started',
+    'finished' with its outputs, or 'failed'). Each record is synced to
+    disk before the run goes on, so the state of a run survives a crash
+    of the process running it.
+    """
+
+    def __init__(self, run_dir):
+        self.path = os.path.join(run_dir, JOURNAL)
+        self._lock = threading.Lock()
+
+    def job(self, job):
+        self._append({'job': job})
+
+    def step(self, step_id, status, job_dir, outputs=None):
+        record = {'step': step_id, 'status': status, 'job_dir': job_dir}
+        if outputs is not None:
+            record['outputs'] = outputs
+        self._append(record)
+
+    def load(self):
+        """
+        Returns the job of the run and the last record of each step. A
+        record cut short by a crash ends the journal.
+        """
+        job, steps = None, {}
+        with open(self.path) as fp:
+            for line in fp:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    log.warning('Truncated record in %s', self.path)
+                    break
+                if 'job' in record:
+                    job = record['job']
+                else:
+                    steps[record['step']] = record
+        return job, steps
+
+    def _append(self, record):
+        line = json.dumps(record) + '\n'
+        with self._lock:
+            with open(self.path, 'a') as fp:
+                fp.write(line)
+                fp.flush()
+                os.fsync(fp.fileno())
+
+
+def outputs_exist(outputs):
+    """
+    Whether all output files of a step are still on disk.
+    """
+    return all(os.path.exists(f['path']) for f in output_files(outputs)
+               if isinstance(f, dict) and isinstance(
+                   f.get('path'), six.string_types))
@@ -0,0 +1,509 @@
+import os
+import copy
+import json
+import time
+import uuid
+import logging
+import threading
+import collections
+import six
+
+from rabix.cliche.adapter import Adapter
+from rabix.common.errors import RabixError, ValidationError
+from rabix.executors.history import critical_paths
+from rabix.executors.journal import Journal, outputs_exist
+from rabix.executors.runner import Runner
+from rabix.executors.scheduler import RESOURCES, scheduler_for
+
+log = logging.getLogger(__name__)
+
+
+def is_pipeline(doc):
+    return isinstance(doc, dict) and doc.get('$$type') == 'app/pipeline'
+
+
+class Pipeline(object):
+    """
+    An app/pipeline document as a graph of steps. Step inputs are wired
+    by name: 'step_id.output' refers to an output of another step, any
+    other name to an input of the pipeline. Sources given as a list are
+    gathered into an array. Step 'outputs' map step outputs to outputs of
+    the pipeline.
+
+    Inputs listed in a step's 'pipe' are fed, through a named pipe, by the
+    stdout output of the step they come from. Steps connected by pipes
+    form a group which runs concurrently, so other outputs of a step
+    cannot be wired to a step of its group.
+    """
+
+    def __init__(self, doc):
+        import networkx as nx
+        if not is_pipeline(doc):
+            raise ValidationError('Not an app/pipeline document.')
+        self.doc = doc
+        self.steps = collections.OrderedDict()
+        for step in doc['steps']:
+            if step['id'] in self.steps:
+                raise ValidationError('Duplicate step id: %s' % step['id'])
+            self.steps[step['id']] = step
+            self.tool(step['id'])
+        self.graph = nx.DiGraph()
+        for step_id, step in six.iteritems(self.steps):
+            self.graph.add_node(step_id)
+            for _, src in self._sources(step):
+                upstream, _ = self.source(src)
+                if upstream:
+                    self.graph.add_edge(upstream, step_id)
+        if not nx.is_directed_acyclic_graph(self.graph):
+            raise ValidationError('Pipeline steps form a cycle.')
+        self.pipes = self._pipes()
+        self.groups = self._groups()
+
+    def _pipes(self):
+        """
+        (upstream, output, downstream, input) of each piped input.
+        """
+        pipes = []
+        for step_id, step in six.iteritems(self.steps):
+            for port in step.get('pipe', []):
+                src = step.get('inputs', {}).get(port)
+                upstream, output = self.source(src) \
+                    if isinstance(src, six.string_types) else (None, None)
+                if not upstream:
+                    raise ValidationError(
+                        'Piped input %s.%s must come from a step output.' %
+                        (step_id, port))
+                if not self.is_stdout(upstream, output):
+                    raise ValidationError('Only stdout can be piped, %s.%s '
+                                          'is not.' % (upstream, output))
+                if any(p[:2] == (upstream, output) for p in pipes):
+                    raise ValidationError('%s.%s is piped to more than one '
+                                          'step.' % (upstream, output))
+                pipes.append((upstream, output, step_id, port))
+        return pipes
+
+    def _groups(self):
+        import networkx as nx
+        connected = nx.Graph()
+        connected.add_nodes_from(self.steps)
+        connected.add_edges_from((p[0], p[2]) for p in self.pipes)
+        order = list(nx.topological_sort(self.graph))
+        groups = {}
+        for component in nx.connected_components(connected):
+            group = tuple(s for s in order if s in component)
+            for step_id in group:
+                groups[step_id] = group
+        contracted = nx.DiGraph()
+        contracted.add_nodes_from(set(groups.values()))
+        contracted.add_edges_from((groups[a], groups[b])
+                                  for a, b in self.graph.edges()
+                                  if groups[a] != groups[b])
+        if not nx.is_directed_acyclic_graph(contracted):
+            raise ValidationError('Piped steps depend on each other '
+                                  'through other steps.')
+        # piped steps run at once, so only the piped output is there yet
+        for step_id, step in six.iteritems(self.steps):
+            for port, src in self._sources(step):
+                upstream, output = self.source(src)
+                if upstream and groups[upstream] == groups[step_id] and \
+                        (upstream, output, step_id, port) not in self.pipes:
+                    raise ValidationError(
+                        '%s.%s takes %s, which is not piped to it but comes '
+                        'from a step running alongside it.' %
+                        (step_id, port, src))
+        return groups
+
+    def is_stdout(self, step_id, output):
+        tool = self.tool(step_id)
+        adapter = tool.get('outputs', {}).get('properties', {}).get(
+            output, {}).get('adapter', {})
+        stdout = tool.get('adapter', {}).get('stdout')
+        return bool(adapter.get('stdout') or
+                    stdout and adapter.get('glob') == stdout)
+
+    def tool(self, step_id):
+        """
+        Tool of a step. The step app is inline or the name of one in the
+        'apps' of the document.
+        """
+        app = self.steps[step_id]['app']
+        if isinstance(app, six.string_types):
+            if app not in self.doc.get('apps', {}):
+                raise ValidationError('Step %s refers to unknown app %s.' %
+                                      (step_id, app))
+            app = self.doc['apps'][app]
+        if not isinstance(app, dict):
+            raise ValidationError('App of step %s is not an object.' %
+                                  step_id)
+        return app.get('tool', app)
+
+    def source(self, src):
+        """
+        Returns (step_id, output) for a step output and (None, name) for a
+        pipeline input.
+        """
+        step_id, _, port = src.partition('.')
+        if port and step_id in self.steps:
+            return step_id, port
+        return None, src
+
+    @property
+    def inputs(self):
+        """
+        Input schema of the pipeline, taken from the step inputs each
+        pipeline input is wired to.
+        """
+        props = {}
+        for step_id, step in six.iteritems(self.steps):
+            schema = self.tool(step_id).get('inputs', {}).get(
+                'properties', {})
+            for port, src in self._sources(step):
+                upstream, name = self.source(src)
+                if not upstream and port in schema:
+                    props.setdefault(name, schema[port])
+        return {'type': 'object', 'properties': props}
+
+    def ready(self, results, started=()):
+        """
+        Steps not yet started whose upstream steps all have results, apart
+        from those in the same group of piped steps.
+        """
+        return [s for s in self.steps if s not in started and all(
+            p in results for m in self.groups[s]
+            for p in self.graph.predecessors(m) if p not in self.groups[s])]
+
+    def step_job(self, step_id, job, results):
+        """
+        Job for a step, with inputs taken from the pipeline job and from
+        the outputs of upstream steps.
+        """
+        step = self.steps[step_id]
+        step_job = dict((k, copy.deepcopy(v)) for k, v in six.iteritems(job)
+                        if k != 'inputs')
+        inputs = copy.deepcopy(step.get('parameters', {}))
+        for port, src in six.iteritems(step.get('inputs', {})):
+            if isinstance(src, list):
+                inputs[port] = []
+                for value in (self._value(s, job, results) for s in src):
+                    if isinstance(value, list):
+                        inputs[port].extend(value)
+                    elif value is not None:
+                        inputs[port].append(value)
+            else:
+                value = self._value(src, job, results)
+                if value is not None:
+                    inputs[port] = value
+        step_job['inputs'] = inputs
+        return step_job
+
+    def outputs(self, results):
+        outputs = {}
+        for step_id, step in six.iteritems(self.steps):
+            for port, name in six.iteritems(
+                    step.get('outputs', step.get('output', {}))):
+                outputs[name] = results[step_id].get(port)
+        return outputs
+
+    def _value(self, src, job, results):
+        upstream, port = self.source(src)
+        if upstream:
+            return copy.deepcopy(results[upstream].get(port))
+        return copy.deepcopy(job.get('inputs', {}).get(port))
+
+    @staticmethod
+    def _sources(step):
+        for port, src in six.iteritems(step.get('inputs', {})):
+            for s in (src if isinstance(src, list) else [src]):
+                yield port, s
+
+
+class PipelineRunner(object):
+    """
+    Runs a pipeline with the given runner class (DockerRunner or
+    NativeRunner), each step in a job dir named after it under the run
+    dir. Steps are submitted to the scheduler as soon as their upstream
+    steps finish, so independent steps run concurrently. Once a step fails
+    no new steps are started, and the error is raised when the running
+    ones are done.
+
+    Ready steps are prioritised by the length of the longest path of
+    steps left from them to the end of the pipeline, each step weighted by
+    its runtime estimated from `history` (a RuntimeHistory) or as one unit
+    without it. Runtimes of finished steps are recorded to the history,
+    and predicted and actual times are written to stats.json in the run
+    dir.
+
+    The job and the status and outputs of steps are kept in the journal of
+    the run dir, from which a run is resumed: steps whose outputs are still
+    there are not run again.
+    """
+
+    def __init__(self, doc, runner, scheduler=None, history=None,
+                 **runner_kwargs):
+        self.pipeline = doc if isinstance(doc, Pipeline) else Pipeline(doc)
+        self.tool = {'inputs': self.pipeline.inputs}
+        self.runner = runner
+        self.runner_kwargs = runner_kwargs
+        self.scheduler = scheduler
+        self.history = history
+
+    def install(self):
+        for step_id in self.pipeline.steps:
+            self._runner(step_id).install()
+
+    def run_job(self, job, job_id=None, resume=False):
+        run_dir = os.path.abspath(job_id or str(uuid.uuid4()))
+        journal = Journal(run_dir)
+        if resume:
+            job, results = self._resume(journal, job)
+        else:
+            os.mkdir(run_dir)
+            journal.job(job)
+            results = {}
+        scheduler = self.scheduler or scheduler_for(
+            self.runner, working_dir=run_dir)
+        started, running, errors = set(results), set(), []
+        cond = threading.Condition()
+        estimates = dict((s, self._estimate(s, job))
+                         for s in self.pipeline.steps)
+        priorities = critical_paths(self.pipeline.graph, estimates)
+        times = {}
+
+        def submit():
+            for step_id in sorted(self.pipeline.ready(results, started),
+                                  key=lambda s: -priorities[s]):
+                if step_id in started:
+                    continue
+                group = self.pipeline.groups[step_id]
+                log.info('Starting step %s', '|'.join(group))
+                started.update(group)
+                try:
+                    runner, step_job, resources = self._prepare(
+                        group, job, results, run_dir)
+                    scheduler.submit(
+                        runner, step_job, job_id=os.path.join(
+                            run_dir, step_id), resources=resources,
+                        callback=lambda task, group=group: finished(
+                            group, task),
+                        priority=max(priorities[s] for s in group))
+                except (Exception, RabixError) as e:
+                    errors.append(('|'.join(group), e))
+                    return
+                running.add(group)
+                for s in group:
+                    journal.step(s, 'started', os.path.join(run_dir, s))
+
+        def finished(group, task):
+            with cond:
+                running.discard(group)
+                for step_id in group if task.started else ():
+                    times[step_id] = task.finished - task.started
+                if task.error:
+                    errors.append(('|'.join(group), task.error))
+                    for s in group:
+                        journal.step(s, 'failed', os.path.join(run_dir, s))
+                else:
+                    results.update(task.result if len(group) > 1
+                                   else {group[0]: task.result})
+                    for s in group:
+                        journal.step(s, 'finished', os.path.join(run_dir, s),
+                                     outputs=results[s])
+                    self._record(group, task)
+                    if not errors:
+                        submit()
+                cond.notify_all()
+
+        start = time.time()
+        try:
+            with cond:
+                submit()
+                while running:
+                    cond.wait()
+        finally:
+            if not self.scheduler:
+                scheduler.shutdown(wait=False)
+            self._write_stats(run_dir, estimates, priorities, times,
+                              time.time() - start)
+        if errors:
+            raise RabixError('\n'.join('Step %s failed: %s' % (s, e)
+                                       for s, e in errors))
+        outputs = self.pipeline.outputs(results)
+        with open(os.path.join(run_dir, 'result.json'), 'w') as f:
+            json.dump(outputs, f)
+        return outputs
+
+    def _resume(self, journal, job=None):
+        """
+        Job (unless given) and results of a run from its journal. Steps are
+        run again if they did not finish or their outputs are gone, along
+        with the steps piped to them and all steps downstream.
+        """
+        import networkx as nx
+        try:
+            saved, records = journal.load()
+        except (IOError, OSError) as e:
+            raise RabixError('Cannot resume run: %s' % e)
+        job = job or saved
+        if job is None:
+            raise RabixError('No job in %s' % journal.path)
+        rerun = set()
+        for step_id in self.pipeline.steps:
+            record = records.get(step_id, {})
+            if record.get('status') != 'finished':
+                rerun.add(step_id)
+            elif not outputs_exist(record['outputs']):
+                log.warning('Outputs of step %s are gone, running it again.',
+                            step_id)
+                rerun.add(step_id)
+        while True:
+            stale = set()
+            for step_id in rerun:
+                stale.update(self.pipeline.groups[step_id])
+                stale.update(nx.descendants(self.pipeline.graph, step_id))
+            if stale <= rerun:
+                break
+            rerun |= stale
+        results = dict((s, records[s]['outputs'])
+                       for s in self.pipeline.steps if s not in rerun)
+        log.info('Resuming run with %s of %s steps done', len(results),
+                 len(self.pipeline.steps))
+        return job, results
+
+    def _estimate(self, step_id, job):
+        """
+        Estimated runtime of a step, given cpu from its tool requirements
+        or else from the pipeline job.
+        """
+        if not self.history:
+            return 1.0
+        tool = self.pipeline.tool(step_id)
+        cpu = tool.get('requirements', {}).get('resources', {}).get('cpu')
+        if not isinstance(cpu, six.integer_types):
+            cpu = job.get('allocatedResources', {}).get('cpu', 1)
+        return self.history.estimate(tool, cpu)
+
+    def _record(self, group, task):
+        if not self.history:
+            return
+        for step_id in group:
+            resources = task.resources if len(group) == 1 \
+                else task.runner.allocated[step_id]
+            self.history.record(self.pipeline.tool(step_id),
+                                task.finished - task.started,
+                                resources.get('cpu', 1))
+
+    def _write_stats(self, run_dir, estimates, priorities, times, makespan):
+        stats = {
+            'makespan': makespan,
+            'steps': dict((s, {'predicted': estimates[s],
+                               'actual': times.get(s),
+                               'priority': priorities[s]})
+                          for s in self.pipeline.steps)
+        }
+        if self.history:
+            stats['predicted_makespan'] = max(priorities.values() or [0])
+            log.info('Pipeline finished in %.1fs, predicted %.1fs',
+                     makespan, stats['predicted_makespan'])
+            try:
+                self.history.save()
+            except (IOError, OSError) as e:
+                log.warning('Could not save runtime history: %s', e)
+        with open(os.path.join(run_dir, 'stats.json'), 'w') as f:
+            json.dump(stats, f, indent=2)
+
+    def _prepare(self, group, job, results, run_dir):
+        """
+        Runner, job and resources (None to use the runner's) to submit for
+        a group of steps. Piped steps are run by a PipeGroup, with a named
+        pipe created in place of the stdout of each upstream step.
+        """
+        if len(group) == 1:
+            step_id = group[0]
+            return (self._runner(step_id),
+                    self.pipeline.step_job(step_id, job, results), None)
+        results = dict(results)
+        members, pipes = [], []
+        for step_id in group:
+            runner = self._runner(step_id)
+            step_job = self.pipeline.step_job(step_id, job, results)
+            job_dir = os.path.join(run_dir, step_id)
+            members.append((step_id, runner, step_job, job_dir))
+            for up, output, down, _ in self.pipeline.pipes:
+                if up != step_id:
+                    continue
+                Runner._make_dir(job_dir)
+                fifo = os.path.join(job_dir, Adapter(
+                    runner.tool)._get_stdout_name(step_job))
+                if os.path.lexists(fifo):
+                    os.remove(fifo)
+                os.mkfifo(fifo)
+                results.setdefault(step_id, {})[output] = {'path': fifo}
+                pipes.append((up, down, fifo))
+        group_runner = PipeGroup(members, pipes)
+        return group_runner, None, group_runner.resources
+
+    def _runner(self, step_id):
+        return self.runner(self.pipeline.tool(step_id), **self.runner_kwargs)
+
+
+class PipeGroup(object):
+    """
+    Runs steps connected by named pipes concurrently, as one job of the
+    scheduler which allocates the sum of their resources. Pipe buffers
+    give backpressure. When one side of a pipe finishes, the other side
+    is kept from blocking on it: a reader left without a writer gets end
+    of file and a writer left without a reader gets a broken pipe, so
+    failure of either side surfaces instead of hanging.
+    """
+
+    tool = {}
+
+    def __init__(self, members, pipes):
+        self.members = members
+        self.pipes = pipes
+        self.resources = dict((k, 0) for k in RESOURCES)
+        self.allocated = {}
+        for step_id, runner, job, _ in members:
+            allocated = Adapter(runner.tool).allocated_resources(job)
+            self.allocated[step_id] = allocated
+            for k in RESOURCES:
+                self.resources[k] += allocated.get(k, 0)
+
+    def run_job(self, job=None, job_id=None):
+        results, errors = {}, []
+        done = dict((m[0], threading.Event()) for m in self.members)
+
+        def run(step_id, runner, job, job_dir):
+            try:
+                results[step_id] = runner.run_job(job, job_id=job_dir)
+            except (Exception, RabixError) as e:
+                log.error('Piped step %s failed: %s', step_id, e)
+                errors.append((step_id, e))
+            finally:
+                done[step_id].set()
+
+        threads = [threading.Thread(target=run, args=m)
+                   for m in self.members]
+        threads += [threading.Thread(target=self._release, args=(
+            fifo, done[up], done[down])) for up, down, fifo in self.pipes]
+        for t in threads:
+            t.daemon = True
+            t.start()
+        for t in threads:
+            t.join()
+        if errors:
+            raise RabixError('\n'.join('Step %s failed: %s' % (s, e)
+                                       for s, e in errors))
+        return results
+
+    @staticmethod
+    def _release(fifo, writer_done, reader_done):
+        while not (writer_done.is_set() and reader_done.is_set()):
+            try:
+                if writer_done.is_set():
+                    os.close(os.open(fifo, os.O_WRONLY | os.O_NONBLOCK))
+                elif reader_done.is_set():
+                    os.close(os.open(fifo, os.O_RDONLY | os.O_NONBLOCK))
+            except OSError:
+                pass
+            time.sleep(0.05)
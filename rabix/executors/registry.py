@@ -0,0 +1,200 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+import docopt
+import six
+
+from rabix.cliche.ref_resolver import loader
+
+log = logging.getLogger(__name__)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    tool TEXT NOT NULL,
+    tool_name TEXT,
+    inputs TEXT,
+    status TEXT NOT NULL,
+    started REAL,
+    finished REAL,
+    exit_code INTEGER,
+    outputs TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_tool ON jobs (tool, started);
+CREATE INDEX IF NOT EXISTS jobs_tool_name ON jobs (tool_name, started);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, started);
+CREATE INDEX IF NOT EXISTS jobs_started ON jobs (started);
+'''
+
+COLUMNS = ('job_id', 'tool', 'tool_name', 'inputs', 'status', 'started',
+           'finished', 'exit_code', 'outputs', 'error')
+
+
+def tool_name(tool):
+    """
+    >>> tool_name({'adapter': {'baseCmd': ['bwa', 'mem']}})
+    'bwa mem'
+    """
+    name = (tool.get('softwareDescription') or {}).get('name')
+    if name:
+        return name
+    cmd = tool.get('adapter', {}).get('baseCmd', [])
+    cmd = cmd if isinstance(cmd, list) else [cmd]
+    return ' '.join(c for c in cmd if isinstance(c, six.string_types))
+
+
+class JobRegistry(object):
+    """
+    Record of jobs run on this host in a SQLite database, by default under
+    the XDG data dir: the tool (checksum and name), inputs, status
+    ('running', 'finished', 'failed'), start and finish time, exit code,
+    outputs and error of each job, keyed by its job dir. Indexed by tool,
+    status and start time for queries across many runs. Recording is
+    best-effort: a job does not fail because the database does.
+    """
+
+    def __init__(self, path=None):
+        if not path:
+            from xdg.BaseDirectory import save_data_path
+            path = os.path.join(save_data_path('rabix'), 'jobs.db')
+        self.path = path
+        self._local = threading.local()
+        self._db().executescript(SCHEMA)
+
+    def _db(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=60)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.row_factory = sqlite3.Row
+            self._local.db = db
+        return db
+
+    def start(self, job_id, tool, job):
+        self._write(
+            job_id, 'INSERT OR REPLACE INTO jobs (job_id, tool, tool_name, '
+            'inputs, status, started) VALUES (?, ?, ?, ?, ?, ?)',
+            (job_id, loader.checksum(tool), tool_name(tool),
+             json.dumps(job.get('inputs', {})), 'running', time.time()))
+
+    def finish(self, job_id, status, outputs=None, exit_code=None,
+               error=None):
+        self._write(
+            job_id, 'UPDATE jobs SET status = ?, finished = ?, exit_code = ?, '
+            'outputs = ?, error = ? WHERE job_id = ?',
+            (status, time.time(), exit_code,
+             None if outputs is None else json.dumps(outputs),
+             None if error is None else six.text_type(error), job_id))
+
+    def _write(self, job_id, query, args):
+        try:
+            with self._db() as db:
+                db.execute(query, args)
+        except sqlite3.Error as e:
+            log.warning('Could not record job %s in %s: %s', job_id,
+                        self.path, e)
+
+    def get(self, job_id):
+        rows = self._db().execute('SELECT * FROM jobs WHERE job_id = ?',
+                                  (job_id,)).fetchall()
+        return self._record(rows[0]) if rows else None
+
+    def find(self, tool=None, status=None, since=None, limit=None):
+        """
+        Jobs, latest first. tool matches the tool name or a prefix of its
+        checksum, since is a unix time.
+        """
+        query, args = 'SELECT * FROM jobs', []
+        where = []
+        if tool:
+            where.append('(tool_name = ? OR tool LIKE ?)')
+            args += [tool, tool + '%']
+        if status:
+            where.append('status = ?')
+            args.append(status)
+        if since:
+            where.append('started >= ?')
+            args.append(since)
+        if where:
+            query += ' WHERE ' + ' AND '.join(where)
+        query += ' ORDER BY started DESC'
+        if limit:
+            query += ' LIMIT ?'
+            args.append(limit)
+        return [self._record(r) for r in self._db().execute(query, args)]
+
+    def counts(self, since=None):
+        """
+        Number of jobs per tool name and status.
+        """
+        query, args = ('SELECT tool_name, status, COUNT(*) FROM jobs', [])
+        if since:
+            query += ' WHERE started >= ?'
+            args.append(since)
+        query += ' GROUP BY tool_name, status ORDER BY tool_name, status'
+        return self._db().execute(query, args).fetchall()
+
+    @staticmethod
+    def _record(row):
+        record = dict(zip(COLUMNS, (row[c] for c in COLUMNS)))
+        for k in ('inputs', 'outputs'):
+            if record[k] is not None:
+                record[k] = json.loads(record[k])
+        return record
+
+
+def open_registry(path=None):
+    """
+    JobRegistry at path, or None (with a warning) if it cannot be opened.
+    """
+    try:
+        return JobRegistry(path)
+    except (sqlite3.Error, OSError) as e:
+        log.warning('Not recording jobs, cannot open the registry: %s', e)
+        return None
+
+
+JOBS_USAGE = '''
+Usage:
+    rabix jobs [--registry <db>] [--tool <tool>] [--status <status>]
+               [--since <hours>] [--limit <n>] [--json]
+    rabix jobs --counts [--registry <db>] [--since <hours>]
+
+Options:
+  --registry=<db>     Job database, jobs.db in the XDG data dir by default.
+  --tool=<tool>       Only jobs of the tool with this name or checksum
+                      prefix.
+  --status=<status>   Only jobs with this status (running, finished, failed).
+  --since=<hours>     Only jobs started in the last <hours> hours.
+  --limit=<n>         Show at most <n> jobs [default: 100].
+  --json              Print each job as a JSON line.
+  --counts            Print the number of jobs per tool and status.
+'''
+
+
+def jobs_main(argv=None):
+    args = docopt.docopt(JOBS_USAGE, argv)
+    registry = JobRegistry(args['--registry'])
+    since = args['--since'] and time.time() - float(args['--since']) * 3600
+    if args['--counts']:
+        for name, status, count in registry.counts(since):
+            print('%8d  %-9s %s' % (count, status, name))
+        return
+    jobs = registry.find(args['--tool'], args['--status'], since,
+                         int(args['--limit'] or 0) or None)
+    for job in jobs:
+        if args['--json']:
+            print(json.dumps(job, sort_keys=True))
+            continue
+        duration = job['finished'] - job['started'] \
+            if job['finished'] else time.time() - job['started']
+        print('%s  %-9s %4s %8.1fs  %s  %s' % (
+            time.strftime('%Y-%m-%d %H:%M:%S',
+                          time.localtime(job['started'])),
+            job['status'], '' if job['exit_code'] is None
+            else job['exit_code'], duration, job['tool_name'],
+            job['job_id']))
@@ -1,45 +1,394 @@
 import os
-import docker
 import six
 import json
 import logging
 import uuid
+import time
 import stat
+import signal
+import weakref
+import threading
 import copy
+import shutil
+import tempfile
+import resource
+import subprocess
 
-from multiprocessing import Process
-from rabix.executors.io import InputRunner
-from rabix.executors.container import Container, ensure_image
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+from rabix.executors.io import InputRunner, ManifestWriter, output_files
+from rabix.executors.compression import compress_file
 from rabix.cliche.adapter import Adapter
-from rabix.tests import infinite_loop, infinite_read
+from rabix.common.errors import JobCancelled, RabixError
 
 
 log = logging.getLogger(__name__)
 
+_runners = weakref.WeakSet()
+
+
+def cancel_all():
+    """
+    Cancels the jobs of all runners of this process: running ones are
+    stopped and new ones fail as they start.
+    """
+    for runner in list(_runners):
+        runner.cancel_all()
+
 
 class BindDict(dict):
+    def __init__(self, *args, **kwargs):
+        super(BindDict, self).__init__(*args, **kwargs)
+        self.read_only = set()
+
     def items(self):
         ret = []
         for k, v in six.iteritems(super(BindDict, self)):
-            ret.append((v, k))
+            if k in self.read_only:
+                ret.append((v, {'bind': k, 'ro': True}))
+            else:
+                ret.append((v, k))
         return ret
 
 
+def is_subdir(path, parent):
+    """
+    >>> is_subdir('/a/b/c', '/a/b'), is_subdir('/a/bc', '/a/b')
+    (True, False)
+    """
+    return path == parent or path.startswith(parent.rstrip('/') + '/')
+
+
+def coalesce_dirs(dirs):
+    """
+    Returns the minimal list of directories covering all of dirs, dropping
+    every directory that is nested in another one.
+
+    >>> coalesce_dirs(['/a/b/c', '/a/b', '/a/b-x', '/a/b'])
+    ['/a/b', '/a/b-x']
+    """
+    roots = []
+    for d in sorted(set(dirs), key=lambda p: p.split('/')):
+        if not (roots and is_subdir(d, roots[-1])):
+            roots.append(d)
+    return roots
+
+
+def timed(timing, name, fn, *args):
+    """
+    Calls fn, recording how long it took under name in timing.
+    """
+    start = time.time()
+    try:
+        return fn(*args)
+    finally:
+        timing[name] = time.time() - start
+
+
+class CommandFailed(RuntimeError):
+    def __init__(self, message, exit_code=None):
+        super(CommandFailed, self).__init__(message)
+        self.exit_code = exit_code
+
+
 class Runner(object):
     WORKING_DIR = '/work'
+    INPUTS_DIR = '/rabix-inputs'
+    JOB_DIR = '/rabix-job'
 
-    def __init__(self, tool, working_dir='./', stdout=None, stderr='out.err'):
+    def __init__(self, tool, working_dir='./', stdout=None, stderr='out.err',
+                 scratch=None, cache=None, export=None, sidecars=False,
+                 call_cache=None, registry=None):
         if not os.path.isabs(working_dir):
             working_dir = os.path.abspath(working_dir)
         self.tool = tool
-        self.enviroment = tool['requirements']['environment']
+        self.adapter = Adapter(tool)
+        self.enviroment = tool.get('requirements', {}).get('environment', {})
         self.working_dir = working_dir
         self.stdout = stdout
         self.stderr = stderr
+        self.scratch = scratch or os.getenv('RABIX_SCRATCH')
+        self.cache = cache
+        self.export = export
+        self.sidecars = sidecars
+        self.call_cache = call_cache
+        self.registry = registry
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._running = {}
+        self._cancelled = set()
+        self._cancel_all = False
+        _runners.add(self)
 
-    def run_job(self, job):
+    def run_job(self, job, job_id=None):
+        job_dir = os.path.abspath(job_id or self.rnd_name())
+        if self._cancel_all:
+            raise JobCancelled(job_dir)
+        self._local.job_dir = job_dir
+        if self.registry:
+            self.registry.start(job_dir, self.tool, job)
+        try:
+            outputs = self._run_job(job, job_dir)
+        except (Exception, RabixError) as e:
+            cancelled = self._is_cancelled(job_dir)
+            if self.registry:
+                self.registry.finish(
+                    job_dir, 'cancelled' if cancelled else 'failed', error=e,
+                    exit_code=getattr(e, 'exit_code', None))
+            if cancelled:
+                raise JobCancelled(job_dir)
+            raise
+        finally:
+            with self._lock:
+                self._running.pop(job_dir, None)
+                self._cancelled.discard(job_dir)
+        if self.registry:
+            self.registry.finish(job_dir, 'finished', outputs=outputs)
+        return outputs
+
+    def cancel(self, job_id):
+        """
+        Stops the job running in job dir job_id, which then raises
+        JobCancelled: its input downloads are aborted and its process or
+        container killed. A job not started yet is stopped as it starts.
+        """
+        job_dir = os.path.abspath(job_id)
+        with self._lock:
+            self._cancelled.add(job_dir)
+            handles = list(self._running.get(job_dir, ()))
+        log.info('Cancelling job %s', job_dir)
+        for handle in handles:
+            self._kill(handle)
+
+    def cancel_all(self):
+        with self._lock:
+            self._cancel_all = True
+            handles = [h for hs in self._running.values() for h in hs]
+        for handle in handles:
+            self._kill(handle)
+
+    def _is_cancelled(self, job_dir):
+        return self._cancel_all or job_dir in self._cancelled
+
+    def _started(self, handle):
+        """
+        Registers an InputRunner, process or container working on the job
+        of this thread, to be stopped if the job is cancelled.
+        """
+        job_dir = getattr(self._local, 'job_dir', None)
+        with self._lock:
+            self._running.setdefault(job_dir, []).append(handle)
+            cancelled = self._is_cancelled(job_dir)
+        if cancelled:
+            self._kill(handle)
+
+    def _kill(self, handle):
+        if isinstance(handle, InputRunner):
+            handle.cancel()
+        else:
+            self._stop(handle)
+
+    def _stop(self, handle):
         pass
 
+    def _run_job(self, job, job_dir):
+        self._make_dir(job_dir)
+        key = self._call_key(job)
+        outputs = self.call_cache.get(key, job_dir) if key else None
+        if outputs is not None:
+            log.info('Call cache hit for job %s', job_dir)
+        else:
+            outputs = self._run(job, job_dir)
+            if key:
+                self.call_cache.put(key, outputs, job_dir)
+        outputs = self._write_result(outputs, job_dir)
+        if self.export:
+            self.export(outputs, job_dir)
+        return outputs
+
+    def _run(self, job, job_dir):
+        adapter = self.adapter
+        timing = {}
+        start = time.time()
+        scratch = None
+        if not self._stdout_piped(job, job_dir):
+            scratch = self._make_scratch_dir(adapter, job)
+        run_dir = job_dir
+        try:
+            if scratch:
+                run_dir = os.path.join(scratch, os.path.basename(job_dir))
+                self._make_dir(run_dir)
+            input_runner = self._input_runner(job, run_dir)
+            self._started(input_runner)
+            job = self._prepare(input_runner, timing)
+            try:
+                timed(timing, 'execute', self._execute, adapter, job,
+                      run_dir)
+                input_runner.close()
+            finally:
+                input_runner.close(check=False)
+                if scratch:
+                    self._move(os.path.join(run_dir, self.stderr),
+                               run_dir, job_dir)
+            outputs = timed(timing, 'outputs', lambda: self._compress_outputs(
+                adapter.get_outputs(run_dir, job)))
+            if scratch:
+                outputs = self._move_outputs(outputs, run_dir, job_dir)
+            timing['total'] = time.time() - start
+            self._write_timing(timing, job_dir)
+            return outputs
+        finally:
+            if scratch:
+                shutil.rmtree(scratch, ignore_errors=True)
+
+    def _prepare(self, input_runner, timing):
+        """
+        Stages inputs while the image of the tool is pulled, if it has to
+        be, and returns the job with staged inputs. The command line is
+        built after, as its expressions may refer to staged paths.
+        """
+        errors = []
+
+        def pull():
+            try:
+                timed(timing, 'image', self.install)
+            except (Exception, RabixError) as e:
+                errors.append(e)
+        start = time.time()
+        thread = threading.Thread(target=pull)
+        thread.daemon = True
+        thread.start()
+        job = timed(timing, 'inputs', input_runner)
+        thread.join()
+        if errors:
+            raise errors[0]
+        timing['prepare'] = time.time() - start
+        timing['saved'] = max(0.0, timing['inputs'] + timing['image'] -
+                              timing['prepare'])
+        return job
+
+    @staticmethod
+    def _write_timing(timing, job_dir):
+        log.info('Job %s took %.2fs: staging %.2fs and image %.2fs in '
+                 '%.2fs (%.2fs saved), command %.2fs, outputs %.2fs',
+                 job_dir, timing['total'], timing['inputs'],
+                 timing['image'], timing['prepare'], timing['saved'],
+                 timing['execute'], timing['outputs'])
+        with open(os.path.join(job_dir, 'timing.json'), 'w') as f:
+            json.dump(timing, f, indent=2, sort_keys=True)
+
+    def _call_key(self, job):
+        if not self.call_cache:
+            return None
+        try:
+            return self.call_cache.key(self.tool, job)
+        except (IOError, OSError) as e:
+            log.warning('Not using call cache: %s', e)
+            return None
+
+    def _execute(self, adapter, job, job_dir):
+        raise NotImplementedError()
+
+    def _write_result(self, outputs, job_dir):
+        """
+        Records output metadata in the job manifest and, in compatibility
+        mode (sidecars), in a '.meta' file next to each output.
+        """
+        with ManifestWriter(job_dir) as manifest:
+            for out in output_files(outputs):
+                meta = out.pop('meta', {})
+                manifest.add(out['path'], meta)
+                if self.sidecars:
+                    with open(out['path'] + '.meta', 'w') as m:
+                        json.dump(meta, m)
+        with open(os.path.join(job_dir, 'result.json'), 'w') as f:
+            json.dump(outputs, f)
+        return outputs
+
+    @staticmethod
+    def _make_dir(path):
+        if not os.path.isdir(path):
+            os.mkdir(path)
+        os.chmod(path, os.stat(path).st_mode | stat.S_IROTH | stat.S_IWOTH)
+
+    def _stdout_piped(self, job, job_dir):
+        """
+        Whether stdout goes to a named pipe created in job_dir beforehand,
+        to feed another job. The job then has to run in job_dir.
+        """
+        if not self.adapter.stdout:
+            return False
+        try:
+            path = os.path.join(job_dir, self.adapter._get_stdout_name(job))
+            return stat.S_ISFIFO(os.stat(path).st_mode)
+        except OSError:
+            return False
+
+    def _make_scratch_dir(self, adapter, job):
+        """
+        Returns a fresh directory under the scratch root, or None if no
+        scratch root is configured or it has less free space than the
+        job's diskSpace (MB).
+        """
+        if not self.scratch:
+            return None
+        fs = os.statvfs(self.scratch)
+        free = fs.f_bavail * fs.f_frsize // (1024 * 1024)
+        needed = adapter.allocated_resources(job).get('diskSpace', 0)
+        if needed > free:
+            log.warning('Scratch %s has %sMB free, job needs %sMB. '
+                        'Running in job dir.', self.scratch, free, needed)
+            return None
+        return tempfile.mkdtemp(prefix='rabix-', dir=self.scratch)
+
+    def _move_outputs(self, outputs, src_dir, dst_dir):
+        for out in output_files(outputs):
+            out['path'] = self._move(out['path'], src_dir, dst_dir)
+        return outputs
+
+    def _compress_outputs(self, outputs):
+        """
+        Compresses in parallel the outputs whose adapter has a 'compress'
+        option ('gzip' or 'bzip2'), splitting the cores between files.
+        """
+        schema = self.tool.get('outputs', {}).get('properties', {})
+        todo = []
+        for k, v in six.iteritems(outputs):
+            fmt = schema.get(k, {}).get('adapter', {}).get('compress')
+            if fmt:
+                todo += [(out, fmt) for out in output_files({k: v})]
+        if not todo:
+            return outputs
+        threads = max(1, cpu_count() // len(todo))
+
+        def compress(item):
+            out, fmt = item
+            out['path'] = compress_file(out['path'], fmt, threads)
+        pool = ThreadPool(min(len(todo), cpu_count()))
+        try:
+            pool.map(compress, todo, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+        return outputs
+
+    @staticmethod
+    def _move(path, src_dir, dst_dir):
+        """
+        Hard-links path from src_dir to the same relative place in dst_dir,
+        moving it when the two are on different filesystems.
+        """
+        dest = os.path.join(dst_dir, os.path.relpath(path, src_dir))
+        if not os.path.exists(path):
+            return dest
+        if not os.path.isdir(os.path.dirname(dest)):
+            os.makedirs(os.path.dirname(dest))
+        try:
+            os.link(path, dest)
+        except OSError:
+            shutil.move(path, dest)
+        return dest
+
     def rnd_name(self):
         return str(uuid.uuid4())
 
@@ -47,50 +396,88 @@ class Runner(object):
         pass
 
     def provide_files(self, job, dir=None):
+        return self._input_runner(job, dir)()
+
+    def _input_runner(self, job, dir=None):
         return InputRunner(job, self.tool.get('inputs', {}).get(
-            'properties'), dir)()
+            'properties'), dir, cache=self.cache, sidecars=self.sidecars)
 
 
 class DockerRunner(Runner):
-    def __init__(self, tool, working_dir='./', dockr=None, stderr=None):
+    def __init__(self, tool, working_dir='./', dockr=None, stderr=None,
+                 scratch=None, cache=None, export=None, sidecars=False,
+                 call_cache=None, registry=None):
         stdout = tool.get('adapter', {}).get('stdout', None)
-        super(DockerRunner, self).__init__(tool, working_dir, stdout)
-        self.docker_client = dockr or docker.Client(os.getenv(
-            "DOCKER_HOST", None), version='1.12')
+        super(DockerRunner, self).__init__(tool, working_dir, stdout,
+                                           scratch=scratch, cache=cache,
+                                           export=export, sidecars=sidecars,
+                                           call_cache=call_cache,
+                                           registry=registry)
+        if dockr is None:
+            import docker
+            dockr = docker.Client(os.getenv("DOCKER_HOST", None),
+                                  version='1.12')
+        self.docker_client = dockr
+        self._pull_lock = threading.Lock()
+        self._pulled = False
 
-    def _volumes(self, job):
+    def _volumes(self, job, job_dir=None):
+        """
+        Plans the bind mounts for the job. Input files are grouped by the
+        host directory they live in and each group (directories nested in
+        another one are folded into it) gets a single read-only bind, so
+        thousands of inputs from one directory become one mount. Files
+        already inside job_dir are reached through the job dir mount.
+        """
         remaped_job = copy.deepcopy(job)
         volumes = {}
-        binds = {}
+        binds = BindDict()
         is_single = lambda i: any([inputs[i]['type'] == 'directory',
                                   inputs[i]['type'] == 'file'])
         is_array = lambda i: inputs[i]['type'] == 'array' and any([
             inputs[i]['items']['type'] == 'directory',
             inputs[i]['items']['type'] == 'file'])
 
-        inputs = self.tool.get('inputs', {}).get('properties')
-        input_values = remaped_job.get('inputs')
-        if inputs:
-            single = filter(is_single, [i for i in inputs])
-            lists = filter(is_array, [i for i in inputs])
-            for inp in single:
-                docker_dir = '/' + inp
-                dir_name, file_name = os.path.split(
-                    os.path.abspath(input_values[inp]['path']))
-                volumes[docker_dir] = {}
-                binds[docker_dir] = dir_name
-                remaped_job['inputs'][inp]['path'] = '/'.join(
-                    [docker_dir, file_name])
-            for inp in lists:
-                for num, inv in enumerate(input_values[inp]):
-                    docker_dir = '/' + '/'.join([inp, str(num)])
-                    dir_name, file_name = os.path.split(
-                        os.path.abspath(inv['path']))
-                    volumes[docker_dir] = {}
-                    binds[docker_dir] = dir_name
-                    remaped_job['inputs'][inp][num]['path'] = '/'.join(
-                        [docker_dir, file_name])
-            return volumes, BindDict(binds), remaped_job
+        inputs = self.tool.get('inputs', {}).get('properties') or {}
+        input_values = remaped_job.get('inputs', {})
+        files = []
+        for inp in inputs:
+            if inp not in input_values:
+                continue
+            if is_single(inp):
+                files.append(input_values[inp])
+            elif is_array(inp):
+                files.extend(input_values[inp])
+
+        mounts = {}
+        if job_dir:
+            docker_dir = self._job_mount(job_dir)
+            mounts[os.path.abspath(job_dir)] = docker_dir
+            volumes[docker_dir] = {}
+            binds[docker_dir] = os.path.abspath(job_dir)
+
+        dirs = [os.path.dirname(os.path.abspath(f['path'])) for f in files]
+        dirs = coalesce_dirs(d for d in dirs if not any(
+            is_subdir(d, m) for m in mounts))
+        for num, dir_name in enumerate(dirs):
+            docker_dir = '/'.join([self.INPUTS_DIR, str(num)])
+            mounts[dir_name] = docker_dir
+            volumes[docker_dir] = {}
+            binds[docker_dir] = dir_name
+            binds.read_only.add(docker_dir)
+
+        for f in files:
+            path = os.path.abspath(f['path'])
+            root = os.path.dirname(path)
+            while root not in mounts:
+                root = os.path.dirname(root)
+            f['path'] = mounts[root] + path[len(root.rstrip('/')):]
+        return volumes, binds, remaped_job
+
+    def _job_mount(self, job_dir):
+        # under a prefix, so a job named like a system dir does not hide it
+        return '/'.join([self.JOB_DIR,
+                         os.path.basename(os.path.abspath(job_dir))])
 
     @property
     def _envvars(self):
@@ -105,6 +492,7 @@ class DockerRunner(Runner):
         volumes = vol or {self.WORKING_DIR: {}}
         working_dir = work_dir or self.WORKING_DIR
         user = user or ':'.join([str(os.getuid()), str(os.getgid())])
+        from rabix.executors.container import Container
         container = Container(self.docker_client,
                               self.enviroment['container']['imageId'],
                               self.enviroment['container']['uri'],
@@ -115,71 +503,106 @@ class DockerRunner(Runner):
         container.start(binds)
         return container
 
-    def run_job(self, job, job_id=None):
-        job_dir = job_id or self.rnd_name()
-        os.mkdir(job_dir)
-        os.chmod(job_dir, os.stat(job_dir).st_mode | stat.S_IROTH |
-                 stat.S_IWOTH)
-        job = self.provide_files(job, os.path.abspath(job_dir))
-        adapter = Adapter(self.tool)
-        volumes, binds, remaped_job = self._volumes(job)
-        volumes['/' + job_dir] = {}
-        binds['/' + job_dir] = os.path.abspath(job_dir)
+    def _execute(self, adapter, job, job_dir):
+        volumes, binds, remaped_job = self._volumes(job, job_dir)
         container = self._run(['bash', '-c', adapter.cmd_line(remaped_job)],
                               vol=volumes, bind=binds, env=self._envvars,
-                              work_dir='/' + job_dir)
-        container.get_stderr(file='/'.join([os.path.abspath(job_dir),
-                                            self.stderr]))
+                              work_dir=self._job_mount(job_dir))
+        self._started(container)
+        container.get_stderr(file=os.path.join(job_dir, self.stderr))
         if not container.is_success():
-            raise RuntimeError("err %s" % container.get_stderr())
-        with open(os.path.abspath(job_dir) + '/result.json', 'w') as f:
-            outputs = adapter.get_outputs(os.path.abspath(job_dir), job)
-            for k, v in six.iteritems(outputs):
-                if v:
-                    meta = v.pop('meta', {})
-                    with open(v['path'] + '.meta', 'w') as m:
-                        json.dump(meta, m)
-            json.dump(outputs, f)
-            print(outputs)
+            raise CommandFailed("err %s" % container.get_stderr(),
+                                container.inspect()['State']['ExitCode'])
+
+    def _stop(self, container):
+        from docker.errors import APIError
+        try:
+            self.docker_client.remove_container(container.container,
+                                                force=True)
+        except APIError as e:
+            log.warning('Could not remove container %s: %s',
+                        container.container, e)
 
     def install(self):
-        ensure_image(self.docker_client,
-                     self.enviroment['container']['imageId'],
-                     self.enviroment['container']['uri'])
+        from rabix.executors.container import ensure_image
+        with self._pull_lock:
+            if self._pulled:
+                return
+            ensure_image(self.docker_client,
+                         self.enviroment['container']['imageId'],
+                         self.enviroment['container']['uri'])
+            self._pulled = True
 
 
 class NativeRunner(Runner):
-    def __init__(self, tool, working_dir='./', stdout=None, stderr=None):
-        super(NativeRunner, self).__init__(tool, working_dir, stdout, stderr)
+    """
+    Runs the command line directly on the host, in the job dir, without
+    starting a container. The tool has to be installed locally.
+    """
+    def __init__(self, tool, working_dir='./', stdout=None, stderr=None,
+                 scratch=None, cache=None, export=None, sidecars=False,
+                 call_cache=None, registry=None):
+        stdout = stdout or tool.get('adapter', {}).get('stdout', None)
+        super(NativeRunner, self).__init__(tool, working_dir, stdout,
+                                           stderr or 'out.err', scratch,
+                                           cache, export, sidecars,
+                                           call_cache, registry)
+
+    @property
+    def _envvars(self):
+        env = dict(os.environ)
+        env.update(self.tool.get('adapter', {}).get('environment', {}))
+        return env
+
+    def _execute(self, adapter, job, job_dir):
+        resources = adapter.allocated_resources(job)
+        stderr = os.path.join(job_dir, self.stderr)
+        with open(stderr, 'w') as err:
+            returncode = self.run(['bash', '-c', adapter.cmd_line(job)],
+                                  cwd=job_dir, env=self._envvars,
+                                  stderr=err, resources=resources)
+        if returncode != 0:
+            with open(stderr) as err:
+                raise CommandFailed("err %s" % err.read(), returncode)
+
+    def run(self, command, cwd=None, env=None, stderr=None, resources=None):
+        set_limits = rlimits(resources or {})
+
+        def preexec():
+            os.setsid()
+            set_limits()
+        process = subprocess.Popen(command, cwd=cwd, env=env, stderr=stderr,
+                                   close_fds=True, preexec_fn=preexec)
+        self._started(process)
+        return process.wait()
+
+    def _stop(self, process):
+        """
+        Kills the process group of the command, so commands it started go
+        too.
+        """
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except OSError:
+            pass
 
-    def run(self, command):
-        pass
 
+def rlimits(resources):
+    """
+    Returns a preexec_fn which caps address space at allocated 'mem' and
+    file size at 'diskSpace' (both in MB) for the child process.
+    """
+    limits = []
+    if resources.get('mem'):
+        limits.append((resource.RLIMIT_AS, resources['mem'] * 1024 * 1024))
+    if resources.get('diskSpace'):
+        limits.append((resource.RLIMIT_FSIZE,
+                       resources['diskSpace'] * 1024 * 1024))
 
-if __name__ == '__main__':
-
-    '''
-    Streaming between two containers test.
-    '''
-    working_dir = str(uuid.uuid4())
-    os.mkdir(working_dir)
-    os.chmod(working_dir, os.stat(working_dir).st_mode | stat.S_IROTH |
-             stat.S_IWOTH)
-    os.chdir(working_dir)
-
-    runner_inf = DockerRunner(infinite_loop['tool'])
-    runner_read = DockerRunner(infinite_read['tool'])
-
-    command_inf = ['bash', '-c', '/home/infinite.sh > %s' %
-                   ('/' + working_dir + '/pipe')]
-    command_read = ['bash', '-c', '/home/infinite_read.sh < %s > %s' %
-                    ('/' + working_dir + '/pipe',
-                     '/' + working_dir + '/result')]
-    volumes = {''.join(['/', working_dir]): {}}
-    binds = {os.path.abspath('./'): ''.join(['/', working_dir])}
-    container_inf = runner_inf._run(command_inf, vol=volumes, bind=binds,
-                                    work_dir='/' + working_dir)
-    container_rd = runner_read._run(command_read, vol=volumes, bind=binds,
-                                    work_dir='/' + working_dir)
-    p2 = Process(target=container_rd.get_stdout, kwargs={'file': 'result'})
-    p2.start()
+    def set_limits():
+        for res, value in limits:
+            soft, hard = resource.getrlimit(res)
+            if hard != resource.RLIM_INFINITY:
+                value = min(value, hard)
+            resource.setrlimit(res, (value, hard))
+    return set_limits
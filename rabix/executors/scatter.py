@@ -0,0 +1,229 @@
+import os
+import copy
+import json
+import time
+import uuid
+import shutil
+import logging
+import itertools
+import threading
+import multiprocessing
+import six
+
+from rabix.common.errors import RabixError, ValidationError
+from rabix.executors.scheduler import scheduler_for
+
+log = logging.getLogger(__name__)
+
+
+def scatter_jobs(job, names, method='dot'):
+    """
+    Splits job into one job per element of the array inputs in names.
+    With 'dot' the arrays are zipped and must be of equal length, with
+    'cross' every combination of elements gets a job.
+
+    >>> [j['inputs'] for j in scatter_jobs(
+    ...     {'inputs': {'a': [1, 2], 'b': 'x'}}, ['a'])]
+    [{'a': 1, 'b': 'x'}, {'a': 2, 'b': 'x'}]
+    >>> [sorted(j['inputs'].values()) for j in scatter_jobs(
+    ...     {'inputs': {'a': [1, 2], 'b': [3, 4]}}, ['a', 'b'], 'cross')]
+    [[1, 3], [1, 4], [2, 3], [2, 4]]
+    """
+    inputs = job.get('inputs', {})
+    for name in names:
+        if not isinstance(inputs.get(name), list):
+            raise ValidationError('Scattered input %s is not an array.' %
+                                  name)
+    arrays = [inputs[name] for name in names]
+    if method == 'dot':
+        if len(set(len(a) for a in arrays)) > 1:
+            raise ValidationError('Scattered inputs %s differ in length.' %
+                                  ', '.join(names))
+        combinations = six.moves.zip(*arrays)
+    elif method == 'cross':
+        combinations = itertools.product(*arrays)
+    else:
+        raise ValidationError('Unknown scatter method: %s' % method)
+    jobs = []
+    for values in combinations:
+        shard = copy.deepcopy(job)
+        shard['inputs'].update(zip(names, copy.deepcopy(values)))
+        jobs.append(shard)
+    return jobs
+
+
+def scattered_inputs(schema, names):
+    """
+    Input schema with the scattered inputs in names turned into arrays.
+    """
+    schema = copy.deepcopy(schema)
+    props = schema.setdefault('properties', {})
+    for name in names:
+        if name in props:
+            props[name] = {'type': 'array', 'items': props[name]}
+    return schema
+
+
+def gather(results, names=()):
+    """
+    Outputs of the shards, gathered into an array per output in shard
+    order.
+
+    >>> gather([{'out': 1}, {'out': 2}])
+    {'out': [1, 2]}
+    """
+    outputs = dict((k, []) for k in names)
+    for result in results:
+        for k, v in six.iteritems(result):
+            outputs.setdefault(k, []).append(v)
+    return outputs
+
+
+def median(values):
+    """
+    >>> median([3, 1, 2]), median([1, 2, 3, 4])
+    (2, 2.5)
+    """
+    values = sorted(values)
+    mid = len(values) // 2
+    if len(values) % 2:
+        return values[mid]
+    return (values[mid - 1] + values[mid]) / 2.0
+
+
+class ScatterRunner(object):
+    """
+    Runs a tool once per element of its array inputs in `names` (see
+    scatter_jobs), with at most `parallel` shards submitted to the
+    scheduler at a time, and gathers their outputs. All shards share one
+    runner, so its per-tool state is built once. Shard job dirs are
+    numbered in input order under the run dir.
+
+    With `straggler` set, a shard running longer than that multiple of
+    the median runtime of finished shards is flagged as a straggler and,
+    with `speculate`, run again in <num>.spec. The first copy to finish
+    is kept, the other is cancelled and its job dir removed. Shard
+    runtimes are written to stats.json in the run dir.
+    """
+
+    def __init__(self, tool, runner, names, method='dot', parallel=None,
+                 scheduler=None, straggler=None, speculate=False, poll=1.0,
+                 **runner_kwargs):
+        self.tool = tool
+        self.runner = runner(tool, **runner_kwargs)
+        self.names = names
+        self.method = method
+        self.parallel = parallel
+        self.scheduler = scheduler
+        self.straggler = straggler
+        self.speculate = speculate
+        self.poll = poll
+
+    @property
+    def inputs(self):
+        return scattered_inputs(self.tool.get('inputs', {}), self.names)
+
+    def install(self):
+        self.runner.install()
+
+    def run_job(self, job, job_id=None):
+        jobs = scatter_jobs(job, self.names, self.method)
+        run_dir = os.path.abspath(job_id or str(uuid.uuid4()))
+        os.mkdir(run_dir)
+        workers = self.parallel
+        if self.speculate:
+            # spare workers for speculative copies of stragglers
+            workers = 2 * (workers or getattr(self.runner, 'slots', None) or
+                           multiprocessing.cpu_count())
+        scheduler = self.scheduler or scheduler_for(
+            self.runner, workers, run_dir)
+        parallel = self.parallel or len(jobs)
+        results, errors, pending = [None] * len(jobs), [], list(
+            enumerate(jobs))
+        attempts = {}
+        runtimes, stragglers, speculated = {}, set(), {}
+        cond = threading.Condition()
+
+        def submit():
+            while pending and len(attempts) < parallel and not errors:
+                num, shard = pending.pop(0)
+                if not start(num, shard, os.path.join(run_dir, str(num))):
+                    return
+
+        def start(num, shard, job_dir, priority=0):
+            try:
+                task = scheduler.submit(
+                    self.runner, shard, job_id=job_dir, priority=priority,
+                    callback=lambda task, num=num: finished(num, task))
+            except (Exception, RabixError) as e:
+                errors.append((num, e))
+                return False
+            attempts.setdefault(num, []).append(task)
+            return True
+
+        def finished(num, task):
+            with cond:
+                others = [t for t in attempts[num] if t is not task]
+                if others:
+                    attempts[num] = others
+                else:
+                    del attempts[num]
+                if results[num] is not None:
+                    shutil.rmtree(task.job_id, ignore_errors=True)
+                elif not task.error:
+                    results[num] = task.result
+                    runtimes[num] = task.finished - task.started
+                    if task.job_id.endswith('.spec'):
+                        speculated[num] = 'won'
+                    cancel = getattr(self.runner, 'cancel', None)
+                    for other in others if cancel else ():
+                        cancel(other.job_id)
+                elif not others:
+                    errors.append((num, task.error))
+                submit()
+                cond.notify_all()
+
+        def check():
+            done = list(runtimes.values())
+            if len(done) < max(1, min(3, len(jobs) // 2)):
+                return
+            limit = self.straggler * median(done)
+            now = time.time()
+            for num, tasks in list(attempts.items()):
+                task = tasks[0]
+                if num in stragglers or not task.started or \
+                        now - task.started <= limit:
+                    continue
+                log.warning('Shard %s has run %.1fs, over %.1f times the '
+                            'median of %.1fs', num, now - task.started,
+                            self.straggler, median(done))
+                stragglers.add(num)
+                if self.speculate:
+                    speculated[num] = 'started'
+                    start(num, task.job, task.job_id + '.spec', priority=1)
+
+        log.info('Scattering %s over %s jobs', ', '.join(self.names),
+                 len(jobs))
+        try:
+            with cond:
+                submit()
+                while attempts:
+                    cond.wait(self.poll if self.straggler else None)
+                    if self.straggler and not errors:
+                        check()
+        finally:
+            if not self.scheduler:
+                scheduler.shutdown(wait=False)
+        with open(os.path.join(run_dir, 'stats.json'), 'w') as f:
+            json.dump({'shards': [
+                {'runtime': runtimes.get(n), 'straggler': n in stragglers,
+                 'speculative': speculated.get(n)}
+                for n in range(len(jobs))]}, f, indent=2)
+        if errors:
+            raise RabixError('\n'.join('Shard %s failed: %s' % (n, e)
+                                       for n, e in errors))
+        outputs = gather(results, self.tool.get('outputs', {}).get(
+            'properties', {}))
+        with open(os.path.join(run_dir, 'result.json'), 'w') as f:
+            json.dump(outputs, f)
+        return outputs
@@ -0,0 +1,244 @@
+import os
+import time
+import weakref
+import logging
+import threading
+import multiprocessing
+
+from rabix.cliche.adapter import Adapter
+from rabix.common.errors import JobCancelled, RabixError
+
+log = logging.getLogger(__name__)
+
+RESOURCES = ('cpu', 'mem', 'diskSpace')
+
+_schedulers = weakref.WeakSet()
+
+
+def cancel_all():
+    """
+    Cancels everything this process runs: queued jobs of all schedulers
+    are dropped and jobs of all runners stopped.
+    """
+    from rabix.executors import runner
+    for scheduler in list(_schedulers):
+        scheduler.cancel_all()
+    runner.cancel_all()
+
+
+def host_capacity(working_dir='.'):
+    """
+    Returns cpu count, physical memory and free disk space under
+    working_dir, in the units of allocatedResources (mem and diskSpace
+    in MB).
+    """
+    mb = 1024 * 1024
+    mem = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // mb
+    fs = os.statvfs(working_dir)
+    return {
+        'cpu': multiprocessing.cpu_count(),
+        'mem': mem,
+        'diskSpace': fs.f_bavail * fs.f_frsize // mb
+    }
+
+
+def scheduler_for(runner, workers=None, working_dir='.'):
+    """
+    Scheduler for the jobs of runner. Jobs are packed against the capacity
+    of this host, unless the runner (or runner class) has a `capacity` of
+    its own, as a DistributedRunner, whose jobs run on other hosts, does.
+    Such a runner also gives the default number of `slots`, jobs run at
+    once.
+    """
+    capacity = getattr(runner, 'capacity', None)
+    if capacity is not None:
+        workers = workers or runner.slots
+    return LocalScheduler(capacity=capacity, workers=workers,
+                          working_dir=working_dir)
+
+
+class Task(object):
+    def __init__(self, runner, job, job_id=None, resources=None,
+                 callback=None, priority=0):
+        self.runner = runner
+        self.job = job
+        self.job_id = job_id
+        self.resources = resources or {}
+        self.callback = callback
+        self.priority = priority
+        self.released = False
+        self.result = None
+        self.error = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self._done = threading.Event()
+
+    @property
+    def wait_time(self):
+        if self.started is None:
+            return time.time() - self.submitted
+        return self.started - self.submitted
+
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        self._done.wait(timeout)
+        if self.error:
+            raise self.error
+        return self.result
+
+
+class LocalScheduler(object):
+    """
+    Runs jobs on a pool of worker threads, starting a queued job only when
+    its allocatedResources fit in what is left of the host capacity. The
+    cpu and mem capacity is multiplied by the overcommit ratio. Queued jobs
+    are started highest priority first, then in submission order; smaller
+    jobs may overtake one that does not fit yet. A job larger than the
+    whole capacity runs alone.
+    """
+
+    def __init__(self, capacity=None, overcommit=1.0, workers=None,
+                 working_dir='.'):
+        capacity = dict(host_capacity(working_dir), **(capacity or {}))
+        self.capacity = {
+            'cpu': capacity['cpu'] * overcommit,
+            'mem': capacity['mem'] * overcommit,
+            'diskSpace': capacity['diskSpace']
+        }
+        self.used = dict.fromkeys(RESOURCES, 0)
+        self.queue = []
+        self.running = set()
+        self.tasks = []
+        self._cond = threading.Condition()
+        self._closed = False
+        # enough workers to fill the overcommitted cpu, _fits gates the rest
+        workers = workers or max(1, int(self.capacity['cpu']))
+        self._workers = [threading.Thread(target=self._work)
+                         for _ in range(workers)]
+        for worker in self._workers:
+            worker.daemon = True
+            worker.start()
+        _schedulers.add(self)
+
+    def submit(self, runner, job, job_id=None, callback=None,
+               resources=None, priority=0):
+        if resources is None:
+            adapter = getattr(runner, 'adapter', None) or Adapter(runner.tool)
+            resources = adapter.allocated_resources(job)
+        task = Task(runner, job, job_id, resources, callback, priority)
+        with self._cond:
+            if self._closed:
+                raise RuntimeError('Scheduler is shut down.')
+            self.queue.append(task)
+            self.tasks.append(task)
+            self._cond.notify_all()
+        return task
+
+    def join(self):
+        with self._cond:
+            while self.queue or self.running:
+                self._cond.wait()
+
+    def shutdown(self, wait=True):
+        if wait:
+            self.join()
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def cancel_all(self):
+        """
+        Fails queued jobs with JobCancelled and cancels running ones,
+        giving back their resources at once.
+        """
+        with self._cond:
+            queued, self.queue = self.queue, []
+            running = list(self.running)
+            for task in running:
+                self._release(task)
+            self._cond.notify_all()
+        for task in queued:
+            task.error = JobCancelled(task.job_id)
+            task.released = True
+            self._finish(task)
+        for task in running:
+            cancel = getattr(task.runner, 'cancel', None)
+            if cancel and task.job_id:
+                cancel(task.job_id)
+
+    def stats(self):
+        with self._cond:
+            waits = [t.wait_time for t in self.tasks]
+            return {
+                'queued': len(self.queue),
+                'running': len(self.running),
+                'finished': len(self.tasks) - len(self.queue) -
+                len(self.running),
+                'utilization': {k: float(self.used[k]) / self.capacity[k]
+                                if self.capacity[k] else 0.0
+                                for k in RESOURCES},
+                'wait_time': {
+                    'mean': sum(waits) / len(waits) if waits else 0.0,
+                    'max': max(waits) if waits else 0.0
+                }
+            }
+
+    def _fits(self, task):
+        if not self.running:
+            return True
+        return all(self.used[k] + task.resources.get(k, 0) <=
+                   self.capacity[k] for k in RESOURCES)
+
+    def _next(self):
+        for task in sorted(self.queue, key=lambda t: -t.priority):
+            if self._fits(task):
+                self.queue.remove(task)
+                return task
+
+    def _work(self):
+        while True:
+            with self._cond:
+                task = self._next()
+                while task is None and not self._closed:
+                    self._cond.wait()
+                    task = self._next()
+                if task is None:
+                    return
+                self.running.add(task)
+                for k in RESOURCES:
+                    self.used[k] += task.resources.get(k, 0)
+            self._run(task)
+
+    def _run(self, task):
+        task.started = time.time()
+        log.debug('Starting job %s after %.2fs in queue',
+                  task.job_id, task.wait_time)
+        try:
+            task.result = task.runner.run_job(task.job, job_id=task.job_id)
+        except (Exception, RabixError) as e:
+            log.error('Job %s failed: %s', task.job_id, e)
+            task.error = e
+        self._finish(task)
+
+    def _finish(self, task):
+        task.finished = time.time()
+        try:
+            if task.callback:
+                task.callback(task)
+        except Exception:
+            log.exception('Callback for job %s failed', task.job_id)
+        finally:
+            with self._cond:
+                self.running.discard(task)
+                self._release(task)
+                self._cond.notify_all()
+            task._done.set()
+
+    def _release(self, task):
+        if not task.released:
+            task.released = True
+            for k in RESOURCES:
+                self.used[k] -= task.resources.get(k, 0)
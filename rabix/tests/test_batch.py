@@ -0,0 +1,75 @@
+import os
+import json
+import shutil
+import tempfile
+
+from nose.tools import eq_, raises
+from six import StringIO
+
+from rabix.common.errors import ValidationError
+from rabix.executors.batch import BatchRunner, read_jobs, validate_job
+from rabix.executors.runner import NativeRunner
+from rabix.tests.test_runner import make_cat_tool
+
+
+def test_validate_job():
+    tool = make_cat_tool()
+    tool['inputs']['required'] = ['inp']
+    validate_job(tool, {'inputs': {'inp': {'path': 'x'}}})
+    for inputs in ({}, {'inp': 'x'}, {'inp': {}},
+                   {'inp': {'path': 'x'}, 'other': 1}):
+        try:
+            validate_job(tool, {'inputs': inputs})
+        except ValidationError:
+            continue
+        raise AssertionError('%s is valid' % inputs)
+
+
+@raises(ValidationError)
+def test_validate_array_items():
+    tool = make_cat_tool()
+    tool['inputs']['properties']['n'] = {'type': 'array',
+                                         'items': {'type': 'integer'}}
+    validate_job(tool, {'inputs': {'n': [1, 'two']}})
+
+
+def test_batch():
+    tmp = tempfile.mkdtemp()
+    try:
+        lines = []
+        for i in range(4):
+            inp = os.path.join(tmp, 'in%s' % i)
+            with open(inp, 'w') as f:
+                f.write(str(i))
+            lines.append(json.dumps({'inp': {'path': inp}}))
+        lines[2] = json.dumps({'id': 'named', 'inputs': {
+            'inp': {'path': os.path.join(tmp, 'in2')}}})
+        lines.append(json.dumps({'inp': 'not a file'}))
+        lines.append('{"inp": ')
+        lines.append(json.dumps({'inp': {'path': os.path.join(tmp, 'none')}}))
+        jobs = read_jobs(StringIO('\n'.join(lines) + '\n'),
+                         base={'inputs': {}, 'allocatedResources': {
+                             'cpu': 1, 'mem': 10, 'diskSpace': 0}})
+        results = StringIO()
+        run_dir = os.path.join(tmp, 'run')
+
+        counts = BatchRunner(make_cat_tool(), NativeRunner(make_cat_tool()),
+                             parallel=2, results=results).run_job(
+            jobs, job_id=run_dir)
+
+        eq_(counts, {'finished': 4, 'invalid': 2, 'failed': 1})
+        records = dict((r['line'], r) for r in map(
+            json.loads, results.getvalue().splitlines()))
+        eq_(sorted(records), list(range(1, 8)))
+        for line, name in ((1, '1'), (2, '2'), (3, 'named'), (4, '4')):
+            eq_(records[line]['status'], 'finished')
+            eq_(records[line]['id'], name)
+            out = records[line]['outputs']['out']['path']
+            eq_(out, os.path.join(run_dir, name, 'out.txt'))
+            with open(out) as f:
+                eq_(f.read(), str(line - 1))
+        eq_([records[n]['status'] for n in (5, 6, 7)],
+            ['invalid', 'invalid', 'failed'])
+        assert records[7]['error']
+    finally:
+        shutil.rmtree(tmp)
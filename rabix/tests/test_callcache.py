@@ -0,0 +1,153 @@
+import os
+import json
+import mock
+import shutil
+import tempfile
+
+from nose.tools import eq_
+
+from rabix.executors.callcache import CallCache
+from rabix.executors.io import Manifest
+from rabix.executors.runner import NativeRunner
+from rabix.tests.test_io import Server
+from rabix.tests.test_runner import make_cat_tool
+
+
+def write(path, data):
+    with open(path, 'w') as f:
+        f.write(data)
+    return {'path': path}
+
+
+def test_call_cache():
+    tmp = tempfile.mkdtemp()
+    try:
+        cache = CallCache(os.path.join(tmp, 'cache'))
+        runner = NativeRunner(make_cat_tool(), call_cache=cache)
+        job = {'inputs': {'inp': write(os.path.join(tmp, 'a.txt'), 'a')}}
+        first = runner.run_job(job, job_id=os.path.join(tmp, 'first'))
+
+        renamed = {'inputs': {'inp': write(os.path.join(tmp, 'b.txt'), 'a')}}
+        with mock.patch.object(NativeRunner, '_execute') as execute:
+            second = runner.run_job(renamed,
+                                    job_id=os.path.join(tmp, 'second'))
+            eq_(execute.call_count, 0)
+        eq_(second['out']['path'], os.path.join(tmp, 'second', 'out.txt'))
+        with open(second['out']['path']) as f:
+            eq_(f.read(), 'a')
+        eq_(Manifest.find(second['out']['path']).get(second['out']['path']),
+            {'file_type': 'text'})
+        with open(os.path.join(tmp, 'second', 'result.json')) as f:
+            eq_(json.load(f), second)
+
+        changed = {'inputs': {'inp': write(os.path.join(tmp, 'b.txt'), 'b')}}
+        third = runner.run_job(changed, job_id=os.path.join(tmp, 'third'))
+        with open(third['out']['path']) as f:
+            eq_(f.read(), 'b')
+        assert first != third
+    finally:
+        shutil.rmtree(tmp)
+
+
+def test_key_covers_tool_and_parameters():
+    tmp = tempfile.mkdtemp()
+    try:
+        cache = CallCache(tmp)
+        tool = make_cat_tool()
+        job = {'inputs': {'inp': {'path': 'http://example.com/a.txt',
+                                  'checksum': 'sha1$1'}, 'n': 1}}
+        key = cache.key(tool, job)
+        eq_(key, cache.key(tool, json.loads(json.dumps(job))))
+        assert key != cache.key(tool, dict(job, inputs=dict(
+            job['inputs'], n=2)))
+        assert key != cache.key(make_cat_tool(['-n']), job)
+        tool['requirements']['environment']['container']['imageId'] = 'y'
+        assert key != cache.key(tool, job)
+    finally:
+        shutil.rmtree(tmp)
+
+
+def test_remote_input_keyed_by_version():
+    server = Server({'/a.txt': b'a'})
+    tmp = tempfile.mkdtemp()
+    try:
+        cache = CallCache(tmp)
+        job = {'inputs': {'inp': {'path': server.url('/a.txt')}}}
+        key = cache.key(make_cat_tool(), job)
+        eq_(key, cache.key(make_cat_tool(), job))
+        server.files['/a.txt'] = b'b'
+        assert key != cache.key(make_cat_tool(), job)
+    finally:
+        server.shutdown()
+        shutil.rmtree(tmp)
+
+
+def test_empty_outputs_are_a_hit():
+    tmp = tempfile.mkdtemp()
+    try:
+        runner = NativeRunner(make_cat_tool(), call_cache=CallCache(
+            os.path.join(tmp, 'cache')))
+        job = {'inputs': {'inp': write(os.path.join(tmp, 'a.txt'), 'a')}}
+        with mock.patch.object(NativeRunner, '_run', return_value={}) as run:
+            for name in ('first', 'second'):
+                eq_(runner.run_job(job, job_id=os.path.join(tmp, name)), {})
+            eq_(run.call_count, 1)
+    finally:
+        shutil.rmtree(tmp)
+
+
+def test_cached_outputs_are_separate_files():
+    tmp = tempfile.mkdtemp()
+    try:
+        cache = CallCache(os.path.join(tmp, 'cache'))
+        runner = NativeRunner(make_cat_tool(), call_cache=cache)
+        job = {'inputs': {'inp': write(os.path.join(tmp, 'a.txt'), 'a')}}
+        first = runner.run_job(job, job_id=os.path.join(tmp, 'first'))
+        blob = os.path.join(cache.root, 'blobs', os.listdir(
+            os.path.join(cache.root, 'blobs'))[0])
+        assert not os.path.samefile(first['out']['path'], blob)
+        eq_(os.stat(blob).st_mode & 0o777, 0o444)
+
+        with open(first['out']['path'], 'a') as f:
+            f.write('changed')
+        second = runner.run_job(job, job_id=os.path.join(tmp, 'second'))
+        with open(second['out']['path']) as f:
+            eq_(f.read(), 'a')
+    finally:
+        shutil.rmtree(tmp)
+
+
+def test_changed_blob_is_a_miss():
+    tmp = tempfile.mkdtemp()
+    try:
+        cache = CallCache(os.path.join(tmp, 'cache'))
+        runner = NativeRunner(make_cat_tool(), call_cache=cache)
+        job = {'inputs': {'inp': write(os.path.join(tmp, 'a.txt'), 'a')}}
+        runner.run_job(job, job_id=os.path.join(tmp, 'first'))
+        blobs = os.path.join(cache.root, 'blobs')
+        blob = os.path.join(blobs, os.listdir(blobs)[0])
+        os.chmod(blob, 0o644)
+        with open(blob, 'a') as f:
+            f.write('changed')
+
+        key = cache.key(runner.tool, job)
+        eq_(cache.get(key, os.path.join(tmp, 'second')), None)
+        assert not os.path.exists(blob)
+    finally:
+        shutil.rmtree(tmp)
+
+
+def test_failed_put_does_not_fail_job():
+    tmp = tempfile.mkdtemp()
+    try:
+        cache = CallCache(os.path.join(tmp, 'cache'))
+        runner = NativeRunner(make_cat_tool(), call_cache=cache)
+        job = {'inputs': {'inp': write(os.path.join(tmp, 'a.txt'), 'a')}}
+        with mock.patch('rabix.executors.callcache.clone',
+                        side_effect=IOError(28, 'No space left on device')):
+            outputs = runner.run_job(job, job_id=os.path.join(tmp, 'job'))
+        with open(outputs['out']['path']) as f:
+            eq_(f.read(), 'a')
+        eq_(os.listdir(os.path.join(cache.root, 'blobs')), [])
+    finally:
+        shutil.rmtree(tmp)
@@ -0,0 +1,194 @@
+import os
+import time
+import signal
+import shutil
+import tempfile
+import threading
+import multiprocessing
+
+from nose.tools import eq_, raises
+
+from rabix.common.errors import JobCancelled, RabixError
+from rabix.executors.distributed import (DirectoryQueue, DistributedRunner,
+                                         Worker)
+from rabix.executors.runner import cancel_all
+from rabix.executors.scheduler import scheduler_for
+from rabix.tests.test_runner import make_cat_tool
+
+
+def start_worker(queue, worker_id, burst=False):
+    worker = Worker(queue, worker_id=worker_id, heartbeat=0.1)
+    process = multiprocessing.Process(target=worker.work,
+                                      kwargs={'burst': burst, 'poll': 0.1})
+    process.start()
+    return process
+
+
+def write_input(tmp, name, data):
+    path = os.path.join(tmp, name)
+    with open(path, 'w') as f:
+        f.write(data)
+    return {'path': path}
+
+
+def test_workers_run_queued_jobs():
+    tmp = tempfile.mkdtemp()
+    try:
+        queue = DirectoryQueue(os.path.join(tmp, 'queue'))
+        runner = DistributedRunner(make_cat_tool(), queue, native=True,
+                                   poll=0.1)
+        job_ids = []
+        for i in range(4):
+            job = {'inputs': {'inp': write_input(tmp, 'in%s' % i, str(i))}}
+            job_ids.append(runner.submit(job, os.path.join(tmp, 'job%s' % i)))
+        workers = [start_worker(queue, 'w%s' % i, burst=True)
+                   for i in range(2)]
+
+        for i, job_id in enumerate(job_ids):
+            outputs = runner.wait(job_id, timeout=30)
+            with open(outputs['out']['path']) as f:
+                eq_(f.read(), str(i))
+        for worker in workers:
+            worker.join()
+        workers = set(queue.result(j)['worker'] for j in job_ids)
+        assert workers <= set(['w0', 'w1'])
+    finally:
+        shutil.rmtree(tmp)
+
+
+def test_worker_writes_sidecars():
+    tmp = tempfile.mkdtemp()
+    try:
+        queue = DirectoryQueue(os.path.join(tmp, 'queue'))
+        runner = DistributedRunner(make_cat_tool(), queue, native=True,
+                                   sidecars=True, poll=0.1)
+        job_id = runner.submit({'inputs': {'inp': write_input(
+            tmp, 'in', 'data')}}, os.path.join(tmp, 'job'))
+        start_worker(queue, 'w', burst=True).join()
+        outputs = runner.wait(job_id, timeout=30)
+        assert os.path.exists(outputs['out']['path'] + '.meta')
+    finally:
+        shutil.rmtree(tmp)
+
+
+class SleepingRunner(DistributedRunner):
+    def __init__(self, *args, **kwargs):
+        super(SleepingRunner, self).__init__(*args, **kwargs)
+        self.lock = threading.Lock()
+        self.running = self.peak = 0
+
+    def run_job(self, job, job_id=None):
+        with self.lock:
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+        time.sleep(0.1)
+        with self.lock:
+            self.running -= 1
+
+
+def test_not_packed_against_local_host():
+    runner = SleepingRunner(make_cat_tool(), None, slots=4)
+    scheduler = scheduler_for(runner)
+    for i in range(8):
+        scheduler.submit(runner, {'inputs': {}, 'allocatedResources': {
+            'cpu': 1024, 'mem': 10 ** 9}}, job_id=str(i))
+    scheduler.shutdown()
+    eq_(runner.peak, 4)
+
+
+def test_job_of_dead_worker_requeued():
+    tmp = tempfile.mkdtemp()
+    try:
+        queue = DirectoryQueue(os.path.join(tmp, 'queue'))
+        tool = make_cat_tool()
+        tool['adapter']['baseCmd'] = ['sleep 1 && cat']
+        runner = DistributedRunner(tool, queue, native=True,
+                                   heartbeat_timeout=0.5, poll=0.1)
+        job_id = runner.submit({'inputs': {'inp': write_input(
+            tmp, 'in', 'data')}}, os.path.join(tmp, 'job'))
+        doomed = start_worker(queue, 'doomed')
+        claimed = os.path.join(queue.root, 'claimed', 'doomed')
+        while not (os.path.isdir(claimed) and os.listdir(claimed)):
+            time.sleep(0.05)
+        os.kill(doomed.pid, signal.SIGKILL)
+        doomed.join()
+        worker = start_worker(queue, 'survivor')
+        try:
+            outputs = runner.wait(job_id, timeout=30)
+        finally:
+            worker.terminate()
+            worker.join()
+        with open(outputs['out']['path']) as f:
+            eq_(f.read(), 'data')
+        eq_(queue.result(job_id)['worker'], 'survivor')
+    finally:
+        shutil.rmtree(tmp)
+
+
+def test_dead_worker_requeued_once():
+    tmp = tempfile.mkdtemp()
+    try:
+        queue = DirectoryQueue(tmp)
+        for i in range(50):
+            queue.put('job%s' % i, {})
+        while queue.claim('dead', timeout=0):
+            pass
+        requeued = []
+
+        def requeue():
+            requeued.extend(queue.requeue_dead(timeout=1))
+
+        threads = [threading.Thread(target=requeue) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        eq_(sorted(requeued), sorted('job%s' % i for i in range(50)))
+        eq_(len(os.listdir(os.path.join(tmp, 'pending'))), 50)
+    finally:
+        shutil.rmtree(tmp)
+
+
+@raises(RabixError)
+def test_failed_job_reported():
+    tmp = tempfile.mkdtemp()
+    try:
+        queue = DirectoryQueue(os.path.join(tmp, 'queue'))
+        runner = DistributedRunner(make_cat_tool(['--no-such-option']), queue,
+                                   native=True, poll=0.1)
+        job_id = runner.submit({'inputs': {'inp': write_input(
+            tmp, 'in', '')}}, os.path.join(tmp, 'job'))
+        start_worker(queue, 'w', burst=True).join()
+        runner.wait(job_id, timeout=30)
+    finally:
+        shutil.rmtree(tmp)
+
+
+def test_cancel_stops_waiting():
+    tmp = tempfile.mkdtemp()
+    try:
+        queue = DirectoryQueue(os.path.join(tmp, 'queue'))
+        runner = DistributedRunner(make_cat_tool(), queue, native=True,
+                                   poll=60)
+        errors = {}
+
+        def run(name):
+            try:
+                runner.run_job({'inputs': {'inp': write_input(
+                    tmp, name, '')}}, os.path.join(tmp, name))
+            except JobCancelled as e:
+                errors[name] = e
+
+        threads = dict((name, threading.Thread(target=run, args=(name,)))
+                       for name in ('a', 'b'))
+        for thread in threads.values():
+            thread.start()
+        time.sleep(0.2)
+        runner.cancel(os.path.join(tmp, 'a'))
+        threads['a'].join(5)
+        eq_(sorted(errors), ['a'])
+        cancel_all()
+        threads['b'].join(5)
+        eq_(sorted(errors), ['a', 'b'])
+    finally:
+        shutil.rmtree(tmp)
@@ -1,12 +1,28 @@
 import os
 import sys
 import json
+import time
 import docker
 import shutil
+import tempfile
+import subprocess
 from rabix.executors.container import ensure_image
-from nose.tools import nottest, raises
+from nose.tools import eq_, nottest, raises
 from rabix.tests import mock_app_bad_repo, mock_app_good_repo
 from rabix.executors.cli import get_tool, main, dry_run_parse
+from rabix.tests.test_runner import make_cat_tool
+
+# seconds `rabix --print-cli` may take beyond starting the interpreter
+STARTUP_BUDGET = 0.35
+
+STARTUP = '''
+import sys, json
+from rabix.executors.cli import main
+try:
+    main()
+finally:
+    print(json.dumps(sorted(sys.modules)))
+'''
 
 
 @nottest
@@ -95,3 +111,33 @@ def test_override_input():
     main()
     assert os.path.exists(os.path.abspath('./testdir') + '/output.sam')
     shutil.rmtree(os.path.abspath('./testdir'))
+
+
+def best_time(args, runs=3):
+    best, out = None, None
+    for _ in range(runs):
+        start = time.time()
+        out = subprocess.check_output(args)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, out
+
+
+def test_startup():
+    tmp = tempfile.mkdtemp()
+    try:
+        tool = os.path.join(tmp, 'cat.json')
+        with open(tool, 'w') as fp:
+            json.dump(make_cat_tool(), fp)
+        base, _ = best_time([sys.executable, '-c', 'pass'])
+        elapsed, out = best_time([sys.executable, '-c', STARTUP,
+                                  '--print-cli', tool, '--', '--inp', tool])
+    finally:
+        shutil.rmtree(tmp)
+    cmd_line, modules = out.decode('utf-8').splitlines()
+    eq_(cmd_line, 'cat %s > out.txt' % tool)
+    heavy = {'docker', 'requests', 'jsonschema', 'yapsy', 'execjs',
+             'networkx', 'sqlite3'}
+    assert not heavy & set(json.loads(modules)), \
+        heavy & set(json.loads(modules))
+    assert elapsed - base < STARTUP_BUDGET, (elapsed, base)
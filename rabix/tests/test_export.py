@@ -0,0 +1,99 @@
+import os
+import json
+import shutil
+import tempfile
+
+from nose.tools import eq_, raises
+
+from rabix.common.errors import RabixError
+from rabix.executors.export import Exporter
+from rabix.executors.io import MANIFEST
+from rabix.tests.test_io import Server
+
+
+def make_outputs(job_dir):
+    os.makedirs(os.path.join(job_dir, 'sub'))
+    outputs = {'bam': {'path': os.path.join(job_dir, 'out.bam')},
+               'logs': [{'path': os.path.join(job_dir, 'sub', 'a.log')}]}
+    for path, data in [('out.bam', b'x' * 10000), ('sub/a.log', b'log')]:
+        with open(os.path.join(job_dir, path), 'wb') as fp:
+            fp.write(data)
+        with open(os.path.join(job_dir, path + '.meta'), 'w') as fp:
+            json.dump({'name': path}, fp)
+    return outputs
+
+
+def test_export_http_multipart():
+    server = Server({}, drops=1)
+    root = tempfile.mkdtemp()
+    try:
+        job_dir = os.path.join(root, 'job')
+        outputs = make_outputs(job_dir)
+        manifest = Exporter(server.url('/results'), part_size=1024,
+                            backoff=0, root=root)(outputs, job_dir)
+
+        eq_(manifest, {'bam': {'url': server.url('/results/job/out.bam')},
+                       'logs': [{'url': server.url(
+                           '/results/job/sub/a.log')}]})
+        eq_(server.files['/results/job/out.bam'], b'x' * 10000)
+        eq_(server.files['/results/job/sub/a.log'], b'log')
+        eq_(json.loads(server.files['/results/job/sub/a.log.meta'].decode()),
+            {'name': 'sub/a.log'})
+        eq_(server.requests.count('/results/job/out.bam'), 11)
+        with open(os.path.join(job_dir, 'export.json')) as fp:
+            eq_(json.load(fp), manifest)
+    finally:
+        server.shutdown()
+        shutil.rmtree(root)
+
+
+def test_export_file():
+    job_dir, dest = tempfile.mkdtemp(), tempfile.mkdtemp()
+    try:
+        outputs = make_outputs(job_dir)
+        manifest = Exporter('file://' + dest)(outputs, job_dir)
+
+        name = os.path.basename(job_dir)
+        eq_(manifest['logs'], [{'url': 'file://%s/%s/sub/a.log' % (
+            dest, name)}])
+        eq_(sorted(os.listdir(os.path.join(dest, name))),
+            ['out.bam', 'out.bam.meta', 'sub'])
+        with open(os.path.join(dest, name, 'sub', 'a.log')) as fp:
+            eq_(fp.read(), 'log')
+    finally:
+        shutil.rmtree(job_dir)
+        shutil.rmtree(dest)
+
+
+def test_export_jobs_of_run_apart():
+    root, dest = tempfile.mkdtemp(), tempfile.mkdtemp()
+    try:
+        exporter = Exporter('file://' + dest, root=root)
+        for step in ('a', 'b'):
+            job_dir = os.path.join(root, 'run', step, '0')
+            outputs = make_outputs(job_dir)
+            with open(os.path.join(job_dir, MANIFEST), 'w') as fp:
+                fp.write(step)
+            exporter(outputs, job_dir)
+
+        for step in ('a', 'b'):
+            exported = os.path.join(dest, 'run', step, '0')
+            eq_(sorted(os.listdir(exported)),
+                [MANIFEST, 'out.bam', 'out.bam.meta', 'sub'])
+            with open(os.path.join(exported, MANIFEST)) as fp:
+                eq_(fp.read(), step)
+    finally:
+        shutil.rmtree(root)
+        shutil.rmtree(dest)
+
+
+@raises(RabixError)
+def test_export_gives_up():
+    server = Server({}, drops=10)
+    job_dir = tempfile.mkdtemp()
+    try:
+        Exporter(server.url('/results'), retries=2, backoff=0)(
+            make_outputs(job_dir), job_dir)
+    finally:
+        server.shutdown()
+        shutil.rmtree(job_dir)
@@ -0,0 +1,28 @@
+import os
+import shutil
+import tempfile
+
+from nose.tools import eq_
+
+from rabix.executors.history import RuntimeHistory
+
+
+def test_record_and_save():
+    tmp = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp, 'data', 'history.json')
+        history = RuntimeHistory(path, default=5)
+        tool = {'name': 'tool'}
+        eq_(history.estimate(tool), 5)
+        history.record(tool, 10, cpu=2)
+        eq_(history.estimate(tool, cpu=1), 20)
+        eq_(history.estimate(tool, cpu=4), 5)
+
+        other = RuntimeHistory(path)
+        other.record(tool, 30)
+        history.save()
+        other.save()
+        eq_(RuntimeHistory(path).records[history.key(tool)]['count'], 2)
+        eq_(RuntimeHistory(path).estimate(tool), 20 + 0.3 * (30 - 20))
+    finally:
+        shutil.rmtree(tmp)
@@ -0,0 +1,559 @@
+import os
+import bz2
+import six
+import gzip
+import time
+import mock
+import hashlib
+import stat
+import shutil
+import tempfile
+import threading
+
+from nose.tools import eq_, raises
+from six.moves import BaseHTTPServer, socketserver
+
+from rabix.common.errors import RabixError, ResourceUnavailable
+from rabix.executors.io import InputRunner, MetaCache, file_metas
+from rabix.executors.cache import InputCache
+from rabix.executors import compression
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_HEAD(self):
+        data = self.server.files.get(self.path)
+        self.send_response(404 if data is None else 200)
+        if data is not None:
+            self.send_header('ETag', hashlib.md5(data).hexdigest())
+        self.send_header('Content-Length', str(len(data or b'')))
+        self.end_headers()
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.active += 1
+            server.peak = max(server.peak, server.active)
+            server.requests.append(self.path)
+        try:
+            time.sleep(server.delay)
+            data = server.files.get(self.path)
+            if data is None:
+                self.send_response(404)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            start = 0
+            if self.headers.get('Range') and server.ranges:
+                start = int(self.headers['Range'][len('bytes='):-1])
+                self.send_response(206)
+                self.send_header('Content-Range', 'bytes %s-%s/%s' % (
+                    start, len(data) - 1, len(data)))
+            else:
+                self.send_response(200)
+            self.send_header('Content-Length', str(len(data) - start))
+            self.end_headers()
+            if server.drops:
+                server.drops -= 1
+                self.wfile.write(data[start:start + server.drop_after])
+                self.close_connection = True
+                return
+            self.wfile.write(data[start:])
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    def do_PUT(self):
+        server = self.server
+        data = self.rfile.read(int(self.headers['Content-Length']))
+        with server.lock:
+            server.requests.append(self.path)
+            if server.drops:
+                server.drops -= 1
+                self.send_response(500)
+            else:
+                start, total = 0, len(data)
+                if self.headers.get('Content-Range'):
+                    rng, total = self.headers['Content-Range'][
+                        len('bytes '):].split('/')
+                    start, total = int(rng.split('-')[0]), int(total)
+                buf = bytearray(server.files.get(self.path, b''))
+                buf.extend(b'\0' * (total - len(buf)))
+                buf[start:start + len(data)] = data
+                server.files[self.path] = bytes(buf)
+                self.send_response(201)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, files, delay=0, drops=0, drop_after=0, ranges=True):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), Handler)
+        self.files = files
+        self.delay = delay
+        self.drops = drops
+        self.drop_after = drop_after
+        self.ranges = ranges
+        self.lock = threading.Lock()
+        self.active = 0
+        self.peak = 0
+        self.requests = []
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def url(self, path):
+        return 'http://127.0.0.1:%s%s' % (self.server_address[1], path)
+
+
+def file_inputs():
+    return {
+        'reference': {'type': 'file',
+                      'adapter': {'secondaryFiles': ['*.fai', '.dict']}},
+        'reads': {'type': 'array', 'items': {'type': 'file'}},
+    }
+
+
+def test_parallel_staging():
+    files = {'/ref.fa': b'ref', '/ref.fa.fai': b'fai', '/ref.dict': b'dict',
+             '/r1.fq': b'r1', '/r2.fq': b'r2', '/r1.fq.meta': b'{"a": 1}'}
+    server = Server(files, delay=0.2)
+    tmp = tempfile.mkdtemp()
+    try:
+        job = {'inputs': {
+            'reference': {'path': server.url('/ref.fa')},
+            'reads': [{'path': server.url('/r1.fq')},
+                      {'path': server.url('/r2.fq'), 'meta': {'b': 2}}],
+        }}
+        remaped = InputRunner(job, file_inputs(), tmp)()
+
+        eq_(remaped['inputs']['reference']['path'],
+            os.path.join(tmp, 'ref.fa'))
+        eq_([r['path'] for r in remaped['inputs']['reads']],
+            [os.path.join(tmp, 'r1.fq'), os.path.join(tmp, 'r2.fq')])
+        eq_(remaped['inputs']['reads'][0]['meta'], {'a': 1})
+        eq_(remaped['inputs']['reads'][1]['meta'], {'b': 2})
+        eq_(sorted(os.listdir(tmp)), ['r1.fq', 'r1.fq.meta', 'r2.fq',
+                                      'ref.dict', 'ref.fa', 'ref.fa.fai'])
+        with open(os.path.join(tmp, 'ref.fa.fai')) as f:
+            eq_(f.read(), 'fai')
+        assert server.peak > 1
+    finally:
+        server.shutdown()
+        shutil.rmtree(tmp)
+
+
+@raises(ResourceUnavailable)
+def test_staging_errors_aggregated():
+    server = Server({'/ref.fa': b'ref'})
+    tmp = tempfile.mkdtemp()
+    try:
+        job = {'inputs': {
+            'reference': {'path': server.url('/ref.fa')},
+            'reads': [{'path': server.url('/missing.fq')},
+                      {'path': os.path.join(tmp, 'missing.fq')}],
+        }}
+        InputRunner(job, file_inputs(), tmp)()
+    finally:
+        server.shutdown()
+        shutil.rmtree(tmp)
+
+
+def test_cancel_staging():
+    server = Server({'/ref.fa': b'ref' * 1000}, delay=0.5)
+    tmp = tempfile.mkdtemp()
+    errors = []
+    try:
+        job = {'inputs': {'reference': {'path': server.url('/ref.fa')}}}
+        runner = InputRunner(job, {'reference': {'type': 'file'}}, tmp)
+
+        def stage():
+            try:
+                runner()
+            except RabixError as e:
+                errors.append(e)
+        thread = threading.Thread(target=stage)
+        thread.start()
+        time.sleep(0.1)
+        runner.cancel()
+        thread.join()
+
+        eq_(len(errors), 1)
+        eq_(os.listdir(tmp), [])
+    finally:
+        server.shutdown()
+        shutil.rmtree(tmp)
+
+
+def test_failure_stops_downloads():
+    server = Server({'/ref.fa': b'ref' * 1000}, delay=0.5)
+    tmp = tempfile.mkdtemp()
+    try:
+        job = {'inputs': {
+            'reference': {'path': server.url('/ref.fa')},
+            'reads': [{'path': os.path.join(tmp, 'missing.fq')}],
+        }}
+        runner = InputRunner(job, file_inputs(), tmp, chunk_size=1024)
+        try:
+            runner()
+        except ResourceUnavailable as e:
+            assert 'stopped' in six.text_type(e), e
+        else:
+            raise AssertionError('Staging did not fail.')
+        eq_(os.listdir(tmp), [])
+    finally:
+        server.shutdown()
+        shutil.rmtree(tmp)
+
+
+def download(server, path, **kwargs):
+    tmp = tempfile.mkdtemp()
+    job = {'inputs': {'reference': {'path': server.url(path)}}}
+    try:
+        remaped = InputRunner(job, {'reference': {'type': 'file'}}, tmp,
+                              chunk_size=1024, backoff=0, **kwargs)()
+        with open(remaped['inputs']['reference']['path'], 'rb') as f:
+            return f.read(), sorted(os.listdir(tmp))
+    finally:
+        shutil.rmtree(tmp)
+
+
+def test_resume_dropped_download():
+    data = os.urandom(10000)
+    server = Server({'/big.bam': data}, drops=3, drop_after=3000)
+    try:
+        content, files = download(server, '/big.bam')
+        eq_(content, data)
+        eq_(files, ['big.bam'])
+        eq_(len([r for r in server.requests if r == '/big.bam']), 4)
+    finally:
+        server.shutdown()
+
+
+def test_restart_without_range_support():
+    data = os.urandom(10000)
+    server = Server({'/big.bam': data}, drops=1, drop_after=3000,
+                    ranges=False)
+    try:
+        eq_(download(server, '/big.bam')[0], data)
+    finally:
+        server.shutdown()
+
+
+@raises(ResourceUnavailable)
+def test_give_up_after_retries():
+    server = Server({'/big.bam': os.urandom(10000)}, drops=10,
+                    drop_after=100)
+    try:
+        download(server, '/big.bam', retries=2)
+    finally:
+        server.shutdown()
+
+
+def test_checksum_verified():
+    data = os.urandom(5000)
+    meta = '{"checksum": "sha1$%s"}' % hashlib.sha1(data).hexdigest()
+    server = Server({'/a.bam': data, '/a.bam.meta': meta.encode('ascii')},
+                    drops=1, drop_after=1000)
+    try:
+        content, files = download(server, '/a.bam')
+        eq_(content, data)
+        eq_(files, ['a.bam', 'a.bam.meta'])
+    finally:
+        server.shutdown()
+
+
+@raises(ResourceUnavailable)
+def test_checksum_mismatch():
+    server = Server({'/a.bam': b'data',
+                     '/a.bam.meta': b'{"checksum": "sha1$0000"}'})
+    try:
+        download(server, '/a.bam')
+    finally:
+        server.shutdown()
+
+
+def cached_download(server, cache, path):
+    tmp = tempfile.mkdtemp()
+    job = {'inputs': {'reference': {'path': server.url(path)}}}
+    try:
+        remaped = InputRunner(job, {'reference': {'type': 'file'}}, tmp,
+                              cache=cache)()
+        path = remaped['inputs']['reference']['path']
+        with open(path, 'rb') as f:
+            return f.read(), os.stat(path).st_ino
+    finally:
+        shutil.rmtree(tmp)
+
+
+def test_cache_shared_between_jobs():
+    data = os.urandom(5000)
+    server = Server({'/ref.fa': data})
+    root = tempfile.mkdtemp()
+    try:
+        cache = InputCache(root)
+        content1, inode1 = cached_download(server, cache, '/ref.fa')
+        content2, inode2 = cached_download(server, InputCache(root),
+                                           '/ref.fa')
+        eq_(content1, data)
+        eq_(content2, data)
+        eq_(inode1, inode2)
+        eq_(server.requests.count('/ref.fa'), 1)
+        stats = cache.stats()
+        eq_((stats['misses'], stats['entries'], stats['size']),
+            (1, 1, 5000))
+
+        server.files['/ref.fa'] = b'changed'
+        eq_(cached_download(server, cache, '/ref.fa')[0], b'changed')
+        eq_(server.requests.count('/ref.fa'), 2)
+    finally:
+        server.shutdown()
+        shutil.rmtree(root)
+
+
+def test_cache_deduplicates_concurrent_downloads():
+    server = Server({'/ref.fa': b'x' * 1000}, delay=0.1)
+    root = tempfile.mkdtemp()
+    try:
+        cache = InputCache(root)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(
+            cached_download(server, cache, '/ref.fa'))) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        eq_(len(results), 8)
+        eq_(server.requests.count('/ref.fa'), 1)
+        eq_(cache.stats()['hits'], 7)
+    finally:
+        server.shutdown()
+        shutil.rmtree(root)
+
+
+def test_cache_eviction():
+    server = Server({'/a': os.urandom(600 * 1024),
+                     '/b': os.urandom(600 * 1024)})
+    root = tempfile.mkdtemp()
+    try:
+        cache = InputCache(root, max_size=1)
+        cached_download(server, cache, '/a')
+        cached_download(server, cache, '/b')
+        stats = cache.stats()
+        eq_((stats['entries'], stats['evictions']), (1, 1))
+        cached_download(server, cache, '/a')
+        eq_(server.requests.count('/a'), 2)
+    finally:
+        server.shutdown()
+        shutil.rmtree(root)
+
+
+def test_meta_cached_per_url():
+    files = {'/ref.fa': b'ref', '/ref.fa.fai': b'fai',
+             '/ref.fa.meta': b'{"file_type": "fasta"}'}
+    server = Server(files)
+    tmp = tempfile.mkdtemp()
+    try:
+        for i in range(3):
+            job = {'inputs': {'reference': {'path': server.url('/ref.fa')}}}
+            inputs = {'reference': {'type': 'file', 'adapter': {
+                'secondaryFiles': ['*.fai']}}}
+            remaped = InputRunner(job, inputs, os.path.join(tmp, str(i)))()
+            eq_(remaped['inputs']['reference']['meta'],
+                {'file_type': 'fasta'})
+        eq_(server.requests.count('/ref.fa.meta'), 1)
+        eq_(server.requests.count('/ref.fa.fai.meta'), 1)
+        eq_(server.requests.count('/ref.fa'), 3)
+    finally:
+        server.shutdown()
+        shutil.rmtree(tmp)
+
+
+def test_meta_cache_keeps_recently_used():
+    cache, loads = MetaCache(size=2), []
+
+    def get(key):
+        return cache.get(key, lambda: loads.append(key) or (key, True))
+    for key in ('a', 'b', 'a', 'c', 'a', 'b'):
+        eq_(get(key), key)
+    eq_(loads, ['a', 'b', 'c', 'b'])
+
+
+def test_local_sidecar_read_once():
+    tmp = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp, 'reads.fq')
+        open(path, 'w').close()
+        with open(path + '.meta', 'w') as f:
+            f.write('{"sample": "s1"}')
+        job = {'inputs': {'reads': [{'path': path}] * 50}}
+        inputs = {'reads': {'type': 'array', 'items': {'type': 'file'}}}
+        loads = []
+        get = file_metas.get
+
+        def counting_get(key, load):
+            return get(key, lambda: loads.append(key) or load())
+        with mock.patch.object(file_metas, 'get', counting_get):
+            remaped = InputRunner(job, inputs, tmp)()
+        eq_(len(loads), 1)
+        eq_([r['meta'] for r in remaped['inputs']['reads']],
+            [{'sample': 's1'}] * 50)
+    finally:
+        shutil.rmtree(tmp)
+
+
+def stream_inputs():
+    return {'reads': {'type': 'array', 'items': {
+        'type': 'file', 'adapter': {'streamable': 'Yes'}}}}
+
+
+def test_streamable_input():
+    data = os.urandom(100000)
+    server = Server({'/r1.fq': data}, drops=2, drop_after=30000)
+    tmp = tempfile.mkdtemp()
+    try:
+        job = {'inputs': {'reads': [{'path': server.url('/r1.fq')}]}}
+        runner = InputRunner(job, stream_inputs(), tmp, chunk_size=1024,
+                             backoff=0)
+        path = runner()['inputs']['reads'][0]['path']
+        assert stat.S_ISFIFO(os.stat(path).st_mode)
+        with open(path, 'rb') as f:
+            eq_(f.read(), data)
+        runner.close()
+        eq_(os.listdir(tmp), ['r1.fq'])
+    finally:
+        server.shutdown()
+        shutil.rmtree(tmp)
+
+
+def test_stream_never_read():
+    server = Server({'/r1.fq': os.urandom(100000)})
+    tmp = tempfile.mkdtemp()
+    try:
+        job = {'inputs': {'reads': [{'path': server.url('/r1.fq')}]}}
+        runner = InputRunner(job, stream_inputs(), tmp)
+        path = runner()['inputs']['reads'][0]['path']
+        with open(path, 'rb') as f:
+            f.read(10)
+        runner.close()
+        runner = InputRunner(job, stream_inputs(), tmp)
+        runner()
+        runner.close()
+    finally:
+        server.shutdown()
+        shutil.rmtree(tmp)
+
+
+@raises(ResourceUnavailable)
+def test_stream_failure_reported():
+    server = Server({'/r1.fq': os.urandom(100000)}, drops=5,
+                    drop_after=1000)
+    tmp = tempfile.mkdtemp()
+    try:
+        job = {'inputs': {'reads': [{'path': server.url('/r1.fq')}]}}
+        runner = InputRunner(job, stream_inputs(), tmp, retries=1,
+                             backoff=0)
+        path = runner()['inputs']['reads'][0]['path']
+        with open(path, 'rb') as f:
+            f.read()
+        runner.close()
+    finally:
+        server.shutdown()
+        shutil.rmtree(tmp)
+
+
+def gzip_members(*parts):
+    return b''.join(gzip_bytes(p) for p in parts)
+
+
+def gzip_bytes(data):
+    buf = six.BytesIO()
+    f = gzip.GzipFile(fileobj=buf, mode='wb')
+    f.write(data)
+    f.close()
+    return buf.getvalue()
+
+
+def test_decompress_remote_input():
+    data = os.urandom(50000)
+    server = Server({'/r1.fq.gz': gzip_members(data[:20000], data[20000:])},
+                    drops=1, drop_after=5000)
+    tmp = tempfile.mkdtemp()
+    try:
+        job = {'inputs': {'reads': {'path': server.url('/r1.fq.gz')}}}
+        inputs = {'reads': {'type': 'file', 'adapter': {'decompress': True}}}
+        remaped = InputRunner(job, inputs, tmp, chunk_size=1024,
+                              backoff=0)()
+        path = remaped['inputs']['reads']['path']
+        eq_(path, os.path.join(tmp, 'r1.fq'))
+        with open(path, 'rb') as f:
+            eq_(f.read(), data)
+        eq_(os.listdir(tmp), ['r1.fq'])
+    finally:
+        server.shutdown()
+        shutil.rmtree(tmp)
+
+
+def test_decompress_local_input_streamed():
+    data = os.urandom(50000)
+    tmp = tempfile.mkdtemp()
+    try:
+        src = os.path.join(tmp, 'reads.fq.bz2')
+        with open(src, 'wb') as f:
+            f.write(bz2.compress(data))
+        job = {'inputs': {'reads': {'path': src}}}
+        inputs = {'reads': {'type': 'file', 'adapter': {
+            'decompress': 'auto', 'streamable': True}}}
+        task_dir = os.path.join(tmp, 'task')
+        runner = InputRunner(job, inputs, task_dir)
+        path = runner()['inputs']['reads']['path']
+        eq_(path, os.path.join(task_dir, 'reads.fq'))
+        assert stat.S_ISFIFO(os.stat(path).st_mode)
+        with open(path, 'rb') as f:
+            eq_(f.read(), data)
+        runner.close()
+    finally:
+        shutil.rmtree(tmp)
+
+
+@raises(ResourceUnavailable)
+def test_decompress_truncated_input():
+    tmp = tempfile.mkdtemp()
+    try:
+        src = os.path.join(tmp, 'reads.fq.gz')
+        with open(src, 'wb') as f:
+            f.write(gzip_bytes(os.urandom(50000))[:-100])
+        job = {'inputs': {'reads': {'path': src}}}
+        inputs = {'reads': {'type': 'file', 'adapter': {'decompress': True}}}
+        InputRunner(job, inputs, os.path.join(tmp, 'task'))()
+    finally:
+        shutil.rmtree(tmp)
+
+
+def test_decompress_members_split_anywhere():
+    for fmt, compress in (('gzip', gzip_bytes), ('bzip2', bz2.compress)):
+        first, second = compress(b'a' * 1000), compress(b'b' * 1000)
+        data = first + second
+        for split in (7, len(first) - 1, len(first), len(first) + 1):
+            d = compression.PyDecompressor(fmt)
+            eq_(d.decompress(data[:split]) + d.decompress(data[split:]),
+                b'a' * 1000 + b'b' * 1000)
+            assert not d.truncated, (fmt, split)
+        for cut in (1, len(second) - 1):
+            d = compression.PyDecompressor(fmt)
+            d.decompress(data[:-cut])
+            assert d.truncated, (fmt, cut)
+
+
+def test_decompressing_tool_stopped_on_abort():
+    with tempfile.TemporaryFile() as fp:
+        with mock.patch.object(compression, 'command',
+                               return_value=['sleep', '60']):
+            writer = compression.DecompressingWriter(fp, 'gzip')
+        writer.write(b'x')
+        writer.abort()
+        assert writer.proc.returncode is not None
@@ -0,0 +1,292 @@
+import os
+import time
+import json
+import stat
+import shutil
+import tempfile
+import threading
+
+from nose.tools import eq_, raises
+
+from rabix.common.errors import RabixError, ValidationError
+from rabix.executors.history import RuntimeHistory
+from rabix.executors.pipeline import Pipeline, PipelineRunner
+from rabix.executors.runner import NativeRunner
+from rabix.executors.scheduler import LocalScheduler
+from rabix.tests.test_runner import make_cat_tool
+
+
+def cat_many_tool():
+    tool = make_cat_tool()
+    tool['inputs']['properties']['inp'] = {
+        'type': 'array', 'items': {'type': 'file'}, 'adapter': {'order': 1}}
+    return tool
+
+
+def make_pipeline(tool=None, join_tool=None):
+    return {
+        '$$type': 'app/pipeline',
+        'steps': [
+            {'id': 'a', 'app': tool or make_cat_tool(),
+             'inputs': {'inp': 'first'}},
+            {'id': 'b', 'app': tool or make_cat_tool(),
+             'inputs': {'inp': 'second'}},
+            {'id': 'join', 'app': join_tool or cat_many_tool(),
+             'inputs': {'inp': ['a.out', 'b.out']},
+             'outputs': {'out': 'joined'}},
+        ]
+    }
+
+
+def test_graph():
+    pipeline = Pipeline(make_pipeline())
+    eq_(pipeline.ready({}), ['a', 'b'])
+    eq_(pipeline.ready({'a': {}}, ['a', 'b']), [])
+    eq_(pipeline.ready({'a': {}, 'b': {}}, ['a', 'b']), ['join'])
+    eq_(sorted(pipeline.inputs['properties']), ['first', 'second'])
+
+
+@raises(ValidationError)
+def test_cycle():
+    doc = make_pipeline()
+    doc['steps'][0]['inputs']['inp'] = 'join.out'
+    Pipeline(doc)
+
+
+def test_app_refs():
+    doc = make_pipeline()
+    doc['apps'] = {'cat': doc['steps'][0]['app']}
+    doc['steps'][0]['app'] = doc['steps'][1]['app'] = 'cat'
+    pipeline = Pipeline(doc)
+    eq_(pipeline.tool('a'), doc['apps']['cat'])
+    eq_(pipeline.ready({}), ['a', 'b'])
+
+
+@raises(ValidationError)
+def test_unknown_app_ref():
+    doc = make_pipeline()
+    doc['steps'][0]['app'] = 'missing'
+    Pipeline(doc)
+
+
+def test_run_native():
+    tmp = tempfile.mkdtemp()
+    try:
+        inputs = {}
+        for name in ('first', 'second'):
+            inputs[name] = {'path': os.path.join(tmp, name + '.txt')}
+            with open(inputs[name]['path'], 'w') as f:
+                f.write(name + '\n')
+        run_dir = os.path.join(tmp, 'run')
+
+        outputs = PipelineRunner(make_pipeline(), NativeRunner).run_job(
+            {'inputs': inputs}, job_id=run_dir)
+
+        eq_(outputs['joined']['path'], os.path.join(run_dir, 'join',
+                                                    'out.txt'))
+        with open(outputs['joined']['path']) as f:
+            eq_(f.read(), 'first\nsecond\n')
+        with open(os.path.join(run_dir, 'result.json')) as f:
+            eq_(json.load(f), outputs)
+    finally:
+        shutil.rmtree(tmp)
+
+
+class FakeRunner(object):
+    lock = threading.Lock()
+    running = 0
+    peak = 0
+    jobs = []
+
+    def __init__(self, tool):
+        self.tool = tool
+
+    def run_job(self, job, job_id=None):
+        cls = FakeRunner
+        with cls.lock:
+            cls.jobs.append((os.path.basename(job_id), job['inputs']))
+            cls.running += 1
+            cls.peak = max(cls.peak, cls.running)
+        time.sleep(0.1)
+        with cls.lock:
+            cls.running -= 1
+        if self.tool.get('fail'):
+            raise RuntimeError('failed')
+        return {'out': {'path': os.path.basename(job_id)}}
+
+
+def run_fake(doc):
+    FakeRunner.jobs, FakeRunner.peak = [], 0
+    tmp = tempfile.mkdtemp()
+    scheduler = LocalScheduler(
+        capacity={'cpu': 4, 'mem': 10000, 'diskSpace': 1000}, workers=4)
+    try:
+        return PipelineRunner(doc, FakeRunner, scheduler).run_job(
+            {'inputs': {'first': 1, 'second': 2}},
+            job_id=os.path.join(tmp, 'run'))
+    finally:
+        scheduler.shutdown()
+        shutil.rmtree(tmp)
+
+
+def test_independent_steps_concurrent():
+    outputs = run_fake(make_pipeline({}, {}))
+    eq_(outputs, {'joined': {'path': 'join'}})
+    eq_(FakeRunner.peak, 2)
+    eq_(sorted(FakeRunner.jobs[:2]), [('a', {'inp': 1}), ('b', {'inp': 2})])
+    eq_(FakeRunner.jobs[2], ('join', {'inp': [{'path': 'a'},
+                                              {'path': 'b'}]}))
+
+
+@raises(RabixError)
+def test_failed_step_stops_downstream():
+    try:
+        run_fake(make_pipeline({'fail': True}, {}))
+    finally:
+        eq_(sorted(name for name, _ in FakeRunner.jobs), ['a', 'b'])
+
+
+class FileRunner(FakeRunner):
+    def run_job(self, job, job_id=None):
+        FakeRunner.run_job(self, job, job_id)
+        open(job_id, 'w').close()
+        return {'out': {'path': job_id}}
+
+
+def test_resume():
+    FakeRunner.jobs = []
+    tmp = tempfile.mkdtemp()
+    try:
+        run_dir = os.path.join(tmp, 'run')
+        doc = make_pipeline({}, {})
+        PipelineRunner(doc, FileRunner).run_job(
+            {'inputs': {'first': 1, 'second': 2}}, job_id=run_dir)
+        journal = os.path.join(run_dir, 'journal.jsonl')
+        with open(journal) as f:
+            lines = f.readlines()
+        with open(journal, 'w') as f:
+            f.writelines(lines[:-1] + [lines[-1][:10]])
+        os.remove(os.path.join(run_dir, 'a'))
+
+        FakeRunner.jobs = []
+        outputs = PipelineRunner(doc, FileRunner).run_job(
+            None, job_id=run_dir, resume=True)
+        eq_(outputs, {'joined': {'path': os.path.join(run_dir, 'join')}})
+        eq_(FakeRunner.jobs, [('a', {'inp': 1}),
+                              ('join', {'inp': [
+                                  {'path': os.path.join(run_dir, 'a')},
+                                  {'path': os.path.join(run_dir, 'b')}]})])
+    finally:
+        shutil.rmtree(tmp)
+
+
+@raises(RabixError)
+def test_resume_missing_run():
+    PipelineRunner(make_pipeline({}, {}), FakeRunner).run_job(
+        None, job_id=tempfile.mktemp(), resume=True)
+
+
+def upper_tool(extra_args=()):
+    tool = make_cat_tool()
+    tool['adapter']['baseCmd'] = ['tr'] + list(extra_args) + ['a-z', 'A-Z']
+    tool['inputs']['properties']['inp']['adapter'] = {'stdin': True}
+    return tool
+
+
+def piped_pipeline(producer, consumer):
+    return {
+        '$$type': 'app/pipeline',
+        'steps': [
+            {'id': 'produce', 'app': producer, 'inputs': {'inp': 'first'}},
+            {'id': 'consume', 'app': consumer,
+             'inputs': {'inp': 'produce.out'}, 'pipe': ['inp'],
+             'outputs': {'out': 'result'}},
+        ]
+    }
+
+
+def run_piped(doc, data='piped\n'):
+    tmp = tempfile.mkdtemp()
+    try:
+        inp = os.path.join(tmp, 'in.txt')
+        with open(inp, 'w') as f:
+            f.write(data)
+        run_dir = os.path.join(tmp, 'run')
+        outputs = PipelineRunner(doc, NativeRunner).run_job(
+            {'inputs': {'first': {'path': inp}}}, job_id=run_dir)
+        assert stat.S_ISFIFO(os.stat(
+            os.path.join(run_dir, 'produce', 'out.txt')).st_mode)
+        with open(outputs['result']['path']) as f:
+            return f.read()
+    finally:
+        shutil.rmtree(tmp)
+
+
+def test_piped_steps():
+    doc = piped_pipeline(make_cat_tool(), upper_tool())
+    eq_(Pipeline(doc).groups['consume'], ('produce', 'consume'))
+    eq_(Pipeline(doc).ready({}), ['produce', 'consume'])
+    eq_(run_piped(doc, 'x' * 1000000), 'X' * 1000000)
+
+
+@raises(RabixError)
+def test_piped_producer_fails():
+    run_piped(piped_pipeline(make_cat_tool(['--no-such-option']),
+                             upper_tool()))
+
+
+@raises(RabixError)
+def test_piped_consumer_fails():
+    run_piped(piped_pipeline(make_cat_tool(),
+                             upper_tool(['--no-such-option'])),
+              'x' * 1000000)
+
+
+@raises(ValidationError)
+def test_only_stdout_piped():
+    producer = make_cat_tool()
+    producer['adapter']['stdout'] = 'other.txt'
+    Pipeline(piped_pipeline(producer, upper_tool()))
+
+
+@raises(ValidationError)
+def test_unpiped_output_of_piped_step():
+    doc = piped_pipeline(make_cat_tool(), upper_tool())
+    doc['steps'][1]['inputs']['log'] = 'produce.log'
+    Pipeline(doc)
+
+
+def test_critical_path_first():
+    FakeRunner.jobs = []
+    tmp = tempfile.mkdtemp()
+    scheduler = LocalScheduler(
+        capacity={'cpu': 1, 'mem': 10000, 'diskSpace': 1000}, workers=1)
+    history = RuntimeHistory(os.path.join(tmp, 'history.json'), default=1)
+    history.record({'name': 'slow'}, 100)
+    doc = {
+        '$$type': 'app/pipeline',
+        'steps': [
+            {'id': 'short', 'app': {'name': 'fast'},
+             'inputs': {'inp': 'first'}},
+            {'id': 'long', 'app': {'name': 'slow'},
+             'inputs': {'inp': 'second'}},
+            {'id': 'after', 'app': {'name': 'fast'},
+             'inputs': {'inp': 'long.out'}},
+        ]
+    }
+    try:
+        run_dir = os.path.join(tmp, 'run')
+        PipelineRunner(doc, FakeRunner, scheduler, history=history).run_job(
+            {'inputs': {'first': 1, 'second': 2}}, job_id=run_dir)
+        eq_([name for name, _ in FakeRunner.jobs],
+            ['long', 'short', 'after'])
+        with open(os.path.join(run_dir, 'stats.json')) as f:
+            stats = json.load(f)
+        eq_(stats['predicted_makespan'], 101)
+        eq_(stats['steps']['long']['priority'], 101)
+        assert stats['steps']['short']['actual'] >= 0.1
+        eq_(RuntimeHistory(history.path).records[
+            history.key({'name': 'fast'})]['count'], 2)
+    finally:
+        scheduler.shutdown()
+        shutil.rmtree(tmp)
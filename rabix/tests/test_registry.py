@@ -0,0 +1,116 @@
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import threading
+
+from nose.tools import eq_
+
+from rabix.common.errors import JobCancelled
+from rabix.executors.registry import JobRegistry, jobs_main, open_registry
+from rabix.executors.runner import CommandFailed, NativeRunner
+from rabix.executors.scheduler import cancel_all
+from rabix.tests.test_runner import make_cat_tool, make_tool
+
+
+def run(registry, tool, job_dir, inp):
+    NativeRunner(tool, registry=registry).run_job(
+        {'inputs': {'inp': {'path': inp}}}, job_id=job_dir)
+
+
+def test_runner_records_jobs():
+    tmp = tempfile.mkdtemp()
+    try:
+        inp = os.path.join(tmp, 'in.txt')
+        with open(inp, 'w') as f:
+            f.write('hello')
+        registry = JobRegistry(os.path.join(tmp, 'jobs.db'))
+        run(registry, make_cat_tool(), os.path.join(tmp, 'ok'), inp)
+        try:
+            run(registry, make_cat_tool(['--no-such-option']),
+                os.path.join(tmp, 'bad'), inp)
+        except CommandFailed:
+            pass
+
+        ok = registry.get(os.path.join(tmp, 'ok'))
+        eq_(ok['status'], 'finished')
+        eq_(ok['tool_name'], 'cat')
+        eq_(ok['inputs'], {'inp': {'path': inp}})
+        eq_(ok['outputs']['out']['path'], os.path.join(tmp, 'ok', 'out.txt'))
+        assert ok['finished'] >= ok['started']
+
+        bad = registry.find(status='failed')
+        eq_([j['job_id'] for j in bad], [os.path.join(tmp, 'bad')])
+        eq_(bad[0]['exit_code'], 1)
+        assert bad[0]['error']
+
+        eq_(registry.find(tool='cat'), [ok])
+        eq_(registry.find(tool=ok['tool'][:8]), [ok])
+        eq_(sorted(tuple(r) for r in registry.counts()),
+            [('cat', 'finished', 1), ('cat --no-such-option', 'failed', 1)])
+    finally:
+        shutil.rmtree(tmp)
+
+
+def test_jobs_command():
+    tmp = tempfile.mkdtemp()
+    try:
+        registry = JobRegistry(os.path.join(tmp, 'jobs.db'))
+        registry.start('job1', make_cat_tool(), {'inputs': {'inp': 1}})
+        registry.finish('job1', 'failed', exit_code=2, error='boom')
+        out = os.path.join(tmp, 'out.txt')
+        stdout = sys.stdout
+        with open(out, 'w') as sys.stdout:
+            try:
+                jobs_main(['jobs', '--registry', registry.path,
+                           '--status', 'failed', '--json'])
+            finally:
+                sys.stdout = stdout
+        with open(out) as f:
+            job = json.loads(f.read())
+        eq_((job['job_id'], job['exit_code'], job['error']),
+            ('job1', 2, 'boom'))
+    finally:
+        shutil.rmtree(tmp)
+
+
+def test_cancelled_job_recorded():
+    tmp = tempfile.mkdtemp()
+    try:
+        registry = JobRegistry(os.path.join(tmp, 'jobs.db'))
+        tool = make_tool({})
+        tool['adapter'] = {'baseCmd': ['sleep', '30'], 'stdout': 'out.txt'}
+        job_dir = os.path.join(tmp, 'job')
+
+        def cancelled():
+            try:
+                NativeRunner(tool, registry=registry).run_job(
+                    {'inputs': {}}, job_id=job_dir)
+            except JobCancelled:
+                pass
+        thread = threading.Thread(target=cancelled)
+        thread.start()
+        time.sleep(0.5)
+        cancel_all()
+        thread.join(5)
+        eq_(registry.get(job_dir)['status'], 'cancelled')
+    finally:
+        shutil.rmtree(tmp)
+
+
+def test_registry_errors_do_not_fail_jobs():
+    tmp = tempfile.mkdtemp()
+    try:
+        inp = os.path.join(tmp, 'in.txt')
+        with open(inp, 'w') as f:
+            f.write('hello')
+        registry = JobRegistry(os.path.join(tmp, 'jobs.db'))
+        db = registry._db()
+        db.execute('DROP TABLE jobs')
+        run(registry, make_cat_tool(), os.path.join(tmp, 'ok'), inp)
+        assert os.path.exists(os.path.join(tmp, 'ok', 'out.txt'))
+        eq_(open_registry(os.path.join(tmp, 'missing', 'jobs.db')), None)
+    finally:
+        shutil.rmtree(tmp)
@@ -0,0 +1,262 @@
+import os
+import gzip
+import json
+import time
+import mock
+import shutil
+import tempfile
+import threading
+
+from nose.tools import eq_, raises
+
+from rabix.common.errors import JobCancelled
+from rabix.executors.io import MANIFEST, Manifest
+from rabix.executors.runner import DockerRunner, NativeRunner, coalesce_dirs
+
+
+def make_tool(inputs):
+    return {
+        'requirements': {
+            'environment': {
+                'container': {'type': 'docker', 'uri': 'docker:x#latest',
+                              'imageId': 'x'}
+            }
+        },
+        'inputs': {'type': 'object', 'properties': inputs},
+        'outputs': {},
+        'adapter': {'baseCmd': ['cat']}
+    }
+
+
+def test_coalesce_dirs():
+    eq_(coalesce_dirs(['/a/b/c', '/a/b', '/a/b-x', '/a/b', '/d']),
+        ['/a/b', '/a/b-x', '/d'])
+
+
+def test_volumes_coalesce_10k_files():
+    tool = make_tool({
+        'reads': {'type': 'array', 'items': {'type': 'file'}},
+        'reference': {'type': 'file'},
+        'index': {'type': 'file'},
+    })
+    reads = [{'path': '/data/shards/shard_%05d.fq' % i}
+             for i in range(10000)]
+    job = {'inputs': {
+        'reads': reads,
+        'reference': {'path': '/refs/hg19/hg19.fa'},
+        'index': {'path': '/refs/hg19/bwa/hg19.fa.bwt'},
+    }}
+    runner = DockerRunner(tool, dockr=mock.Mock())
+
+    volumes, binds, remaped = runner._volumes(job, 'job1')
+
+    eq_(len(volumes), 3)
+    eq_(sorted(dict(binds).values()),
+        sorted([os.path.abspath('job1'), '/data/shards', '/refs/hg19']))
+    host_to_bind = dict(binds.items())
+    eq_(host_to_bind[os.path.abspath('job1')], '/rabix-job/job1')
+    assert host_to_bind['/data/shards']['ro']
+    assert host_to_bind['/refs/hg19']['ro']
+
+    reads_dir = host_to_bind['/data/shards']['bind']
+    refs_dir = host_to_bind['/refs/hg19']['bind']
+    eq_(remaped['inputs']['reads'][1234]['path'],
+        reads_dir + '/shard_01234.fq')
+    eq_(remaped['inputs']['reference']['path'], refs_dir + '/hg19.fa')
+    eq_(remaped['inputs']['index']['path'], refs_dir + '/bwa/hg19.fa.bwt')
+    eq_(job['inputs']['reads'][0]['path'], '/data/shards/shard_00000.fq')
+
+
+def test_volumes_inputs_in_job_dir():
+    tool = make_tool({'inp': {'type': 'file'}})
+    job_dir = os.path.abspath('job2')
+    job = {'inputs': {'inp': {'path': os.path.join(job_dir, 'a.txt')}}}
+    runner = DockerRunner(tool, dockr=mock.Mock())
+
+    volumes, binds, remaped = runner._volumes(job, 'job2')
+
+    eq_(list(volumes), ['/rabix-job/job2'])
+    eq_(remaped['inputs']['inp']['path'], '/rabix-job/job2/a.txt')
+
+
+def test_volumes_job_named_like_system_dir():
+    runner = DockerRunner(make_tool({}), dockr=mock.Mock())
+
+    volumes, binds, remaped = runner._volumes({'inputs': {}}, 'tmp')
+
+    eq_(list(volumes), ['/rabix-job/tmp'])
+
+
+def make_cat_tool(extra_args=()):
+    tool = make_tool({'inp': {'type': 'file', 'adapter': {'order': 1}}})
+    tool['adapter'] = {'baseCmd': ['cat'] + list(extra_args),
+                       'stdout': 'out.txt'}
+    tool['outputs'] = {'type': 'object', 'properties': {
+        'out': {'type': 'file', 'adapter': {
+            'glob': 'out.txt', 'meta': {'file_type': 'text'}}}}}
+    return tool
+
+
+def test_native_runner():
+    tmp = tempfile.mkdtemp()
+    try:
+        inp = os.path.join(tmp, 'in.txt')
+        with open(inp, 'w') as f:
+            f.write('hello')
+        job_dir = os.path.join(tmp, 'job')
+        job = {'inputs': {'inp': {'path': inp}},
+               'allocatedResources': {'cpu': 1, 'mem': 1024}}
+
+        outputs = NativeRunner(make_cat_tool(), sidecars=True).run_job(
+            job, job_id=job_dir)
+
+        eq_(outputs['out']['path'], os.path.join(job_dir, 'out.txt'))
+        with open(outputs['out']['path']) as f:
+            eq_(f.read(), 'hello')
+        with open(outputs['out']['path'] + '.meta') as f:
+            eq_(json.load(f), {'file_type': 'text'})
+        with open(os.path.join(job_dir, 'result.json')) as f:
+            eq_(json.load(f), outputs)
+    finally:
+        shutil.rmtree(tmp)
+
+
+@raises(RuntimeError)
+def test_native_runner_fail():
+    tmp = tempfile.mkdtemp()
+    try:
+        inp = os.path.join(tmp, 'in.txt')
+        open(inp, 'w').close()
+        job = {'inputs': {'inp': {'path': inp}}}
+        NativeRunner(make_cat_tool(['--no-such-option'])).run_job(
+            job, job_id=os.path.join(tmp, 'job'))
+    finally:
+        shutil.rmtree(tmp)
+
+
+def test_native_runner_scratch():
+    tmp = tempfile.mkdtemp()
+    try:
+        scratch = os.path.join(tmp, 'scratch')
+        os.mkdir(scratch)
+        tool = make_tool({})
+        tool['adapter'] = {'baseCmd': ['pwd'], 'stdout': 'out.txt'}
+        tool['outputs'] = {'type': 'object', 'properties': {
+            'out': {'type': 'file', 'adapter': {'glob': 'out.txt'}}}}
+        job_dir = os.path.join(tmp, 'job')
+        job = {'inputs': {}, 'allocatedResources': {'diskSpace': 1}}
+
+        outputs = NativeRunner(tool, scratch=scratch).run_job(
+            job, job_id=job_dir)
+
+        eq_(outputs['out']['path'], os.path.join(job_dir, 'out.txt'))
+        with open(outputs['out']['path']) as f:
+            run_dir = f.read().strip()
+        assert run_dir.startswith(scratch + '/')
+        eq_(os.path.basename(run_dir), 'job')
+        eq_(sorted(os.listdir(job_dir)),
+            ['manifest.jsonl', 'out.err', 'out.txt', 'result.json',
+             'timing.json'])
+        eq_(os.listdir(scratch), [])
+    finally:
+        shutil.rmtree(tmp)
+
+
+def test_native_runner_streamed_input():
+    from rabix.tests.test_io import Server
+    server = Server({'/in.txt': b'streamed'})
+    tmp = tempfile.mkdtemp()
+    try:
+        tool = make_cat_tool()
+        tool['inputs']['properties']['inp']['adapter']['streamable'] = True
+        job = {'inputs': {'inp': {'path': server.url('/in.txt')}}}
+        outputs = NativeRunner(tool).run_job(
+            job, job_id=os.path.join(tmp, 'job'))
+        with open(outputs['out']['path']) as f:
+            eq_(f.read(), 'streamed')
+    finally:
+        server.shutdown()
+        shutil.rmtree(tmp)
+
+
+def test_native_runner_compress_output():
+    tmp = tempfile.mkdtemp()
+    try:
+        inp = os.path.join(tmp, 'in.txt')
+        with open(inp, 'w') as f:
+            f.write('hello' * 1000)
+        tool = make_cat_tool()
+        tool['outputs']['properties']['out']['adapter']['compress'] = 'gzip'
+        job = {'inputs': {'inp': {'path': inp}}}
+        job_dir = os.path.join(tmp, 'job')
+        outputs = NativeRunner(tool).run_job(job, job_id=job_dir)
+        eq_(outputs['out']['path'], os.path.join(job_dir, 'out.txt.gz'))
+        with gzip.open(outputs['out']['path']) as f:
+            eq_(f.read(), b'hello' * 1000)
+        assert not os.path.exists(os.path.join(job_dir, 'out.txt'))
+        eq_(Manifest.find(outputs['out']['path']).get(
+            outputs['out']['path']), {'file_type': 'text'})
+    finally:
+        shutil.rmtree(tmp)
+
+
+def test_manifest_feeds_downstream_job():
+    tmp = tempfile.mkdtemp()
+    try:
+        inp = os.path.join(tmp, 'in.txt')
+        with open(inp, 'w') as f:
+            f.write('hello')
+        first = os.path.join(tmp, 'first')
+        outputs = NativeRunner(make_cat_tool()).run_job(
+            {'inputs': {'inp': {'path': inp}}}, job_id=first)
+        assert not os.path.exists(outputs['out']['path'] + '.meta')
+        with open(os.path.join(first, MANIFEST)) as f:
+            eq_([json.loads(line) for line in f],
+                [{'path': 'out.txt', 'meta': {'file_type': 'text'}}])
+
+        runner = NativeRunner(make_cat_tool())
+        job = {'inputs': {'inp': outputs['out']}}
+        remaped = runner.provide_files(job, os.path.join(tmp, 'second'))
+        eq_(remaped['inputs']['inp']['meta'], {'file_type': 'text'})
+    finally:
+        shutil.rmtree(tmp)
+
+
+def test_native_runner_cancel():
+    tmp = tempfile.mkdtemp()
+    try:
+        tool = make_tool({})
+        tool['adapter'] = {'baseCmd': ['sleep', '30'], 'stdout': 'out.txt'}
+        runner = NativeRunner(tool)
+        job_dir = os.path.join(tmp, 'job')
+        errors = []
+
+        def run():
+            try:
+                runner.run_job({'inputs': {}}, job_id=job_dir)
+            except JobCancelled as e:
+                errors.append(e)
+        thread = threading.Thread(target=run)
+        thread.start()
+        time.sleep(0.5)
+        runner.cancel(job_dir)
+        thread.join(5)
+
+        assert not thread.is_alive()
+        eq_(errors[0].job_id, job_dir)
+    finally:
+        shutil.rmtree(tmp)
+
+
+def test_image_pulled_while_staging():
+    runner = NativeRunner(make_cat_tool())
+    runner.install = lambda: time.sleep(0.3)
+
+    def stage():
+        time.sleep(0.3)
+        return {'inputs': {}}
+    timing = {}
+
+    eq_(runner._prepare(stage, timing), {'inputs': {}})
+    assert timing['prepare'] < 0.5
+    assert timing['saved'] > 0.1
@@ -0,0 +1,106 @@
+import os
+import json
+import time
+import shutil
+import tempfile
+import threading
+
+from nose.tools import eq_, raises
+
+from rabix.common.errors import JobCancelled, ValidationError
+from rabix.executors.runner import NativeRunner
+from rabix.executors.scatter import ScatterRunner, scatter_jobs
+from rabix.tests.test_pipeline import FakeRunner
+from rabix.tests.test_runner import make_cat_tool
+
+
+def test_dot_and_cross():
+    job = {'inputs': {'a': [1, 2], 'b': ['x', 'y'], 'c': 0}}
+    eq_([(j['inputs']['a'], j['inputs']['b']) for j in
+         scatter_jobs(job, ['a', 'b'])], [(1, 'x'), (2, 'y')])
+    eq_([(j['inputs']['a'], j['inputs']['b']) for j in
+         scatter_jobs(job, ['a', 'b'], 'cross')],
+        [(1, 'x'), (1, 'y'), (2, 'x'), (2, 'y')])
+    eq_(job['inputs']['a'], [1, 2])
+
+
+@raises(ValidationError)
+def test_dot_length_mismatch():
+    scatter_jobs({'inputs': {'a': [1, 2], 'b': [1]}}, ['a', 'b'])
+
+
+def test_gathers_in_input_order():
+    tmp = tempfile.mkdtemp()
+    try:
+        tool = make_cat_tool()
+        files = []
+        for i in range(5):
+            files.append({'path': os.path.join(tmp, 'in%s' % i)})
+            with open(files[-1]['path'], 'w') as f:
+                f.write(str(i))
+        run_dir = os.path.join(tmp, 'run')
+        runner = ScatterRunner(tool, NativeRunner, ['inp'], parallel=2)
+        eq_(runner.inputs['properties']['inp']['items']['type'], 'file')
+
+        outputs = runner.run_job({'inputs': {'inp': files}}, job_id=run_dir)
+
+        eq_([o['path'] for o in outputs['out']],
+            [os.path.join(run_dir, str(i), 'out.txt') for i in range(5)])
+        for i, out in enumerate(outputs['out']):
+            with open(out['path']) as f:
+                eq_(f.read(), str(i))
+        with open(os.path.join(run_dir, 'result.json')) as f:
+            eq_(json.load(f), outputs)
+    finally:
+        shutil.rmtree(tmp)
+
+
+def test_concurrency_limit():
+    FakeRunner.peak = 0
+    tmp = tempfile.mkdtemp()
+    try:
+        runner = ScatterRunner({}, FakeRunner, ['a'], parallel=3)
+        outputs = runner.run_job({'inputs': {'a': list(range(9))}},
+                                 job_id=os.path.join(tmp, 'run'))
+        eq_(outputs, {'out': [{'path': str(i)} for i in range(9)]})
+        eq_(FakeRunner.peak, 3)
+    finally:
+        shutil.rmtree(tmp)
+
+
+class StragglerRunner(object):
+    def __init__(self, tool):
+        self.tool = tool
+        self.cancelled = {}
+
+    def run_job(self, job, job_id=None):
+        event = self.cancelled.setdefault(job_id, threading.Event())
+        slow = job['inputs']['a'] == 3 and not job_id.endswith('.spec')
+        os.mkdir(job_id)
+        if event.wait(10 if slow else 0.05):
+            raise JobCancelled(job_id)
+        return {'out': {'path': job_id}}
+
+    def cancel(self, job_id):
+        self.cancelled.setdefault(job_id, threading.Event()).set()
+
+
+def test_speculative_straggler():
+    tmp = tempfile.mkdtemp()
+    try:
+        run_dir = os.path.join(tmp, 'run')
+        runner = ScatterRunner({}, StragglerRunner, ['a'], straggler=3,
+                               speculate=True, poll=0.05)
+        start = time.time()
+        outputs = runner.run_job({'inputs': {'a': list(range(5))}},
+                                 job_id=run_dir)
+
+        assert time.time() - start < 5
+        eq_(outputs['out'][3], {'path': os.path.join(run_dir, '3.spec')})
+        assert not os.path.exists(os.path.join(run_dir, '3'))
+        with open(os.path.join(run_dir, 'stats.json')) as f:
+            shards = json.load(f)['shards']
+        eq_([s['straggler'] for s in shards], [False] * 3 + [True, False])
+        eq_(shards[3]['speculative'], 'won')
+    finally:
+        shutil.rmtree(tmp)
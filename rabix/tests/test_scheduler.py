@@ -0,0 +1,108 @@
+import time
+import threading
+
+from nose.tools import eq_, raises
+
+from rabix.common.errors import JobCancelled
+from rabix.executors.scheduler import LocalScheduler
+
+
+class FakeRunner(object):
+    tool = {}
+
+    def __init__(self, duration=0.05, fail=False):
+        self.duration = duration
+        self.fail = fail
+        self.lock = threading.Lock()
+        self.running = 0
+        self.peak = 0
+
+    def run_job(self, job, job_id=None):
+        with self.lock:
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+        time.sleep(self.duration)
+        with self.lock:
+            self.running -= 1
+        if self.fail:
+            raise RuntimeError('failed %s' % job_id)
+        return {'id': job_id}
+
+
+def job(cpu, mem=1000):
+    return {'inputs': {}, 'allocatedResources': {'cpu': cpu, 'mem': mem}}
+
+
+def test_packs_jobs_by_capacity():
+    runner = FakeRunner()
+    scheduler = LocalScheduler(
+        capacity={'cpu': 4, 'mem': 10000, 'diskSpace': 1000}, workers=8)
+    tasks = [scheduler.submit(runner, job(2), job_id=i) for i in range(6)]
+    scheduler.shutdown()
+
+    eq_([t.wait() for t in tasks], [{'id': i} for i in range(6)])
+    eq_(runner.peak, 2)
+    stats = scheduler.stats()
+    eq_(stats['queued'], 0)
+    eq_(stats['finished'], 6)
+    eq_(stats['utilization']['cpu'], 0.0)
+    assert stats['wait_time']['max'] >= 0.05
+
+
+def test_overcommit():
+    runner = FakeRunner()
+    scheduler = LocalScheduler(
+        capacity={'cpu': 2, 'mem': 10000, 'diskSpace': 1000},
+        overcommit=2.0)
+    for i in range(8):
+        scheduler.submit(runner, job(1), job_id=i)
+    scheduler.shutdown()
+    eq_(runner.peak, 4)
+
+
+def test_oversized_job_runs_alone():
+    runner = FakeRunner()
+    scheduler = LocalScheduler(
+        capacity={'cpu': 2, 'mem': 10000, 'diskSpace': 1000}, workers=4)
+    big = scheduler.submit(runner, job(16), job_id='big')
+    small = scheduler.submit(runner, job(1), job_id='small')
+    scheduler.shutdown()
+    eq_(big.wait(), {'id': 'big'})
+    assert small.started >= big.finished
+
+
+@raises(RuntimeError)
+def test_failed_job():
+    scheduler = LocalScheduler(
+        capacity={'cpu': 2, 'mem': 10000, 'diskSpace': 1000})
+    task = scheduler.submit(FakeRunner(fail=True), job(1))
+    scheduler.shutdown()
+    task.wait()
+
+
+def test_priority():
+    runner = FakeRunner()
+    scheduler = LocalScheduler(
+        capacity={'cpu': 1, 'mem': 10000, 'diskSpace': 1000}, workers=1)
+    scheduler.submit(runner, job(1), job_id='first')
+    low = scheduler.submit(runner, job(1), job_id='low')
+    high = scheduler.submit(runner, job(1), job_id='high', priority=5)
+    scheduler.shutdown()
+    assert high.started < low.started
+
+
+def test_cancel_all():
+    runner = FakeRunner(duration=0.5)
+    scheduler = LocalScheduler(
+        capacity={'cpu': 1, 'mem': 10000, 'diskSpace': 1000}, workers=2)
+    running = scheduler.submit(runner, job(1), job_id='running')
+    queued = scheduler.submit(runner, job(1), job_id='queued')
+    time.sleep(0.1)
+    scheduler.cancel_all()
+
+    eq_(scheduler.used['cpu'], 0)
+    assert queued.done()
+    assert isinstance(queued.error, JobCancelled)
+    scheduler.shutdown()
+    eq_(running.wait(), {'id': 'running'})
+    eq_(scheduler.used['cpu'], 0)
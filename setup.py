@@ -19,7 +19,9 @@ setup(
     packages=find_packages(),
     entry_points={
         'console_scripts': ['rabix = rabix.executors.cli:main',
-                            'rabix-tools = rabix.tools.cli:main'],
+                            'rabix-tools = rabix.tools.cli:main',
+                            'rabix-worker = '
+                            'rabix.executors.distributed:worker_main'],
     },
     install_requires=requires,
     package_data={'rabix': ['models/schema/*.json', 'cliche/expressions/evaluators/*.expr-plugin']},